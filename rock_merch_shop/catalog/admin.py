@@ -1,20 +1,233 @@
+"""
+Admin of the catalog, tuned for large item tables.
+
+The item changelist joins the category and band of its rows in its query, searches through the catalog search index
+(item, band and category names) instead of LIKE scans, unless the index is empty or a search matches more than
+SEARCH_LIMIT items, and shows an estimated count, read from the database statistics, when the table is unfiltered and
+large. Merchandisers can feature, unfeature, re-price and re-categorize any number of items at once, each with a
+single UPDATE statement, and export them as a CSV file that is streamed to the browser in bounded memory (in the
+format `python manage.py catalog_data import --format csv --model item` reads).
+"""
+from decimal import Decimal
+
+from django import forms
 from django.contrib import admin
+from django.contrib.admin import helpers
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Least, Round
+from django.template.response import TemplateResponse
+from django.utils.functional import cached_property
+
+from . import cache, exports, search
+from .management.commands.catalog_data import COLUMNS
 from .models import Band, Category, Item
 
-# Register your models here.
+# Item fields exported by the CSV action, in the order of the catalog_data item columns.
+EXPORT_FIELDS = ('id', 'name', 'description', 'price', 'category__name', 'band__name', 'image', 'is_featured')
+
+# Highest price the Item.price column holds (e.g. 9999.99 for 6 digits with 2 decimal places).
+PRICE_DIGITS, PRICE_DECIMALS = Item._meta.get_field('price').max_digits, Item._meta.get_field('price').decimal_places
+MAX_PRICE = Decimal(10) ** (PRICE_DIGITS - PRICE_DECIMALS) - Decimal(10) ** -PRICE_DECIMALS
+
+# Most items a changelist search reads from the search index; broader searches use the search_fields query instead.
+SEARCH_LIMIT = 5000
+
+# Items re-indexed per batch after a bulk re-categorization.
+REINDEX_BATCH_SIZE = 1000
+
+
+def estimated_row_count(model, using):
+    """
+    Returns the row count of a model's table as estimated by the database statistics, without scanning the table.
 
-# Registers the Band model with the default ModelAdmin
-admin.site.register(Band)
+    :param model: The model class.
+    :param using: The database alias.
+    :return: The estimated number of rows, or None if the database has no statistics for the table (e.g. SQLite
+             before ANALYZE was run).
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [connection.ops.quote_name(table)]
+            )
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s',
+                [table],
+            )
+        elif connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            # The first number of each statistics row is the number of rows of the table (or of the index).
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [table])
+            counts = [int(stat.split()[0]) for stat, in cursor.fetchall()]
+            return max(counts) if counts else None
+        else:
+            return None
+        row = cursor.fetchone()
+    # PostgreSQL reports -1 for tables that were never analyzed.
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator using the database's row count estimate for unfiltered querysets of large tables, where COUNT(*) would
+    scan the whole table on every changelist page. Filtered querysets, and tables with fewer than estimate_threshold
+    rows (or without statistics), are counted exactly.
+    """
+    estimate_threshold = 50000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where and not queryset.query.distinct:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= self.estimate_threshold:
+                return estimate
+        return super().count
+
+
+class PriceChangeForm(forms.Form):
+    """
+    The intermediate form of the price change action.
+    """
+    percentage = forms.DecimalField(
+        max_digits=6, decimal_places=2, min_value=Decimal('-99'), max_value=Decimal('1000'),
+        help_text='10 raises the prices by 10%, -15 lowers them by 15%. Prices are rounded to the cent.',
+    )
+
+
+class CategoryChangeForm(forms.Form):
+    """
+    The intermediate form of the re-categorization action.
+    """
+    category = forms.ModelChoiceField(
+        queryset=Category.objects.all(),
+        widget=AutocompleteSelect(Item._meta.get_field('category'), admin.site),
+    )
+
+
+# BandAdmin is searchable, which the band autocomplete of the item forms requires
+@admin.register(Band)
+class BandAdmin(admin.ModelAdmin):
+    list_display = ['name', 'genre']
+    ordering = ['name']
+    search_fields = ['name']
+
+
+# CategoryAdmin is searchable, which the category autocomplete of the item forms requires
+@admin.register(Category)
+class CategoryAdmin(admin.ModelAdmin):
+    ordering = ['name']
+    search_fields = ['name']
 
-# Registers the Category model with the default ModelAdmin
-admin.site.register(Category)
 
 # ItemAdmin customizes the admin interface for the Item model
 @admin.register(Item)
 class ItemAdmin(admin.ModelAdmin):
     # Fields to display in the list view
     list_display = ['name', 'category', 'band', 'price', 'is_featured']
+    # Joined in the changelist query, instead of one query per row and column
+    list_select_related = ['category', 'band']
     # Filters to display in the sidebar
     list_filter = ['is_featured', 'category', 'band']
-    # Fields that can be searched
-    search_fields = ['name']
+    # Fields that can be searched, through the search index (see get_search_results)
+    search_fields = ['name', 'band__name', 'category__name']
+    # Foreign keys picked with a search box instead of a select listing every band and category
+    autocomplete_fields = ['category', 'band']
+    # The changelist counts large unfiltered tables from the database statistics, and never counts twice
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['feature', 'unfeature', 'change_price', 'change_category', 'export_csv']
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Searches the items through the catalog search index, which matches the item, band and category names. Searches
+        matching more than SEARCH_LIMIT items fall back to the admin's search_fields query, so that every match is
+        listed without passing an unbounded list of ids to the database, and so do searches while the index is empty.
+
+        :param request: The incoming HTTP request.
+        :param queryset: The changelist queryset.
+        :param search_term: The search box query.
+        :return: A (queryset, may have duplicates) tuple.
+        """
+        if not search_term.strip():
+            return queryset, False
+        item_ids = search.search_item_ids(search_term, limit=SEARCH_LIMIT + 1)
+        # The emptiness of the index is only checked when it found nothing.
+        if len(item_ids) > SEARCH_LIMIT or (not item_ids and search.index_is_empty()):
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(pk__in=item_ids), False
+
+    def render_bulk_form(self, request, queryset, form, action, title):
+        """
+        Renders the intermediate page of a bulk action, which posts the form back with the same selection.
+        """
+        context = {
+            **self.admin_site.each_context(request),
+            'title': title,
+            'opts': self.model._meta,
+            'form': form,
+            'media': self.media + form.media,
+            'action': action,
+            'selected': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+            'select_across': request.POST.get('select_across', '0'),
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+            'item_count': queryset.count(),
+        }
+        return TemplateResponse(request, 'admin/catalog/item/bulk_update.html', context)
+
+    def updated(self, request, count, message):
+        """
+        Invalidates the cached pages rendered from the items once the update commits, and reports the update.
+        """
+        transaction.on_commit(lambda: cache.bump_model_version(Item))
+        self.message_user(request, f'{count} item(s) {message}.')
+
+    @admin.action(description='Feature the selected items', permissions=['change'])
+    def feature(self, request, queryset):
+        self.updated(request, queryset.exclude(is_featured=True).update(is_featured=True), 'featured')
+
+    @admin.action(description='Unfeature the selected items', permissions=['change'])
+    def unfeature(self, request, queryset):
+        self.updated(request, queryset.exclude(is_featured=False).update(is_featured=False), 'unfeatured')
+
+    @admin.action(description='Change the price of the selected items by a percentage', permissions=['change'])
+    def change_price(self, request, queryset):
+        form = PriceChangeForm(request.POST if 'apply' in request.POST else None)
+        if not form.is_valid():
+            return self.render_bulk_form(request, queryset, form, 'change_price', 'Change the price of items')
+        factor = 1 + form.cleaned_data['percentage'] / 100
+        # Prices are capped to what the column holds.
+        count = queryset.update(price=Least(Round(F('price') * factor, PRICE_DECIMALS), Value(MAX_PRICE)))
+        self.updated(request, count, f're-priced by {form.cleaned_data["percentage"]}%')
+
+    @admin.action(description='Move the selected items to another category', permissions=['change'])
+    def change_category(self, request, queryset):
+        form = CategoryChangeForm(request.POST if 'apply' in request.POST else None)
+        if not form.is_valid():
+            return self.render_bulk_form(request, queryset, form, 'change_category', 'Move items to a category')
+        category = form.cleaned_data['category']
+        with transaction.atomic():
+            # The items must be read first: a changelist filtered on the old category no longer selects them.
+            item_ids = list(queryset.values_list('pk', flat=True))
+            count = queryset.update(category=category)
+            # update() sends no signals, so re-index the items' category names explicitly.
+            for start in range(0, len(item_ids), REINDEX_BATCH_SIZE):
+                search.index_items(item_ids[start:start + REINDEX_BATCH_SIZE])
+        self.updated(request, count, f'moved to {category}')
+
+    @admin.action(description='Export the selected items as CSV')
+    def export_csv(self, request, queryset):
+        """
+        Streams the selected items as CSV, reading them from the database in chunks.
+        """
+        return exports.streaming_export(request, queryset.order_by('pk'), EXPORT_FIELDS, COLUMNS['item'], 'items')
@@ -0,0 +1,189 @@
+"""
+Read-only JSON API for items, bands and categories, for the mobile client and partners that used to scrape the pages.
+
+Responses are built from values() dicts rather than model instances and serialized with compact separators; items
+carry the rating aggregates stored on Item (see catalog.ratings), so no endpoint runs a query per row.
+
+Every endpoint accepts a 'fields' GET parameter with a comma-separated list of the fields to return (e.g.
+?fields=id,name,price); only the columns and joins those fields need are queried. Lists are paginated by keyset: pass
+the 'next' or 'previous' cursor of a response back as the 'cursor' parameter, and choose the page size with
+'page_size'. The item list takes the same 'sort' and facet parameters as the item list page (see catalog/facets.py)
+and an optional 'category' ID.
+"""
+from django.db.models import F
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+
+from .facets import parse_id
+from .models import Band, Category, Item
+from .pagination import MAX_INTEGER, InvalidCursor, paginate_request
+from .views import ITEM_SORTS, item_list_query
+
+# Public field names mapped to the expression they are read from; None reads the model field of the same name.
+ITEM_FIELDS = {
+    'id': None,
+    'name': None,
+    'description': None,
+    'price': None,
+    'category_id': None,
+    'category_name': F('category__name'),
+    'band_id': None,
+    'band_name': F('band__name'),
+    'genre': F('band__genre'),
+    'is_featured': None,
+    'rating_count': None,
+    'rating_average': None,
+    'image': None,
+}
+BAND_FIELDS = {'id': None, 'name': None, 'genre': None}
+CATEGORY_FIELDS = {'id': None, 'name': None}
+
+
+def image_url(name):
+    return Item._meta.get_field('image').storage.url(name) if name else None
+
+
+# Conversions applied to the values read from the database, by public field name.
+ITEM_CONVERTERS = {'image': image_url}
+
+
+def json_response(data, status=200):
+    return JsonResponse(data, status=status, json_dumps_params={'separators': (',', ':')})
+
+
+def json_error(message, status=400):
+    return json_response({'error': message}, status=status)
+
+
+def parse_fields(request, available):
+    """
+    Reads the sparse field selection from the 'fields' GET parameter.
+
+    :param request: The incoming HTTP request.
+    :param available: The fields of the resource, a dict such as ITEM_FIELDS.
+    :return: The requested field names in request order, or all of them when the parameter is missing.
+    :raises ValueError: If a requested field does not exist.
+    """
+    requested = request.GET.get('fields')
+    if not requested:
+        return list(available)
+    names = list(dict.fromkeys(name.strip() for name in requested.split(',') if name.strip()))
+    unknown = [name for name in names if name not in available]
+    if unknown or not names:
+        raise ValueError(f'Unknown fields: {", ".join(unknown)}. Available fields: {", ".join(available)}.')
+    return names
+
+
+def select_fields(queryset, available, names):
+    """
+    Restricts a queryset to values() dicts of the given public fields.
+    """
+    plain = [name for name in names if available[name] is None]
+    expressions = {name: available[name] for name in names if available[name] is not None}
+    return queryset.values(*plain, **expressions)
+
+
+def serialize(rows, names, converters):
+    """
+    Drops the fields that were only selected for pagination and converts the values that need it, in place.
+    """
+    for row in rows:
+        for name in [name for name in row if name not in names]:
+            del row[name]
+        for name, convert in converters.items():
+            if name in row:
+                row[name] = convert(row[name])
+    return rows
+
+
+def list_response(request, queryset, available, ordering, converters=None):
+    """
+    Returns one keyset-paginated page of a queryset as a JSON response.
+
+    :param request: The incoming HTTP request, with the 'fields', 'cursor' and 'page_size' GET parameters.
+    :param queryset: The filtered queryset of the resource.
+    :param available: The fields of the resource.
+    :param ordering: The ordering, whose fields must be plain fields of available.
+    :param converters: Conversions of the values read from the database, by field name.
+    :return: A JsonResponse with the 'results' and the 'pagination' cursors.
+    """
+    try:
+        names = parse_fields(request, available)
+    except ValueError as e:
+        return json_error(str(e))
+
+    # The ordering's fields are always read, since the cursors are built from them.
+    selected = list(dict.fromkeys([*names, *(field.lstrip('-') for field in ordering)]))
+    try:
+        page = paginate_request(request, select_fields(queryset, available, selected), ordering)
+    except InvalidCursor:
+        return json_error('Invalid cursor.')
+
+    rows = serialize(page.object_list, names, converters or {})
+    return json_response({'results': rows, 'pagination': page.metadata()})
+
+
+@require_GET
+def item_list(request):
+    """
+    Lists items as JSON, sorted and filtered like the item list page, optionally within the 'category' GET parameter.
+
+    :param request: The incoming HTTP request.
+    :return: JsonResponse with one page of items.
+    """
+    category_id = request.GET.get('category')
+    if category_id is not None:
+        category_id = parse_id(category_id)
+        if category_id is None:
+            return json_error('"category" must be a category ID.')
+
+    items, sort, _filters = item_list_query(request, category_id)
+    return list_response(request, items, ITEM_FIELDS, ITEM_SORTS[sort], ITEM_CONVERTERS)
+
+
+@require_GET
+def item_detail(request, item_id):
+    """
+    Returns one item as JSON.
+
+    :param request: The incoming HTTP request.
+    :param item_id: The ID of the item.
+    :return: JsonResponse with the item, or a 404 error.
+    """
+    try:
+        names = parse_fields(request, ITEM_FIELDS)
+    except ValueError as e:
+        return json_error(str(e))
+
+    # IDs beyond the range of the primary key column exist nowhere (and cannot be bound on SQLite).
+    item = None
+    if item_id <= MAX_INTEGER:
+        item = select_fields(Item.objects.filter(pk=item_id), ITEM_FIELDS, names).first()
+    if item is None:
+        return json_error('Item does not exist.', status=404)
+    return json_response(serialize([item], names, ITEM_CONVERTERS)[0])
+
+
+@require_GET
+def band_list(request):
+    """
+    Lists bands as JSON, optionally only those of the 'genre' GET parameter.
+
+    :param request: The incoming HTTP request.
+    :return: JsonResponse with one page of bands.
+    """
+    bands = Band.objects.all()
+    if request.GET.get('genre'):
+        bands = bands.filter(genre=request.GET['genre'])
+    return list_response(request, bands, BAND_FIELDS, ('id',))
+
+
+@require_GET
+def category_list(request):
+    """
+    Lists categories as JSON.
+
+    :param request: The incoming HTTP request.
+    :return: JsonResponse with one page of categories.
+    """
+    return list_response(request, Category.objects.all(), CATEGORY_FIELDS, ('id',))
@@ -0,0 +1,222 @@
+"""
+Native async versions of the catalog's read-heavy views and of submit_rating.
+
+catalog/urls.py routes these instead of their synchronous counterparts in catalog/views.py when the
+CATALOG_ASYNC_VIEWS setting is on (it is off by default, under ASGI too). They read through Django's async ORM
+and start independent queries together with asyncio.gather. Django 5.0 still runs each async ORM query on the
+request's synchronous thread, so gathered queries are issued back to back; the views are written so they overlap as
+soon as the database layer is natively async.
+
+Anything that may read the session (the user, flash messages) and template rendering run through sync_to_async.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404, HttpResponseBadRequest, JsonResponse
+from django.shortcuts import aget_object_or_404, render
+
+from . import facets
+from .cache import cache_page_for_anonymous, fragment_is_cached, page_cache_context
+from .conditional import conditional_page
+from .models import Band, Category, Item, Rating
+from .pagination import InvalidCursor, apaginate_request, get_page_size
+from .ratings import rate_item
+from .search import paginate_search
+from .views import (
+    ITEM_SORTS, item_list_context, item_list_query, log_search_history, parse_rating, recommended_items,
+)
+
+
+async def alist(queryset):
+    """
+    Evaluates a queryset with the async ORM.
+
+    :param queryset: The queryset.
+    :return: A list of its rows.
+    """
+    return [obj async for obj in queryset]
+
+
+async def load_user(request):
+    """
+    Evaluates request.user on the synchronous thread and returns it.
+
+    request.auser() caches the user separately from request.user, which templates and context processors read, so
+    loading request.user itself avoids querying the session and the user twice.
+
+    :param request: The incoming HTTP request.
+    :return: The User, or an AnonymousUser.
+    """
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+
+async def arender(request, template_name, context):
+    """
+    Renders a template on the synchronous thread, where context processors may read the session.
+    """
+    return await sync_to_async(render)(request, template_name, context)
+
+
+@conditional_page('home')
+@cache_page_for_anonymous('home')
+async def home(request):
+    """
+    Async view function for the home page: featured items, categories and bands.
+
+    The three lists are loaded together, and only when the page content is not already in the fragment cache.
+
+    :param request: The incoming HTTP request
+    :return: Rendered home page with context data
+    """
+    cache_context = await sync_to_async(page_cache_context)('home')
+    featured_items = Item.objects.filter(is_featured=True)
+    categories = Category.objects.all()
+    bands = Band.objects.all()
+
+    # A cached fragment never evaluates the (lazy) querysets, so only load them on a fragment cache miss.
+    if not await sync_to_async(fragment_is_cached)('catalog_home', cache_context['cache_version']):
+        featured_items, categories, bands = await asyncio.gather(
+            alist(featured_items), alist(categories), alist(bands)
+        )
+
+    context = {'featured_items': featured_items, 'categories': categories, 'bands': bands, **cache_context}
+    return await arender(request, 'catalog/home.html', context)
+
+
+async def item_list(request, category_id=None):
+    """
+    Async view function for the item list, with the same sorting, facets and pagination as views.item_list. The page
+    of items and the facet counts are loaded together.
+
+    :param request: The incoming HTTP request.
+    :param category_id: The ID of the category to filter items by, defaults to None.
+    :return: Rendered item list page.
+    """
+    items, sort, filters = item_list_query(request, category_id)
+    try:
+        page, facet_counts = await asyncio.gather(
+            apaginate_request(request, items, ITEM_SORTS[sort]),
+            sync_to_async(facets.facet_counts)(category_id, filters),
+        )
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor.")
+
+    context = item_list_context(page, sort, filters, facet_counts)
+    return await arender(request, 'catalog/item_list.html', context)
+
+
+@conditional_page('item_detail', item_kwarg='item_id')
+async def item_detail(request, item_id):
+    """
+    Async view function for the item detail page; the item, its recommendations and the user's rating of it are loaded
+    together.
+
+    :param request: The incoming HTTP request.
+    :param item_id: The ID of the item to display.
+    :return: Rendered item detail page.
+    """
+    user = await load_user(request)
+    lookups = [aget_object_or_404(Item, id=item_id), alist(recommended_items(item_id))]
+    if user.is_authenticated:
+        lookups.append(Rating.objects.filter(user=user, item_id=item_id).values_list('score', flat=True).afirst())
+    item, recommendations, *user_rating = await asyncio.gather(*lookups)
+
+    context = {
+        'item': item,
+        'stars_range': range(1, 6),
+        'user_rating': user_rating[0] if user_rating else None,
+        'recommendations': recommendations,
+    }
+    return await arender(request, 'catalog/item_detail.html', context)
+
+
+async def search_results(request):
+    """
+    Async view function for the search results; the page of items is loaded while the search is being logged.
+
+    :param request: The HttpRequest object containing the search query.
+    :return: Rendered search results page.
+    """
+    query = request.GET.get('q', '')
+    cursor = request.GET.get('cursor')
+    page = None
+    items = []
+
+    if query:
+        try:
+            page, user = await asyncio.gather(
+                sync_to_async(paginate_search)(query, cursor, get_page_size(request), request.GET),
+                load_user(request),
+            )
+        except InvalidCursor:
+            return HttpResponseBadRequest("Invalid cursor.")
+        ranked_ids = [item_id for item_id, _score in page.object_list]
+
+        tasks = [Item.objects.select_related('category', 'band').ain_bulk(ranked_ids)]
+        if user.is_authenticated and not cursor:
+            tasks.append(sync_to_async(log_search_history)(user, query, len(page.object_list)))
+        items_by_id, *_logged = await asyncio.gather(*tasks)
+        items = [items_by_id[item_id] for item_id in ranked_ids if item_id in items_by_id]
+
+    context = {'items': items, 'page': page, 'query': query}
+    return await arender(request, 'catalog/search_results.html', context)
+
+
+@conditional_page('band_detail')
+async def band_detail(request, band_id):
+    """
+    Async view function for the band detail page; the band and its page of items are loaded together.
+
+    :param request: HttpRequest object.
+    :param band_id: The primary key (ID) of the Band object to be detailed.
+    :return: Rendered band detail page.
+    """
+    try:
+        band, page = await asyncio.gather(
+            aget_object_or_404(Band, id=band_id),
+            apaginate_request(request, Item.objects.filter(band_id=band_id), ('id',)),
+        )
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor.")
+
+    return await arender(request, 'catalog/band_detail.html', {'band': band, 'items': page.object_list, 'page': page})
+
+
+async def submit_rating(request):
+    """
+    Async version of views.submit_rating, with the same validation and responses.
+
+    The rating upsert and the aggregate updates must share one transaction, which cannot span async ORM calls, so
+    the whole write runs as a single synchronous call through sync_to_async.
+
+    :param request: HttpRequest object, contains 'item_id' and 'score' in POST data.
+    :return: JsonResponse indicating the success or failure of the rating submission.
+    """
+    # login_required does not support async views in Django 5.0.
+    user = await load_user(request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+
+    if request.method != 'POST':
+        return HttpResponseBadRequest("Invalid request method.")
+
+    item_id = request.POST.get('item_id')
+    score = request.POST.get('score')
+    if not item_id or not score:
+        return HttpResponseBadRequest("Missing item_id or score in POST data.")
+
+    item_id, score, error = parse_rating(item_id, score)
+    if error:
+        return HttpResponseBadRequest(error)
+
+    try:
+        outcome = await sync_to_async(rate_item)(user, item_id, score)
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)})
+
+    if outcome == 'missing':
+        raise Http404("Item does not exist.")
+
+    return JsonResponse({'success': True, 'score': score, 'item_id': item_id})
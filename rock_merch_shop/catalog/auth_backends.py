@@ -0,0 +1,58 @@
+"""
+Authentication backend resolving request.user from a cache instead of querying the User table on every request.
+
+AuthenticationMiddleware loads the logged-in user with the backend's get_user() on each request that reads
+request.user (the navbar greeting does, on every page). CachedModelBackend keeps the users it loaded in the
+USER_CACHE_ALIAS cache for USER_CACHE_TIMEOUT seconds; the cache's own size limit (MAX_ENTRIES) bounds it. Saving or
+deleting a user drops their entry (see catalog/signals.py), so password changes and deactivations apply at once;
+changes made without signals (QuerySet.update()) apply within the timeout.
+
+The cached instance carries the password hash, which the session verification needs, so the cache must be as private
+as the database, and shared by every worker process for a change made in one to apply in the others: the settings
+only list this backend when CATALOG_CACHE_BACKEND is a shared cache. The hit rate is served by the staff-only
+request_stats view.
+"""
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+
+from .instrumentation import CacheCounter
+
+# User cache lookups.
+cache_counter = CacheCounter()
+
+
+def get_user_cache():
+    """
+    Returns the cache backend holding the users (the CATALOG_USER_CACHE_ALIAS setting).
+    """
+    return caches[getattr(settings, 'CATALOG_USER_CACHE_ALIAS', 'default')]
+
+
+def user_cache_key(user_id):
+    return f'catalog:user:{user_id}'
+
+
+def invalidate_user(user_id):
+    """
+    Drops a user from the cache, so the next request loads them from the database.
+    """
+    get_user_cache().delete(user_cache_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    The model backend, with get_user() served from the user cache.
+    """
+
+    def get_user(self, user_id):
+        cache = get_user_cache()
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        cache_counter.record(user is not None)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, timeout=getattr(settings, 'CATALOG_USER_CACHE_TIMEOUT', 300))
+            return user
+        return user if self.user_can_authenticate(user) else None
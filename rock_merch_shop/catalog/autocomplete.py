@@ -0,0 +1,413 @@
+"""
+In-memory prefix index answering the navbar's search-as-you-type suggestions without touching the database.
+
+Every item, band and category name is normalized like the search index (see catalog.search), and the name starting
+from each of its words is stored in a sorted array next to the suggestion it belongs to: 'Iron Maiden Hoodie' is
+stored as 'iron maiden hoodie', 'maiden hoodie' and 'hoodie'. The normalized query is looked up with bisect, and the
+suggestions under the keys it prefixes are ranked by popularity. Ranking a very common prefix ('a', 'th', ...) would
+mean sorting thousands of candidates, so the rankings of such prefixes are cached until a key starting with them
+changes.
+
+A suggestion's popularity combines its ratings (the rating sums of an item, or of all the items of a band or category)
+with how often its words were searched recently according to SearchHistory.
+
+The index is per process. It is built on the first lookup, kept up to date by the model signals of the process
+(see catalog/signals.py) and rebuilt in a background thread every MAX_AGE seconds, which refreshes the popularity
+and picks up changes made by other processes. Settings are read from the CATALOG_AUTOCOMPLETE dict.
+"""
+import heapq
+import logging
+import math
+import sys
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Band, Category, Item, SearchHistory
+from .search import tokenize
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Suggestions returned by default and at most.
+    'LIMIT': 8,
+    'MAX_LIMIT': 20,
+    # Seconds after which the index is rebuilt in the background.
+    'MAX_AGE': 600,
+    # Searches older than this many days do not count towards popularity, and at most MAX_QUERIES distinct queries do.
+    'SEARCH_WINDOW_DAYS': 30,
+    'MAX_QUERIES': 10000,
+    # Weight of the search popularity relative to the rating popularity.
+    'SEARCH_WEIGHT': 2.0,
+    # Prefixes matching more keys than this have their ranked candidates cached.
+    'SCAN_LIMIT': 500,
+}
+
+# Suggestion kinds and the view showing each of them.
+DETAIL_VIEWS = {'item': 'item_detail', 'band': 'band_detail', 'category': 'item_list'}
+
+# Sorts after every character a token can contain, so [prefix, prefix + END) spans the tokens starting with prefix.
+END = '\U0010ffff'
+
+
+def get_options():
+    """
+    Returns the CATALOG_AUTOCOMPLETE setting merged over the defaults.
+
+    :return: A dict of options.
+    """
+    return {**DEFAULTS, **getattr(settings, 'CATALOG_AUTOCOMPLETE', {})}
+
+
+class Suggestion:
+    """
+    An item, band or category the index can suggest.
+
+    Attributes:
+        - kind (str): 'item', 'band' or 'category'.
+        - pk (int): The primary key of the object.
+        - label (str): The name shown.
+        - tokens (tuple): The normalized tokens of the name.
+        - band_id (int): The band of an item, shown next to its name; None for bands and categories.
+        - rating_weight (float): The popularity from ratings.
+        - weight (float): The overall popularity the suggestions are ranked by.
+    """
+    __slots__ = ('kind', 'pk', 'label', 'tokens', 'band_id', 'rating_weight', 'weight')
+
+    def __init__(self, kind, pk, label, band_id=None, rating_weight=0.0):
+        self.kind = kind
+        self.pk = pk
+        self.label = label
+        # Interned, so the copies held by the sorted array share their memory.
+        self.tokens = tuple(dict.fromkeys(sys.intern(token) for token in tokenize(label)))
+        self.band_id = band_id
+        self.rating_weight = rating_weight
+        self.weight = rating_weight
+
+    @property
+    def key(self):
+        return self.kind, self.pk
+
+    def rank(self):
+        # Most popular first, then shorter names (closer to the typed prefix), then alphabetically.
+        return -self.weight, len(self.label), self.label
+
+
+class PrefixIndex:
+    """
+    The suggestions of the catalog in a sorted array of name suffixes, searchable by prefix.
+
+    Attributes:
+        - built_at (float): When the index was built, as a time.monotonic() value.
+        - build_seconds (float): How long the build took.
+        - lookups (int): Queries answered.
+    """
+
+    def __init__(self, suggestions=(), search_hits=None, search_weight=DEFAULTS['SEARCH_WEIGHT'],
+                 scan_limit=DEFAULTS['SCAN_LIMIT'], max_limit=DEFAULTS['MAX_LIMIT']):
+        """
+        :param suggestions: The Suggestion objects to index.
+        :param search_hits: Recent searches per token, for the search popularity.
+        :param search_weight: Weight of the search popularity relative to the rating popularity.
+        :param scan_limit: Prefixes matching more keys than this have their ranked suggestions cached.
+        :param max_limit: The most suggestions a lookup returns.
+        """
+        self.search_hits = search_hits or {}
+        self.search_weight = search_weight
+        self.scan_limit = scan_limit
+        self.max_limit = max_limit
+        self.suggestions = {}
+        pairs = []
+        for suggestion in suggestions:
+            self._weigh(suggestion)
+            self.suggestions[suggestion.key] = suggestion
+            pairs.extend((key, suggestion) for key in self.index_keys(suggestion))
+        pairs.sort(key=lambda pair: pair[0])
+        self.keys = [key for key, _suggestion in pairs]
+        self.values = [suggestion for _key, suggestion in pairs]
+        self._ranked = {}
+        self._lock = threading.Lock()
+        self.built_at = time.monotonic()
+        self.build_seconds = 0.0
+        self.lookups = 0
+
+    @staticmethod
+    def index_keys(suggestion):
+        """
+        Returns the keys a suggestion is found under: its normalized name starting from each word, so that typing
+        'maiden hoo' finds 'Iron Maiden Hoodie'.
+        """
+        tokens = suggestion.tokens
+        return [' '.join(tokens[start:]) for start in range(len(tokens))]
+
+    def _weigh(self, suggestion):
+        hits = max((self.search_hits.get(token, 0) for token in suggestion.tokens), default=0)
+        suggestion.weight = suggestion.rating_weight + self.search_weight * math.log1p(hits)
+
+    def lookup(self, query, limit=DEFAULTS['LIMIT']):
+        """
+        Returns the most popular suggestions with a word sequence starting with the query's words.
+
+        :param query: The text typed so far.
+        :param limit: The maximum number of suggestions, at most max_limit.
+        :return: A list of Suggestion objects, best first.
+        """
+        prefix = ' '.join(tokenize(query))
+        limit = min(limit, self.max_limit)
+        if not prefix or limit <= 0:
+            return []
+        with self._lock:
+            self.lookups += 1
+            start, end = bisect_left(self.keys, prefix), bisect_right(self.keys, prefix + END)
+            if end - start > self.scan_limit:
+                return self._ranked_suggestions(prefix, start, end)[:limit]
+            # A suggestion is listed once per matching word, so the candidates are deduplicated.
+            return heapq.nsmallest(limit, set(self.values[start:end]), key=Suggestion.rank)
+
+    def _ranked_suggestions(self, prefix, start, end):
+        ranked = self._ranked.get(prefix)
+        if ranked is None:
+            ranked = heapq.nsmallest(self.max_limit, set(self.values[start:end]), key=Suggestion.rank)
+            self._ranked[prefix] = ranked
+        return ranked
+
+    def add(self, suggestion):
+        """
+        Adds a suggestion, replacing the one with the same kind and primary key if any. The search popularity is
+        kept from the last build.
+        """
+        with self._lock:
+            self._remove(suggestion.key)
+            self._weigh(suggestion)
+            self.suggestions[suggestion.key] = suggestion
+            for key in self.index_keys(suggestion):
+                position = bisect_right(self.keys, key)
+                self.keys.insert(position, key)
+                self.values.insert(position, suggestion)
+                self._forget(key)
+
+    def remove(self, kind, pk):
+        """
+        Removes a suggestion, if indexed.
+        """
+        with self._lock:
+            self._remove((kind, pk))
+
+    def _remove(self, suggestion_key):
+        suggestion = self.suggestions.pop(suggestion_key, None)
+        if suggestion is None:
+            return
+        for key in self.index_keys(suggestion):
+            start, end = bisect_left(self.keys, key), bisect_right(self.keys, key)
+            for position in range(start, end):
+                if self.values[position] is suggestion:
+                    del self.keys[position]
+                    del self.values[position]
+                    break
+            self._forget(key)
+
+    def _forget(self, key):
+        # Drops the cached rankings of every prefix of a changed key.
+        if self._ranked:
+            for length in range(1, len(key) + 1):
+                self._ranked.pop(key[:length], None)
+
+    def band_name(self, band_id):
+        band = self.suggestions.get(('band', band_id))
+        return band.label if band else ''
+
+    def memory_usage(self):
+        """
+        Estimates the memory held by the index.
+
+        :return: The size in bytes of the arrays, the suggestions, their names and tokens, and the cached rankings.
+        """
+        with self._lock:
+            size = sys.getsizeof(self.keys) + sys.getsizeof(self.values) + sys.getsizeof(self.suggestions)
+            # Interned tokens are shared between the suggestions and the keys, so each string is counted once.
+            strings = {id(key): key for key in self.keys}
+            for suggestion in self.suggestions.values():
+                size += sys.getsizeof(suggestion) + sys.getsizeof(suggestion.label) + sys.getsizeof(suggestion.tokens)
+                strings.update((id(token), token) for token in suggestion.tokens)
+            size += sum(sys.getsizeof(string) for string in strings.values())
+            size += sys.getsizeof(self._ranked) + sum(sys.getsizeof(ranked) for ranked in self._ranked.values())
+            size += sys.getsizeof(self.search_hits)
+            return size
+
+    def stats(self):
+        """
+        Returns the size and usage counters of the index.
+
+        :return: A dict with the suggestion, key and cached prefix counts, the estimated memory in bytes, the build
+                 duration and age in seconds, and the lookups answered.
+        """
+        return {
+            'suggestions': len(self.suggestions),
+            'keys': len(self.keys),
+            'cached_prefixes': len(self._ranked),
+            'memory_bytes': self.memory_usage(),
+            'build_seconds': round(self.build_seconds, 3),
+            'age_seconds': round(time.monotonic() - self.built_at, 1),
+            'lookups': self.lookups,
+        }
+
+
+def item_suggestion(item_id, name, band_id, rating_sum):
+    return Suggestion('item', item_id, name, band_id=band_id, rating_weight=math.log1p(rating_sum))
+
+
+def recent_search_hits(options):
+    """
+    Counts the recent searches of each token, from the most frequent queries of the SearchHistory window.
+
+    :param options: The autocomplete options.
+    :return: A dict of search counts by token.
+    """
+    since = timezone.now() - timedelta(days=options['SEARCH_WINDOW_DAYS'])
+    queries = (
+        SearchHistory.objects.filter(timestamp__gte=since).values_list('query')
+        .annotate(searches=Count('id')).order_by('-searches')[:options['MAX_QUERIES']]
+    )
+    hits = Counter()
+    for query, searches in queries:
+        for token in set(tokenize(query)):
+            hits[token] += searches
+    return dict(hits)
+
+
+def build_index(options=None):
+    """
+    Builds the index of every item, band and category from the database, in four queries.
+
+    :param options: The autocomplete options, defaults to get_options().
+    :return: The PrefixIndex.
+    """
+    options = options or get_options()
+    started = time.monotonic()
+    band_ratings, category_ratings = defaultdict(int), defaultdict(int)
+    suggestions = []
+    for item_id, name, band_id, category_id, rating_sum in Item.objects.values_list(
+            'id', 'name', 'band_id', 'category_id', 'rating_sum').iterator(chunk_size=5000):
+        suggestions.append(item_suggestion(item_id, name, band_id, rating_sum))
+        band_ratings[band_id] += rating_sum
+        category_ratings[category_id] += rating_sum
+    for band_id, name in Band.objects.values_list('id', 'name'):
+        suggestions.append(Suggestion('band', band_id, name, rating_weight=math.log1p(band_ratings[band_id])))
+    for category_id, name in Category.objects.values_list('id', 'name'):
+        suggestions.append(
+            Suggestion('category', category_id, name, rating_weight=math.log1p(category_ratings[category_id]))
+        )
+    index = PrefixIndex(suggestions, recent_search_hits(options), options['SEARCH_WEIGHT'], options['SCAN_LIMIT'],
+                        options['MAX_LIMIT'])
+    index.build_seconds = time.monotonic() - started
+    logger.info('Built the autocomplete index: %d suggestions in %.2fs.', len(index.suggestions), index.build_seconds)
+    return index
+
+
+_index = None
+_index_lock = threading.Lock()
+_rebuilding = threading.Event()
+
+
+def get_index():
+    """
+    Returns the process-wide index, building it on first use and starting a background rebuild once it is older
+    than MAX_AGE seconds.
+
+    :return: The PrefixIndex instance.
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = build_index()
+    elif time.monotonic() - _index.built_at > get_options()['MAX_AGE'] and not _rebuilding.is_set():
+        _rebuilding.set()
+        threading.Thread(target=_rebuild, name='autocomplete-rebuild', daemon=True).start()
+    return _index
+
+
+def _rebuild():
+    global _index
+    try:
+        _index = build_index()
+    except Exception:
+        logger.exception('Could not rebuild the autocomplete index.')
+    finally:
+        _rebuilding.clear()
+        close_old_connections()
+
+
+def loaded_index():
+    """
+    Returns the process-wide index if it was built, without building it.
+    """
+    return _index
+
+
+def reset_index():
+    """
+    Discards the process-wide index; the next lookup builds it again.
+    """
+    global _index
+    with _index_lock:
+        _index = None
+
+
+def update_instance(instance):
+    """
+    Adds or refreshes the suggestion of a saved item, band or category, if the index was built.
+    """
+    index = loaded_index()
+    if index is None:
+        return
+    if isinstance(instance, Item):
+        index.add(item_suggestion(instance.pk, instance.name, instance.band_id, instance.rating_sum))
+    else:
+        kind = 'band' if isinstance(instance, Band) else 'category'
+        # Bands and categories keep the rating popularity of their items from the last build.
+        previous = index.suggestions.get((kind, instance.pk))
+        rating_weight = previous.rating_weight if previous else 0.0
+        index.add(Suggestion(kind, instance.pk, instance.name, rating_weight=rating_weight))
+
+
+def remove_suggestion(model, pk):
+    """
+    Removes the suggestion of a deleted item, band or category, if the index was built.
+
+    :param model: Item, Band or Category.
+    :param pk: The primary key of the deleted object.
+    """
+    index = loaded_index()
+    if index is None:
+        return
+    index.remove({Item: 'item', Band: 'band', Category: 'category'}[model], pk)
+
+
+def suggest(query, limit=DEFAULTS['LIMIT']):
+    """
+    Returns the suggestions for a query as JSON-ready dicts.
+
+    :param query: The text typed so far.
+    :param limit: The maximum number of suggestions.
+    :return: A list of dicts with the type, id, label, detail (an item's band) and url of each suggestion.
+    """
+    index = get_index()
+    results = []
+    for suggestion in index.lookup(query, limit):
+        results.append({
+            'type': suggestion.kind,
+            'id': suggestion.pk,
+            'label': suggestion.label,
+            'detail': index.band_name(suggestion.band_id) if suggestion.kind == 'item' else '',
+            'url': reverse(DETAIL_VIEWS[suggestion.kind], args=[suggestion.pk]),
+        })
+    return results
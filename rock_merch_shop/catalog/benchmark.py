@@ -0,0 +1,455 @@
+"""
+Load benchmark of every catalog and register route, driven by the Django test client.
+
+Each scenario requests one route a number of times in-process and records its latency, the number of SQL statements
+executed (through connection.execute_wrapper, like the request instrumentation) and, in a separate pass so tracing
+does not skew the timings, the peak memory allocated while serving it. Results can be saved as a JSON baseline and
+later runs compared against it to catch latency or query-count regressions.
+
+The scenarios run in one database transaction that is rolled back at the end, so the benchmark user (a staff account,
+for the staff-only routes), its session, its ratings and its searches never outlive the run. Searches are logged
+synchronously in that transaction instead of through the buffered writer, whose thread has its own connection, and
+the cache invalidations scheduled on commit do not run.
+
+measure_throughput() compares the requests per second of the read-heavy routes served through the WSGI and the ASGI
+handler (`python manage.py compare_interfaces`).
+
+Used by `python manage.py benchmark`; generate a realistic dataset first with `python manage.py generate_catalog`.
+"""
+import asyncio
+import json
+import platform
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from importlib import import_module
+from urllib.parse import urlencode
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, connections, transaction
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+
+from . import cache
+from .instrumentation import RequestMetrics
+from .models import Band, Category, Item, Rating, SearchHistory
+
+# Username of the staff account the authenticated scenarios run as.
+BENCHMARK_USERNAME = 'benchmark'
+
+# Apps whose URL patterns must all be covered by a scenario.
+BENCHMARKED_URLCONFS = ('catalog.urls', 'register.urls')
+
+
+@dataclass
+class Scenario:
+    """
+    One benchmarked request.
+
+    Attributes:
+        - name (str): The scenario name used in reports and baselines.
+        - url_name (str): The name of the route requested.
+        - method (str): 'get' or 'post'.
+        - kwargs (dict): URL arguments passed to reverse().
+        - params (dict or callable): Query or form data, or a function of the iteration number returning it.
+        - content_type (str): Content type of a POST body given as a string.
+        - authenticated (bool): Whether the request is made by the logged-in benchmark user.
+        - relogin (bool): Log in again before each request (for routes that log out).
+    """
+    name: str
+    url_name: str
+    method: str = 'get'
+    kwargs: dict = field(default_factory=dict)
+    params: object = None
+    content_type: str = None
+    authenticated: bool = False
+    relogin: bool = False
+
+    def data(self, iteration):
+        return self.params(iteration) if callable(self.params) else self.params
+
+
+def percentile(values, fraction):
+    """
+    Returns a percentile of a list of numbers using the nearest-rank method.
+
+    :param values: The numbers.
+    :param fraction: The percentile as a fraction, e.g. 0.95.
+    :return: The percentile, or 0 for an empty list.
+    """
+    if not values:
+        return 0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def largest_group(field_name):
+    """
+    Returns the value of an Item foreign key shared by the most items, e.g. the band with the most items.
+    """
+    groups = Item.objects.values(field_name).order_by(field_name).annotate(items=Count('pk'))
+    return groups.order_by('-items', field_name)[0][field_name]
+
+
+def get_fixtures():
+    """
+    Picks the objects the scenarios request: a category, band and item with the most data, and a search word.
+
+    :return: A dict of fixture values.
+    """
+    item = Item.objects.order_by('-rating_count', 'pk').select_related('band').first()
+    if item is None:
+        raise ValueError('The catalog is empty; run `python manage.py generate_catalog` first.')
+    words = [word for word in item.band.name.split() if word.isalpha()]
+    return {
+        'item_id': item.pk,
+        'band_id': largest_group('band'),
+        'category_id': largest_group('category'),
+        'query': (words[-1] if words else item.name.split()[0]).lower(),
+    }
+
+
+def build_scenarios(fixtures):
+    """
+    Returns the benchmark scenarios: every catalog and register route, with paginated and sorted variants.
+
+    :param fixtures: The values returned by get_fixtures().
+    :return: A list of Scenario instances.
+    """
+    item_id, band_id, category_id = fixtures['item_id'], fixtures['band_id'], fixtures['category_id']
+    return [
+        Scenario('home', 'home'),
+        Scenario('category_list', 'category_list'),
+        Scenario('band_list', 'band_list'),
+        Scenario('item_list', 'item_list', kwargs={'category_id': category_id}),
+        Scenario('item_list_by_rating', 'item_list', kwargs={'category_id': category_id},
+                 params={'sort': 'rating', 'min_rating': 3}),
+        Scenario('item_detail', 'item_detail', kwargs={'item_id': item_id}),
+        Scenario('band_detail', 'band_detail', kwargs={'band_id': band_id}),
+        Scenario('search_results', 'search_results', params={'q': fixtures['query']}),
+        Scenario('search_results_authenticated', 'search_results', params={'q': fixtures['query']},
+                 authenticated=True),
+        Scenario('autocomplete', 'autocomplete', params={'q': fixtures['query'][:3]}),
+        Scenario('search_history', 'search_history', authenticated=True),
+        Scenario('submit_rating', 'submit_rating', method='post', authenticated=True,
+                 params=lambda iteration: {'item_id': item_id, 'score': iteration % 5 + 1}),
+        Scenario('submit_ratings', 'submit_ratings', method='post', authenticated=True,
+                 content_type='application/json',
+                 params=lambda iteration: json.dumps({'ratings': [{'item_id': item_id, 'score': iteration % 5 + 1}]})),
+        Scenario('request_stats', 'request_stats', authenticated=True),
+        Scenario('api_item_list', 'api_item_list', params={'category': category_id}),
+        Scenario('api_item_list_sparse', 'api_item_list',
+                 params={'category': category_id, 'sort': 'rating', 'fields': 'id,name,price,rating_average'}),
+        Scenario('api_item_detail', 'api_item_detail', kwargs={'item_id': item_id}),
+        Scenario('api_band_list', 'api_band_list'),
+        Scenario('api_category_list', 'api_category_list'),
+        Scenario('register', 'register'),
+        Scenario('login', 'login'),
+        Scenario('logout', 'logout', method='post', authenticated=True, relogin=True),
+        Scenario('profile', 'profile', authenticated=True),
+        Scenario('contact', 'contact'),
+    ]
+
+
+def uncovered_routes(scenarios):
+    """
+    Returns the names of the catalog and register routes no scenario requests, so new routes are not forgotten.
+
+    :param scenarios: The Scenario instances.
+    :return: A sorted list of route names.
+    """
+    names = set()
+    for urlconf in BENCHMARKED_URLCONFS:
+        for pattern in import_module(urlconf).urlpatterns:
+            if isinstance(pattern, URLPattern) and pattern.name:
+                names.add(pattern.name)
+    return sorted(names - {scenario.url_name for scenario in scenarios})
+
+
+def get_benchmark_user():
+    """
+    Returns the staff user the authenticated scenarios run as, creating it (without a usable password) if needed.
+
+    Call it inside the run's transaction (see run()), so a user created here is rolled back with it.
+    """
+    user, created = User.objects.get_or_create(username=BENCHMARK_USERNAME, defaults={'is_staff': True})
+    if created:
+        user.set_unusable_password()
+        user.save(update_fields=['password'])
+    return user
+
+
+def request(client, scenario, iteration):
+    url = reverse(scenario.url_name, kwargs=scenario.kwargs)
+    data = scenario.data(iteration)
+    if scenario.method == 'post' and scenario.content_type:
+        return client.post(url, data, content_type=scenario.content_type)
+    return getattr(client, scenario.method)(url, data)
+
+
+def run_scenario(scenario, user, iterations, warmup=2, cold=False):
+    """
+    Requests one scenario repeatedly and measures it.
+
+    :param scenario: The Scenario to run.
+    :param user: The User authenticated scenarios log in as.
+    :param iterations: The number of measured requests.
+    :param warmup: The number of unmeasured requests made first (they fill caches and connections).
+    :param cold: Clear the page cache before each request, so cached pages are rendered every time.
+    :return: A dict of results: status, latency percentiles in milliseconds, queries per request and peak memory.
+    """
+    client = Client()
+    if scenario.authenticated:
+        client.force_login(user)
+
+    latencies, query_counts, statuses = [], [], set()
+    for iteration in range(warmup + iterations):
+        if scenario.relogin and iteration:
+            client.force_login(user)
+        if cold:
+            cache.get_cache().clear()
+        metrics = RequestMetrics()
+        with ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(metrics))
+            started = time.perf_counter()
+            response = request(client, scenario, iteration)
+            elapsed = time.perf_counter() - started
+        if iteration >= warmup:
+            latencies.append(elapsed * 1000)
+            query_counts.append(metrics.query_count)
+            statuses.add(response.status_code)
+
+    # Measure the allocation peak in a separate request, because tracing slows every allocation down.
+    if scenario.relogin:
+        client.force_login(user)
+    if cold:
+        cache.get_cache().clear()
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        request(client, scenario, warmup + iterations)
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'url': reverse(scenario.url_name, kwargs=scenario.kwargs),
+        'method': scenario.method.upper(),
+        'status': sorted(statuses),
+        'requests': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3) if latencies else 0,
+        'queries': round(sum(query_counts) / len(query_counts), 2) if query_counts else 0,
+        'max_queries': max(query_counts, default=0),
+        'peak_memory_kib': round(peak / 1024, 1),
+    }
+
+
+def run(iterations=50, warmup=2, cold=False, only=None, report=None):
+    """
+    Runs every scenario (or those named in 'only') and returns the full benchmark result.
+
+    :param iterations: The number of measured requests per scenario.
+    :param warmup: The number of unmeasured requests per scenario.
+    :param cold: Clear the page cache before each request.
+    :param only: An optional collection of scenario names to run.
+    :param report: An optional callable receiving (scenario name, result) as each scenario finishes.
+    :return: A dict with the run's metadata, the dataset size, uncovered routes and per-scenario results.
+    """
+    scenarios = build_scenarios(get_fixtures())
+    if only:
+        scenarios = [scenario for scenario in scenarios if scenario.name in only]
+    dataset = {
+        model._meta.model_name: model.objects.count() for model in (Category, Band, Item, Rating, SearchHistory, User)
+    }
+
+    results = {}
+    # The test client's host must be allowed without changing the project settings.
+    search_log = {**getattr(settings, 'CATALOG_SEARCH_LOG', {}), 'ENABLED': False}
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], CATALOG_SEARCH_LOG=search_log), \
+            transaction.atomic():
+        user = get_benchmark_user()
+        for scenario in scenarios:
+            results[scenario.name] = run_scenario(scenario, user, iterations, warmup, cold)
+            if report:
+                report(scenario.name, results[scenario.name])
+        # Nothing the scenarios wrote is kept.
+        transaction.set_rollback(True)
+
+    return {
+        'created': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'database': connection.vendor,
+        'iterations': iterations,
+        'cold': cold,
+        'dataset': dataset,
+        'uncovered_routes': uncovered_routes(scenarios) if not only else [],
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold=0.2, min_delta_ms=1.0):
+    """
+    Compares a benchmark result against a saved baseline.
+
+    A scenario regresses when its p95 latency grows by more than 'threshold' (and by at least min_delta_ms, to ignore
+    noise on very fast routes) or when it runs more queries per request than before.
+
+    :param current: The result of run().
+    :param baseline: A previously saved result of run().
+    :param threshold: The tolerated relative p95 latency increase, e.g. 0.2 for 20%.
+    :param min_delta_ms: The smallest p95 increase in milliseconds reported as a regression.
+    :return: A list of human-readable regression descriptions, empty when nothing regressed.
+    """
+    regressions = []
+    for name, result in current['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if previous is None:
+            continue
+        delta = result['p95_ms'] - previous['p95_ms']
+        if delta > min_delta_ms and result['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+            regressions.append(f'{name}: p95 {previous["p95_ms"]:.1f}ms -> {result["p95_ms"]:.1f}ms')
+        if result['queries'] > previous['queries']:
+            regressions.append(f'{name}: queries per request {previous["queries"]} -> {result["queries"]}')
+    return regressions
+
+
+# Read-heavy routes served natively async under ASGI, used to compare the two interfaces.
+THROUGHPUT_SCENARIOS = ('home', 'item_list', 'item_detail', 'band_detail', 'search_results')
+
+
+def throughput_urls():
+    """
+    Returns the (path, query string) pairs of the read-heavy scenarios, requested anonymously.
+    """
+    scenarios = [scenario for scenario in build_scenarios(get_fixtures()) if scenario.name in THROUGHPUT_SCENARIOS]
+    return [(reverse(scenario.url_name, kwargs=scenario.kwargs), urlencode(scenario.data(0) or {}))
+            for scenario in scenarios]
+
+
+def wsgi_get(application, path, query_string):
+    """
+    Sends one GET request through a WSGI application and returns the response status code.
+    """
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query_string, 'HTTP_HOST': 'testserver'}
+    setup_testing_defaults(environ)
+    statuses = []
+    result = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    try:
+        for _chunk in result:
+            pass
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return int(statuses[0].split()[0])
+
+
+async def asgi_get(application, path, query_string):
+    """
+    Sends one GET request through an ASGI application and returns the response status code.
+    """
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query_string.encode(), 'root_path': '',
+        'headers': [(b'host', b'testserver')], 'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+    }
+    received = False
+    status = []
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # The client stays connected: wait until the handler stops listening for a disconnect.
+        await asyncio.Future()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await application(scope, receive, send)
+    return status[0]
+
+
+def measure_throughput(interface, concurrency=8, requests=500):
+    """
+    Serves the read-heavy routes through Django's real WSGI or ASGI handler with a fixed number of concurrent
+    requests, and measures throughput and latency.
+
+    WSGI requests run on 'concurrency' threads, like a threaded WSGI server; ASGI requests are 'concurrency'
+    coroutines on one event loop, like an ASGI server worker. Which views are routed (sync or async) depends on the
+    CATALOG_ASYNC_VIEWS setting of the running process.
+
+    :param interface: 'wsgi' or 'asgi'.
+    :param concurrency: The number of requests in flight at any time.
+    :param requests: The total number of requests.
+    :return: A dict with the requests per second, latency percentiles, error count and the view mode.
+    """
+    urls = throughput_urls()
+    latencies, errors = [], 0
+
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        if interface == 'wsgi':
+            application = get_wsgi_application()
+            for path, query_string in urls:
+                wsgi_get(application, path, query_string)
+
+            def worker(index):
+                path, query_string = urls[index % len(urls)]
+                started = time.perf_counter()
+                status = wsgi_get(application, path, query_string)
+                return time.perf_counter() - started, status
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                outcomes = list(pool.map(worker, range(requests)))
+            elapsed = time.perf_counter() - started
+        else:
+            application = get_asgi_application()
+
+            async def drive():
+                for path, query_string in urls:
+                    await asgi_get(application, path, query_string)
+                semaphore = asyncio.Semaphore(concurrency)
+
+                async def worker(index):
+                    path, query_string = urls[index % len(urls)]
+                    async with semaphore:
+                        request_started = time.perf_counter()
+                        status = await asgi_get(application, path, query_string)
+                        return time.perf_counter() - request_started, status
+
+                run_started = time.perf_counter()
+                results = await asyncio.gather(*(worker(index) for index in range(requests)))
+                return results, time.perf_counter() - run_started
+
+            outcomes, elapsed = asyncio.run(drive())
+
+    for latency, status in outcomes:
+        latencies.append(latency * 1000)
+        errors += status >= 400
+
+    return {
+        'interface': interface,
+        'async_views': settings.CATALOG_ASYNC_VIEWS,
+        'concurrency': concurrency,
+        'requests': requests,
+        'requests_per_second': round(requests / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'errors': errors,
+    }
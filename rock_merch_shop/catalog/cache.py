@@ -0,0 +1,217 @@
+"""
+Page caching for the catalog's rarely changing pages (home, category_list and band_list).
+
+Every cached page declares the models it is rendered from. Each of those models has a version number in the cache,
+bumped by the post_save/post_delete handlers in catalog/signals.py (admin edits included), and the versions are part
+of every cache key. An edit therefore invalidates exactly the pages that depend on the edited model, and a request
+that was rendering while the edit happened can only write to a key that is already obsolete.
+
+Anonymous visitors get the whole rendered page from the cache. Logged-in users get a freshly rendered page (so the
+navbar stays personalized) in which the content block is a cached template fragment keyed on the same versions.
+"""
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import caches
+from django.core.cache.utils import make_template_fragment_key
+from django.http import HttpResponse
+
+from . import routers
+from .models import Band, Category, Item, ItemRecommendation
+
+# Models each page is rendered from, by page name: the first three pages are cached, and every page's ETag is built
+# from these versions (see catalog/conditional.py).
+PAGE_DEPENDENCIES = {
+    'home': (Item, Category, Band),
+    'category_list': (Category,),
+    'band_list': (Band,),
+    'band_detail': (Item, Category, Band),
+    'item_detail': (Item, Category, Band, ItemRecommendation),
+}
+
+# Set for a few seconds after a model version bump, while the read replicas may still serve the old rows.
+PRIMARY_PIN_KEY = 'catalog:routing:pin-primary'
+
+
+def get_cache():
+    """
+    Returns the cache backend configured for the catalog (the CATALOG_CACHE_ALIAS setting).
+
+    :return: A Django cache backend instance.
+    """
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')]
+
+
+def get_timeout():
+    """
+    Returns the timeout of cached pages; None (the default) keeps them until a signal invalidates them.
+
+    :return: The timeout in seconds, or None.
+    """
+    return getattr(settings, 'CATALOG_PAGE_CACHE_TIMEOUT', None)
+
+
+def _version_key(model, pk=None):
+    if pk is None:
+        return f'catalog:version:{model._meta.label_lower}'
+    return f'catalog:version:{model._meta.label_lower}:{pk}'
+
+
+def model_versions(models, objects=()):
+    """
+    Returns the current cache version of each model, fetched in a single cache round-trip.
+
+    Missing versions are initialized from the clock rather than to 1, so that a version evicted from the cache can
+    never come back with a value that older page entries were stored under.
+
+    :param models: An iterable of model classes.
+    :param objects: An iterable of (model class, primary key) pairs whose object versions (see
+                    bump_object_versions) are fetched in the same round-trip.
+    :return: A list of versions, the models' followed by the objects', in the given order.
+    """
+    cache = get_cache()
+    keys = [_version_key(model) for model in models] + [_version_key(model, pk) for model, pk in objects]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_model_version(model):
+    """
+    Invalidates every cached page that depends on a model by incrementing the model's version.
+
+    :param model: The model class whose instances changed.
+    """
+    cache = get_cache()
+    try:
+        cache.incr(_version_key(model))
+    except ValueError:
+        # The version was never read (or was evicted); any new value invalidates the old keys.
+        cache.set(_version_key(model), time.time_ns(), timeout=None)
+    if routers.replica_aliases():
+        # A page rendered from a lagging replica would be cached under the new version: read from the primary until
+        # the replicas caught up.
+        cache.set(PRIMARY_PIN_KEY, True, timeout=routers.get_options()['STICKY_SECONDS'])
+
+
+def primary_pinned():
+    """
+    Tells whether a model version was bumped in the last STICKY_SECONDS, so that every read should go to the primary.
+    """
+    return bool(get_cache().get(PRIMARY_PIN_KEY))
+
+
+def bump_object_versions(model, pks):
+    """
+    Invalidates what depends on individual objects, such as the ETag of an item's page when its rating aggregates
+    change, in a single cache round-trip.
+
+    :param model: The model class of the objects.
+    :param pks: The primary keys of the changed objects.
+    """
+    # A fresh clock reading differs from any version the keys held before.
+    version = time.time_ns()
+    get_cache().set_many({_version_key(model, pk): version for pk in pks}, timeout=None)
+
+
+def page_version(name):
+    """
+    Returns the version string of a cached page, built from the versions of the models it depends on.
+
+    :param name: The page name, a key of PAGE_DEPENDENCIES.
+    :return: The version string, e.g. '17.4.9'.
+    """
+    return '.'.join(str(version) for version in model_versions(PAGE_DEPENDENCIES[name]))
+
+
+def page_cache_context(name):
+    """
+    Returns the template context used by the {% cache %} fragment tags of a cached page.
+
+    Fragments depending on a single model (e.g. the band grid of the home page) are keyed on that model's version,
+    found in 'cache_model_versions' under the model name, so that editing another model does not re-render them.
+
+    :param name: The page name, a key of PAGE_DEPENDENCIES.
+    :return: A dict with 'cache_version', 'cache_model_versions', 'cache_timeout' and 'cache_alias'.
+    """
+    models = PAGE_DEPENDENCIES[name]
+    versions = model_versions(models)
+    return {
+        'cache_version': '.'.join(str(version) for version in versions),
+        'cache_model_versions': {model._meta.model_name: version for model, version in zip(models, versions)},
+        'cache_timeout': get_timeout(),
+        'cache_alias': getattr(settings, 'CATALOG_CACHE_ALIAS', 'default'),
+    }
+
+
+def fragment_is_cached(fragment_name, version):
+    """
+    Tells whether a {% cache %} fragment rendered with the given version is in the cache, so a view can skip
+    loading the data the fragment would display.
+
+    :param fragment_name: The fragment name used in the template, e.g. 'catalog_home'.
+    :param version: The version the fragment is keyed on (see page_cache_context).
+    :return: True if the fragment is cached.
+    """
+    return get_cache().has_key(make_template_fragment_key(fragment_name, [version]))
+
+
+def cache_page_for_anonymous(name):
+    """
+    Decorator caching the whole rendered page for anonymous GET requests.
+
+    Requests from logged-in users, non-GET requests and requests with pending flash messages (which are rendered
+    into the page) bypass the full-page cache and rely on the fragment cache instead. Both synchronous and
+    asynchronous views can be decorated.
+
+    :param name: The page name, a key of PAGE_DEPENDENCIES.
+    :return: The view decorator.
+    """
+    def lookup(request):
+        # Returns the page's cache key, or None when the cache is bypassed, and the cached content.
+        if request.method != 'GET' or request.user.is_authenticated or len(get_messages(request)):
+            return None, None
+        key = f'catalog:page:{name}:{page_version(name)}'
+        return key, get_cache().get(key)
+
+    def hit(content):
+        response = HttpResponse(content)
+        response['X-Page-Cache'] = 'hit'
+        return response
+
+    def store(key, response):
+        if response.status_code == 200 and not response.streaming:
+            get_cache().set(key, response.content, timeout=get_timeout())
+            response['X-Page-Cache'] = 'miss'
+        return response
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                # The user and the flash messages are read from the session, which is synchronous.
+                key, content = await sync_to_async(lookup)(request)
+                if key is None:
+                    return await view(request, *args, **kwargs)
+                if content is not None:
+                    return hit(content)
+                response = await view(request, *args, **kwargs)
+                return await sync_to_async(store)(key, response)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key, content = lookup(request)
+            if key is None:
+                return view(request, *args, **kwargs)
+            if content is not None:
+                return hit(content)
+            return store(key, view(request, *args, **kwargs))
+        return wrapper
+    return decorator
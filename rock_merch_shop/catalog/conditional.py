@@ -0,0 +1,100 @@
+"""
+Conditional GET for the catalog pages: ETags built from the cache versions of the models a page is rendered from.
+
+The versions (see catalog/cache.py) are bumped by the model signals and, for an item's rating aggregates, by
+catalog.ratings, so they change exactly when a page's content may have. A page's ETag hashes its versions with the
+full path (query string included), the CATALOG_RELEASE setting (so a deploy changing the templates invalidates every
+ETag) and, for logged-in users, the user and the session, which also covers the CSRF token rotated at login. A
+request whose If-None-Match matches gets a 304 Not Modified after one cache round-trip, without running the view.
+
+Pages with pending flash messages are always rendered, since rendering consumes the messages. Responses carry
+'Cache-Control: no-cache' (revalidate before every reuse), 'private' for logged-in users so shared caches and CDNs
+only keep anonymous pages, and 'Vary: Cookie'.
+
+No Last-Modified header is sent: the versions are counters, and a one-second timestamp could not tell apart two
+changes made within the same second.
+"""
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+
+from . import cache
+from .models import Item
+
+
+def page_etag(request, name, objects=()):
+    """
+    Returns the ETag of a page for the current request, or None when the request cannot be answered conditionally.
+
+    :param request: The incoming HTTP request.
+    :param name: The page name, a key of cache.PAGE_DEPENDENCIES.
+    :param objects: (model class, primary key) pairs of the objects whose own versions the page also depends on.
+    :return: A weak ETag, or None.
+    """
+    if request.method not in ('GET', 'HEAD') or len(get_messages(request)):
+        return None
+    versions = cache.model_versions(cache.PAGE_DEPENDENCIES[name], objects)
+    viewer = f'{request.user.pk}:{request.session.session_key}' if request.user.is_authenticated else 'anonymous'
+    parts = [name, request.get_full_path(), getattr(settings, 'CATALOG_RELEASE', ''), viewer, *versions]
+    digest = hashlib.md5('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return f'W/"{digest}"'
+
+
+def set_validators(request, response, etag):
+    """
+    Adds the ETag and the caching headers to a full or a 304 response.
+    """
+    if etag is None:
+        return response
+    if response.status_code in (200, 304) and not response.has_header('ETag'):
+        response['ETag'] = etag
+    if request.user.is_authenticated:
+        patch_cache_control(response, no_cache=True, private=True)
+    else:
+        patch_cache_control(response, no_cache=True)
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def conditional_page(name, item_kwarg=None):
+    """
+    Decorator answering conditional GET requests of a page with 304 Not Modified while its versions are unchanged.
+
+    Both synchronous and asynchronous views can be decorated. Apply it outside cache_page_for_anonymous, so a 304
+    skips the page cache as well.
+
+    :param name: The page name, a key of cache.PAGE_DEPENDENCIES.
+    :param item_kwarg: The name of the view argument holding an item ID, for pages that also show the item's rating
+                       aggregates and so depend on its object version.
+    :return: The view decorator.
+    """
+    def etag_for(request, kwargs):
+        objects = [(Item, kwargs[item_kwarg])] if item_kwarg else ()
+        return page_etag(request, name, objects)
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                # The user, the session and the flash messages are synchronous.
+                etag = await sync_to_async(etag_for)(request, kwargs)
+                response = get_conditional_response(request, etag=etag) if etag else None
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                # request.user was loaded by etag_for whenever there is an ETag.
+                return set_validators(request, response, etag)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            etag = etag_for(request, kwargs)
+            response = get_conditional_response(request, etag=etag) if etag else None
+            if response is None:
+                response = view(request, *args, **kwargs)
+            return set_validators(request, response, etag)
+        return wrapper
+    return decorator
@@ -0,0 +1,133 @@
+"""
+Streamed CSV and JSON Lines downloads of querysets (the search history exports and the admin's item export).
+
+Rows are read with values_list().iterator(chunk_size=...), which fetches them from the database cursor chunk by chunk
+without caching the queryset, and encoded into lines that are sent in batches as they are produced, so an export of
+millions of rows holds one chunk in memory at a time. CSV text cells that a spreadsheet would evaluate as a formula
+(starting with =, +, - or @, e.g. a search for "=HYPERLINK(...)") are prefixed with an apostrophe, which spreadsheets
+show as text; `catalog_data import` removes it again. When the request is served through ASGI the response content is
+an async iterator reading the batches in the sync thread, since Django would otherwise consume a synchronous iterator
+entirely before sending it.
+"""
+import csv
+import datetime
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+
+# Rows fetched from the database per round-trip.
+CHUNK_SIZE = 2000
+
+# Lines sent to the client at once.
+LINES_PER_BATCH = 200
+
+# Values written in ISO 8601.
+DATE_TYPES = (datetime.date, datetime.time)
+
+# First characters that make a spreadsheet evaluate a cell as a formula, and the prefix that keeps it text.
+FORMULA_PREFIXES = ('=', '+', '-', '@')
+FORMULA_ESCAPE = "'"
+
+
+def encode_value(value):
+    """
+    Returns the exported form of a value CSV and JSON do not represent: ISO 8601 for dates and times (with
+    microseconds), text for anything else (e.g. decimals).
+    """
+    if isinstance(value, DATE_TYPES):
+        return value.isoformat()
+    return str(value)
+
+
+def escape_formula(value):
+    """
+    Returns a CSV cell that spreadsheets read as text: an apostrophe is prefixed to text starting like a formula.
+    """
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return FORMULA_ESCAPE + value
+    return value
+
+
+def unescape_formula(value):
+    """
+    Returns the text of a CSV cell written with escape_formula().
+    """
+    if value and value.startswith(FORMULA_ESCAPE) and value[1:].startswith(FORMULA_PREFIXES):
+        return value[1:]
+    return value
+
+
+class Echo:
+    """
+    A file-like object returning what is written to it, so that csv.writer produces the lines of a streamed response.
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(columns, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        # The csv module writes the other values (None as an empty cell) itself.
+        yield writer.writerow([
+            value.isoformat() if isinstance(value, DATE_TYPES) else escape_formula(value) for value in row
+        ])
+
+
+def jsonl_lines(columns, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), default=encode_value) + '\n'
+
+
+# Export formats: content type, file extension and line encoder.
+FORMATS = {
+    'csv': ('text/csv', 'csv', csv_lines),
+    'jsonl': ('application/x-ndjson', 'jsonl', jsonl_lines),
+}
+
+
+def batches(lines):
+    """
+    Joins lines into batches of LINES_PER_BATCH, so each write to the client carries many rows.
+    """
+    while True:
+        batch = ''.join(islice(lines, LINES_PER_BATCH))
+        if not batch:
+            return
+        yield batch
+
+
+async def async_batches(lines):
+    # Every batch is read in the sync thread, where the database cursor lives.
+    next_batch = sync_to_async(lambda: ''.join(islice(lines, LINES_PER_BATCH)), thread_sensitive=True)
+    while True:
+        batch = await next_batch()
+        if not batch:
+            return
+        yield batch
+
+
+def streaming_export(request, queryset, fields, columns, filename, export_format='csv', chunk_size=CHUNK_SIZE):
+    """
+    Returns a download of a queryset's rows, streamed as they are read from the database.
+
+    :param request: The incoming HTTP request.
+    :param queryset: The queryset exported, ordered as the rows should be.
+    :param fields: The fields read with values_list().
+    :param columns: The column names written for the fields (the CSV header, the JSON keys).
+    :param filename: The file name offered to the browser, without its extension.
+    :param export_format: A key of FORMATS.
+    :param chunk_size: Rows fetched from the database per round-trip.
+    :return: A StreamingHttpResponse.
+    """
+    content_type, extension, encode = FORMATS[export_format]
+    lines = encode(columns, queryset.values_list(*fields).iterator(chunk_size=chunk_size))
+    content = async_batches(lines) if isinstance(request, ASGIRequest) else batches(lines)
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{extension}"'
+    return response
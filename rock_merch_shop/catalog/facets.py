@@ -0,0 +1,288 @@
+"""
+Faceted filtering of the item list by band, genre, price range and minimum rating.
+
+parse_filters() reads the filters from the GET parameters ('band', 'genre' and 'price' may be repeated; 'min_rating'
+is a single number), FacetFilters.q() turns them into a Q object, and facet_counts() counts the items behind every
+facet option. Options of the same facet are alternatives (band=1&band=2 means either band), facets are combined, and
+the counts of a facet's options are computed with the filters of every other facet, so they tell how many items
+selecting the option would show.
+
+All counts come from two aggregate queries, whatever the number of options: one with a conditional COUNT per price
+range and rating threshold, and one grouped by band, from which the genre counts are summed as well. Both are served
+by the catalog_item_facet_idx covering index.
+
+Counts of filter combinations requested at least CACHE_AFTER times within POPULAR_WINDOW seconds are cached for
+CACHE_TIMEOUT seconds. Their keys carry the Item and Band cache versions (see catalog/cache.py), so catalog edits
+invalidate them at once; new ratings (which update the stored aggregates without signals) show up within the timeout.
+
+Settings are read from the CATALOG_FACETS dict.
+"""
+import hashlib
+import math
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Count, Min, Q
+
+from . import cache
+from .models import Band, Item
+from .pagination import MAX_INTEGER
+
+DEFAULTS = {
+    'CACHE_AFTER': 2,
+    'POPULAR_WINDOW': 3600,
+    'CACHE_TIMEOUT': 300,
+    'MAX_BAND_OPTIONS': 20,
+    'MAX_VALUES': 20,
+}
+
+# Price range options: (value, label, lower bound included, upper bound excluded).
+PRICE_RANGES = (
+    ('under-20', 'Under $20', None, Decimal('20')),
+    ('20-50', '$20 to $50', Decimal('20'), Decimal('50')),
+    ('50-100', '$50 to $100', Decimal('50'), Decimal('100')),
+    ('100-up', '$100 and up', Decimal('100'), None),
+)
+
+# Minimum average rating options.
+RATING_THRESHOLDS = (4, 3, 2, 1)
+
+# Highest minimum rating a request may ask for.
+MAX_RATING = 5
+
+FACETS = ('band', 'genre', 'price', 'rating')
+
+
+def get_options():
+    """
+    Returns the CATALOG_FACETS setting merged over the defaults.
+
+    :return: A dict of options.
+    """
+    return {**DEFAULTS, **getattr(settings, 'CATALOG_FACETS', {})}
+
+
+def price_range_q(value):
+    """
+    Returns the condition of one price range option.
+
+    :param value: The option's value, e.g. '20-50'.
+    :return: A Q object.
+    """
+    _value, _label, low, high = next(price_range for price_range in PRICE_RANGES if price_range[0] == value)
+    condition = Q()
+    if low is not None:
+        condition &= Q(price__gte=low)
+    if high is not None:
+        condition &= Q(price__lt=high)
+    return condition
+
+
+@dataclass(frozen=True)
+class FacetFilters:
+    """
+    The facet filters of a request, in a canonical order so equal selections share cache keys.
+
+    Attributes:
+        - bands (tuple): Selected band IDs.
+        - genres (tuple): Selected genres.
+        - prices (tuple): Selected price range values (see PRICE_RANGES).
+        - min_rating (float): Minimum average rating, 0 for none.
+    """
+    bands: tuple = ()
+    genres: tuple = ()
+    prices: tuple = ()
+    min_rating: float = 0
+
+    def q(self, exclude=None):
+        """
+        Returns the condition matching items that pass every filter, except those of the excluded facet.
+
+        :param exclude: A facet name from FACETS whose filter is left out, or None.
+        :return: A Q object, empty when nothing is filtered.
+        """
+        condition = Q()
+        if self.bands and exclude != 'band':
+            condition &= Q(band_id__in=self.bands)
+        if self.genres and exclude != 'genre':
+            condition &= Q(band__genre__in=self.genres)
+        if self.prices and exclude != 'price':
+            price_condition = Q()
+            for value in self.prices:
+                price_condition |= price_range_q(value)
+            condition &= price_condition
+        if self.min_rating > 0 and exclude != 'rating':
+            condition &= Q(rating_average__gte=self.min_rating)
+        return condition
+
+    def query_params(self):
+        """
+        Returns the filters as a list of (name, value) GET parameters.
+        """
+        params = [('band', band) for band in self.bands]
+        params += [('genre', genre) for genre in self.genres]
+        params += [('price', price) for price in self.prices]
+        if self.min_rating > 0:
+            params.append(('min_rating', f'{self.min_rating:g}'))
+        return params
+
+    def digest(self):
+        """
+        Returns a short hash identifying the selection, for cache keys.
+        """
+        return hashlib.md5(repr(self.query_params()).encode('utf-8')).hexdigest()[:16]
+
+
+def parse_id(value):
+    """
+    Parses a primary key from a GET parameter.
+
+    Only ASCII digits are accepted (str.isdigit() and int() also take other Unicode digits), within the range of a
+    64-bit primary key column.
+
+    :param value: The raw parameter value.
+    :return: The ID, or None if the value is not a valid primary key.
+    """
+    value = value.strip()
+    if not value.isascii() or not value.isdigit():
+        return None
+    number = int(value)
+    return number if 1 <= number <= MAX_INTEGER else None
+
+
+def parse_filters(params):
+    """
+    Reads the facet filters from GET parameters, ignoring invalid values.
+
+    :param params: A QueryDict, usually request.GET.
+    :return: A FacetFilters instance.
+    """
+    max_values = get_options()['MAX_VALUES']
+    bands = {parse_id(value) for value in params.getlist('band')} - {None}
+    genres = {value.strip() for value in params.getlist('genre') if value.strip()}
+    prices = set(params.getlist('price'))
+    try:
+        min_rating = float(params.get('min_rating', 0))
+    except ValueError:
+        min_rating = 0
+    # Ratings run from 1 to 5; NaN and out of range values select nothing meaningful.
+    min_rating = min(max(min_rating, 0), MAX_RATING) if math.isfinite(min_rating) else 0
+    return FacetFilters(
+        bands=tuple(sorted(bands)[:max_values]),
+        genres=tuple(sorted(genres)[:max_values]),
+        prices=tuple(value for value, *_rest in PRICE_RANGES if value in prices),
+        min_rating=min_rating,
+    )
+
+
+def conditional_count(condition):
+    # An empty Q cannot be compiled as an aggregate filter.
+    return Count('id', filter=condition) if condition else Count('id')
+
+
+def compute_counts(items, filters, max_band_options):
+    """
+    Counts the items behind every facet option with two aggregate queries.
+
+    :param items: The queryset the facets narrow down (the category's items).
+    :param filters: The selected FacetFilters.
+    :param max_band_options: The number of band options listed, besides the selected bands.
+    :return: A dict with the 'total' number of matching items and a list of option dicts (value, label, count,
+        selected) for each facet in FACETS.
+    """
+    # Query 1: the matching total and a conditional count per price range and rating threshold.
+    aggregates = {'total': conditional_count(filters.q())}
+    for index, (value, *_rest) in enumerate(PRICE_RANGES):
+        aggregates[f'price_{index}'] = Count('id', filter=filters.q(exclude='price') & price_range_q(value))
+    for threshold in RATING_THRESHOLDS:
+        aggregates[f'rating_{threshold}'] = Count(
+            'id', filter=filters.q(exclude='rating') & Q(rating_average__gte=threshold)
+        )
+    totals = items.order_by().aggregate(**aggregates)
+
+    # Query 2: per band, the count without the band filter and the count without the genre filter. The band's name
+    # and genre are the same on every row of its group, so Min() reads them without widening the GROUP BY.
+    band_rows = (
+        items.order_by()
+        .values('band_id')
+        .annotate(
+            name=Min('band__name'),
+            genre=Min('band__genre'),
+            band_count=conditional_count(filters.q(exclude='band')),
+            genre_count=conditional_count(filters.q(exclude='genre')),
+        )
+    )
+
+    band_options = []
+    genre_counts = {}
+    for row in band_rows:
+        genre_counts[row['genre']] = genre_counts.get(row['genre'], 0) + row['genre_count']
+        selected = row['band_id'] in filters.bands
+        if row['band_count'] or selected:
+            band_options.append({
+                'value': row['band_id'], 'label': row['name'], 'count': row['band_count'], 'selected': selected,
+            })
+    band_options.sort(key=lambda option: (-option['count'], option['label']))
+    # Keep the most represented bands, and the selected ones wherever they rank.
+    listed = band_options[:max_band_options]
+    listed += [option for option in band_options[max_band_options:] if option['selected']]
+
+    genre_options = [
+        {'value': genre, 'label': genre, 'count': count, 'selected': genre in filters.genres}
+        for genre, count in genre_counts.items()
+        if count or genre in filters.genres
+    ]
+    genre_options.sort(key=lambda option: (-option['count'], option['label']))
+
+    return {
+        'total': totals['total'],
+        'band': listed,
+        'genre': genre_options,
+        'price': [
+            {'value': value, 'label': label, 'count': totals[f'price_{index}'], 'selected': value in filters.prices}
+            for index, (value, label, _low, _high) in enumerate(PRICE_RANGES)
+        ],
+        'rating': [
+            {
+                'value': threshold, 'label': f'{threshold} stars & up', 'count': totals[f'rating_{threshold}'],
+                'selected': filters.min_rating == threshold,
+            }
+            for threshold in RATING_THRESHOLDS
+        ],
+    }
+
+
+def facet_counts(category_id, filters):
+    """
+    Returns the facet counts of a category's items under the given filters, from the cache when the combination is
+    popular (see the module docstring).
+
+    :param category_id: The ID of the category whose items are faceted, or None for all items.
+    :param filters: The selected FacetFilters.
+    :return: The counts, as returned by compute_counts.
+    """
+    options = get_options()
+    backend = cache.get_cache()
+    selection = f'catalog:facets:{category_id}:{filters.digest()}'
+    versions = '.'.join(str(version) for version in cache.model_versions((Item, Band)))
+    key = f'{selection}:{versions}'
+
+    counts = backend.get(key)
+    if counts is not None:
+        return counts
+
+    items = Item.objects.filter(category=category_id) if category_id else Item.objects.all()
+    counts = compute_counts(items, filters, options['MAX_BAND_OPTIONS'])
+
+    # Count the requests for this combination and cache its facets once it is popular.
+    hits_key = f'{selection}:hits'
+    backend.add(hits_key, 0, timeout=options['POPULAR_WINDOW'])
+    try:
+        hits = backend.incr(hits_key)
+    except ValueError:
+        # Evicted between add() and incr().
+        hits = 1
+    if hits >= options['CACHE_AFTER']:
+        backend.set(key, counts, timeout=options['CACHE_TIMEOUT'])
+    return counts
@@ -0,0 +1,108 @@
+"""
+Per-item template fragment caching for the listing pages (item list, band detail and search results).
+
+A listing renders one card per item with the {% item_cards %} tag (see catalog/templatetags/catalog_fragments.py).
+Each card is cached under a key made of the card template, CATALOG_RELEASE (so a deploy changing the templates
+invalidates the cards), the cache versions of the Item, Category and Band models (bumped on every edit, see
+catalog/cache.py) and the item's own version (bumped when its rating aggregates change). A page of cards therefore
+costs two cache round-trips, whatever its length: one get_many for the versions and one for the cards. Only the
+missing cards are rendered, and they are stored back with one set_many.
+
+FragmentStats records, per card template, the hits, the misses and the time spent rendering the misses, from which
+the render time saved by the hits is estimated; the staff-only request_stats view serves them.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from . import cache
+from .models import Band, Category, Item
+
+# Models every card is rendered from.
+CARD_DEPENDENCIES = (Item, Category, Band)
+
+
+class FragmentStats:
+    """
+    Thread-safe per-template counts of the cached fragments served and rendered.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._templates = {}
+
+    def record(self, template_name, hits, misses, render_seconds):
+        with self._lock:
+            stats = self._templates.setdefault(template_name, {'hits': 0, 'misses': 0, 'render_ms': 0.0})
+            stats['hits'] += hits
+            stats['misses'] += misses
+            stats['render_ms'] += render_seconds * 1000
+
+    def snapshot(self):
+        """
+        Returns the counts of each template, with the mean render time of a fragment and the estimated time saved.
+        """
+        snapshot = {}
+        with self._lock:
+            for name, stats in sorted(self._templates.items()):
+                mean = stats['render_ms'] / stats['misses'] if stats['misses'] else 0
+                lookups = stats['hits'] + stats['misses']
+                snapshot[name] = {
+                    'hits': stats['hits'],
+                    'misses': stats['misses'],
+                    'hit_rate': round(stats['hits'] / lookups, 3) if lookups else None,
+                    'mean_render_ms': round(mean, 3),
+                    'saved_render_ms': round(stats['hits'] * mean, 1),
+                }
+        return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._templates.clear()
+
+
+stats = FragmentStats()
+
+
+def card_keys(template_name, items):
+    """
+    Returns the cache key of each item's card, fetching every version in one cache round-trip.
+
+    :param template_name: The card template.
+    :param items: The Item instances.
+    :return: A list of keys, in the order of items.
+    """
+    versions = cache.model_versions(CARD_DEPENDENCIES, [(Item, item.pk) for item in items])
+    prefix = ':'.join(
+        ['catalog:card', template_name, getattr(settings, 'CATALOG_RELEASE', '')]
+        + [str(version) for version in versions[:len(CARD_DEPENDENCIES)]]
+    )
+    return [
+        f'{prefix}:{item.pk}:{version}' for item, version in zip(items, versions[len(CARD_DEPENDENCIES):])
+    ]
+
+
+def render_cards(template_name, items, render):
+    """
+    Returns the rendered card of each item, from the cache where possible.
+
+    :param template_name: The card template.
+    :param items: The Item instances.
+    :param render: A callable rendering the card of one item.
+    :return: A list of HTML strings, in the order of items.
+    """
+    items = list(items)
+    if not items:
+        return []
+    backend = cache.get_cache()
+    keys = card_keys(template_name, items)
+    cached = backend.get_many(keys)
+
+    started = time.perf_counter()
+    rendered = {key: render(item) for key, item in zip(keys, items) if key not in cached}
+    elapsed = time.perf_counter() - started
+    if rendered:
+        backend.set_many(rendered, timeout=cache.get_timeout())
+    stats.record(template_name, len(items) - len(rendered), len(rendered), elapsed)
+    return [cached[key] if key in cached else rendered[key] for key in keys]
@@ -0,0 +1,315 @@
+"""
+Per-request SQL and rendering instrumentation.
+
+RequestMetrics collects, for one request, every SQL statement executed, the time spent rendering templates and the
+statements repeated with different parameters, which is how N+1 query patterns show up. Statements are seen through
+an execute wrapper installed on every database connection when it is created (see catalog/signals.py), so this works
+with DEBUG=False. Connections are per thread, while the current request's metrics are held in a context variable
+that follows the request through sync_to_async, so queries are attributed correctly under WSGI and ASGI.
+MetricsStore aggregates finished requests in memory, per URL name, into histograms that the staff-only stats endpoint
+serves.
+
+Collection is driven by catalog.middleware.RequestInstrumentationMiddleware; template render time is measured by the
+InstrumentedDjangoTemplates backend. Both are configured with the CATALOG_INSTRUMENTATION setting.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates
+
+DEFAULTS = {
+    'ENABLED': True,
+    'SAMPLE_RATE': 1.0,
+    'RESPONSE_HEADER': False,
+    # A statement executed at least this many times in one request is reported as a repeated (N+1) pattern.
+    'REPEAT_THRESHOLD': 5,
+    # Number of repeated patterns kept per URL name.
+    'MAX_PATTERNS': 10,
+}
+
+# Upper bounds of the histogram buckets; the last bucket is open-ended.
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+_current = ContextVar('catalog_request_metrics', default=None)
+
+# Collapses the placeholder lists of IN clauses so that statements differing only in list length match.
+IN_LIST_RE = re.compile(r'\((?:%s, )*%s\)')
+NUMBER_RE = re.compile(r'\b\d+\b')
+
+
+def get_options():
+    """
+    Returns the CATALOG_INSTRUMENTATION setting merged over the defaults.
+
+    :return: A dict of options.
+    """
+    return {**DEFAULTS, **getattr(settings, 'CATALOG_INSTRUMENTATION', {})}
+
+
+def normalize_sql(sql):
+    """
+    Reduces an SQL statement to its pattern, so repeated executions with different parameters compare equal.
+
+    :param sql: The SQL statement, with parameter placeholders.
+    :return: The normalized statement.
+    """
+    return NUMBER_RE.sub('?', IN_LIST_RE.sub('(...)', sql))
+
+
+class RequestMetrics:
+    """
+    Metrics of a single request: SQL statements and timings, template render time and repeated statements.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.sql_time = 0.0
+        self.render_time = 0.0
+        self.patterns = Counter()
+        self._render_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        """
+        Execute wrapper timing and recording a statement; called by record_query, or installed directly with
+        connection.execute_wrapper().
+        """
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.query_count += 1
+            self.patterns[normalize_sql(sql)] += 1
+
+    def repeated_patterns(self, threshold):
+        """
+        Returns the statements executed at least 'threshold' times.
+
+        :param threshold: The minimum number of executions.
+        :return: A list of (pattern, count) tuples, most repeated first.
+        """
+        return [(pattern, count) for pattern, count in self.patterns.most_common() if count >= threshold]
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def current_metrics():
+    """
+    Returns the metrics of the request being processed in this context, or None if it is not instrumented.
+    """
+    return _current.get()
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Execute wrapper installed on every database connection: records the statement in the current request's metrics.
+    """
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def install(connection):
+    """
+    Installs record_query on a database connection, once.
+
+    It goes first in the list of wrappers, because connection.execute_wrapper() removes the last one on exit.
+
+    :param connection: A DatabaseWrapper.
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+def activate(metrics):
+    """
+    Makes metrics the current request's metrics.
+
+    :return: A token to pass to deactivate().
+    """
+    return _current.set(metrics)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+class Histogram:
+    """
+    A fixed-bucket histogram with count, sum and maximum.
+    """
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.maximum = 0.0
+        self.count = 0
+
+    def add(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+        self.count += 1
+
+    def percentile(self, fraction):
+        """
+        Returns the upper bound of the bucket containing the given percentile (the maximum for the last bucket).
+        """
+        if not self.count:
+            return 0
+        target = fraction * self.count
+        running = 0
+        for index, bucket_count in enumerate(self.counts):
+            running += bucket_count
+            if running >= target:
+                return self.bounds[index] if index < len(self.bounds) else self.maximum
+        return self.maximum
+
+    def snapshot(self):
+        labels = [f'<={bound}' for bound in self.bounds] + [f'>{self.bounds[-1]}']
+        return {
+            'count': self.count,
+            'mean': round(self.total / self.count, 3) if self.count else 0,
+            'max': round(self.maximum, 3),
+            'p50': self.percentile(0.50),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'buckets': dict(zip(labels, self.counts)),
+        }
+
+
+class CacheCounter:
+    """
+    Thread-safe hit and miss counts of an in-process or shared cache, as served by the stats endpoint.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+class ViewStats:
+    """
+    Aggregated metrics of every sampled request to one URL name.
+    """
+
+    def __init__(self):
+        self.latency_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.sql_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.render_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.repeated = Counter()
+
+    def snapshot(self):
+        return {
+            'latency_ms': self.latency_ms.snapshot(),
+            'sql_ms': self.sql_ms.snapshot(),
+            'render_ms': self.render_ms.snapshot(),
+            'queries': self.queries.snapshot(),
+            'repeated_queries': [{'sql': sql, 'requests': count} for sql, count in self.repeated.most_common()],
+        }
+
+
+class MetricsStore:
+    """
+    Thread-safe, in-memory aggregation of request metrics per URL name.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, name, metrics, threshold, max_patterns):
+        """
+        Adds a finished request's metrics to the aggregates of its URL name.
+        """
+        repeated = metrics.repeated_patterns(threshold)
+        with self._lock:
+            stats = self._views.setdefault(name, ViewStats())
+            stats.latency_ms.add(metrics.elapsed() * 1000)
+            stats.sql_ms.add(metrics.sql_time * 1000)
+            stats.render_ms.add(metrics.render_time * 1000)
+            stats.queries.add(metrics.query_count)
+            for pattern, _count in repeated:
+                stats.repeated[pattern] += 1
+            # Keep only the most frequent patterns so memory stays bounded.
+            if len(stats.repeated) > max_patterns:
+                stats.repeated = Counter(dict(stats.repeated.most_common(max_patterns)))
+
+    def snapshot(self):
+        with self._lock:
+            return {name: stats.snapshot() for name, stats in sorted(self._views.items())}
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+store = MetricsStore()
+
+
+class InstrumentedTemplate:
+    """
+    Wraps a template of the Django template backend to add its render time to the current request's metrics.
+
+    SQL executed while rendering (lazy querysets evaluated by the template) is subtracted, so render time and SQL time
+    never overlap. Nested renders are only counted once.
+    """
+
+    def __init__(self, template):
+        self._template = template
+
+    def __getattr__(self, name):
+        return getattr(self._template, name)
+
+    def render(self, context=None, request=None):
+        metrics = current_metrics()
+        if metrics is None or metrics._render_depth:
+            return self._template.render(context, request)
+
+        metrics._render_depth += 1
+        started, sql_before = time.perf_counter(), metrics.sql_time
+        try:
+            return self._template.render(context, request)
+        finally:
+            metrics._render_depth -= 1
+            metrics.render_time += (time.perf_counter() - started) - (metrics.sql_time - sql_before)
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, with templates wrapped in InstrumentedTemplate.
+    """
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return InstrumentedTemplate(super().get_template(template_name))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import search_retention
+from catalog.search_log import get_options
+
+
+class Command(BaseCommand):
+    """
+    Moves the search history records past the retention limits (CATALOG_SEARCH_LOG's MAX_PER_USER and MAX_AGE_DAYS)
+    to a gzip-compressed JSON Lines archive, and deletes them in small batches. Schedule it daily.
+
+    Usage: python manage.py archive_search_history [--output-dir DIR] [--max-per-user N] [--max-age-days N] [--dry-run]
+    """
+    help = 'Archives the expired search history records to compressed JSON Lines and deletes them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-dir', help='Directory of the archive (defaults to ARCHIVE_DIR).')
+        parser.add_argument('--max-per-user', type=int, help='Newest records kept per user.')
+        parser.add_argument('--max-age-days', type=int, help='Age in days after which records expire.')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Records archived at once.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Records deleted per statement.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the expired records.')
+
+    def handle(self, *args, **options):
+        settings = get_options()
+        if options['max_per_user'] is not None:
+            settings['MAX_PER_USER'] = options['max_per_user']
+        if options['max_age_days'] is not None:
+            settings['MAX_AGE_DAYS'] = options['max_age_days']
+        if settings['MAX_PER_USER'] is not None and settings['MAX_PER_USER'] < 1:
+            raise CommandError('MAX_PER_USER must be at least 1.')
+
+        stats = search_retention.archive_expired(
+            output_dir=options['output_dir'], options=settings, chunk_size=options['chunk_size'],
+            batch_size=options['batch_size'], dry_run=options['dry_run'],
+        )
+
+        if options['dry_run']:
+            self.stdout.write(f"{stats['expired']} expired search history records of {stats['users']} users.")
+        elif stats['archive']:
+            self.stdout.write(self.style.SUCCESS(
+                f"Archived {stats['expired']} records to {stats['archive']} and deleted them."
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS('No expired search history records.'))
@@ -0,0 +1,81 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import benchmark
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks every catalog and register route in-process with the test client.
+
+    Prints p50/p95/p99 latency, queries per request and peak memory per scenario. --save writes the result as a JSON
+    baseline; --compare checks the run against a saved baseline and lists regressions (p95 latency above the
+    threshold, or more queries per request), failing with --fail-on-regression. Everything the scenarios write,
+    including the staff user they run as, is rolled back at the end of the run.
+
+    Usage:
+        python manage.py benchmark [--iterations N] [--cold] [--only home item_list] [--save baseline.json]
+        python manage.py benchmark --compare baseline.json [--threshold 0.2] [--fail-on-regression]
+    """
+    help = 'Benchmarks every catalog and register route and compares the result with a JSON baseline.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50, help='Measured requests per scenario.')
+        parser.add_argument('--warmup', type=int, default=2, help='Unmeasured requests made first per scenario.')
+        parser.add_argument('--cold', action='store_true', help='Clear the page cache before every request.')
+        parser.add_argument('--only', nargs='+', help='Run only the named scenarios.')
+        parser.add_argument('--save', help='Write the result to this JSON file.')
+        parser.add_argument('--compare', help='Compare the result with this JSON baseline.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Tolerated relative p95 latency increase (0.2 = 20%%).')
+        parser.add_argument('--fail-on-regression', action='store_true', help='Exit with an error on regressions.')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as source:
+                baseline = json.load(source)
+
+        self.stdout.write(f'{"scenario":<30} {"status":>7} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} '
+                          f'{"queries":>8} {"peak KiB":>9}')
+        try:
+            result = benchmark.run(
+                iterations=options['iterations'],
+                warmup=options['warmup'],
+                cold=options['cold'],
+                only=options['only'],
+                report=self.report,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for route in result['uncovered_routes']:
+            self.stderr.write(self.style.WARNING(f'Route {route!r} is not covered by any benchmark scenario.'))
+
+        if options['save']:
+            with open(options['save'], 'w', encoding='utf-8') as output:
+                json.dump(result, output, indent=2)
+            self.stdout.write(f'Saved the result to {options["save"]}.')
+
+        if baseline is None:
+            return
+        regressions = benchmark.compare(result, baseline, threshold=options['threshold'])
+        # Ratings and searches grow as the site is used, so only the catalog's size has to match.
+        catalog_size = {kind: result['dataset'][kind] for kind in ('category', 'band', 'item')}
+        if any(baseline.get('dataset', {}).get(kind) != count for kind, count in catalog_size.items()):
+            self.stderr.write(
+                self.style.WARNING("The catalog size differs from the baseline's; results may not compare.")
+            )
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {options["compare"]}.'))
+            return
+        for regression in regressions:
+            self.stdout.write(self.style.ERROR(f'Regression: {regression}'))
+        if options['fail_on_regression']:
+            raise CommandError(f'{len(regressions)} regressions against {options["compare"]}.')
+
+    def report(self, name, result):
+        status = ','.join(str(code) for code in result['status'])
+        self.stdout.write(f'{name:<30} {status:>7} {result["p50_ms"]:>9.2f} {result["p95_ms"]:>9.2f} '
+                          f'{result["p99_ms"]:>9.2f} {result["queries"]:>8} {result["peak_memory_kib"]:>9}')
@@ -0,0 +1,325 @@
+import csv
+import json
+import sys
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+
+from catalog import cache, search
+from catalog.exports import unescape_formula
+from catalog.models import Band, Category, Item, Rating
+from catalog.pagination import MAX_INTEGER
+from catalog.ratings import recompute_rating_aggregates
+
+# Record kinds in dependency order: a kind only references kinds listed before it.
+KINDS = ('category', 'band', 'item', 'rating')
+
+# Kinds whose pending rows must be written before a batch of the given kind, so foreign keys resolve.
+DEPENDENCIES = {'category': (), 'band': (), 'item': ('category', 'band'), 'rating': ('item',)}
+
+# Columns of each kind, as exported and expected on import.
+COLUMNS = {
+    'category': ['name'],
+    'band': ['name', 'genre'],
+    'item': ['id', 'name', 'description', 'price', 'category', 'band', 'image', 'is_featured'],
+    'rating': ['item_id', 'user', 'score'],
+}
+
+# Item fields overwritten when an imported item's id already exists.
+ITEM_UPDATE_FIELDS = ['name', 'description', 'price', 'category', 'band', 'image', 'is_featured']
+
+
+def parse_bool(value):
+    """
+    Parses a boolean from a JSON value or a CSV cell ('true', '1', 'yes' are true).
+
+    :param value: The raw value.
+    :return: The boolean.
+    """
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('true', '1', 'yes')
+
+
+def parse_int(value):
+    """
+    Parses an integer from a JSON value or a CSV cell.
+
+    :param value: The raw value.
+    :return: The integer, or None if the value is not one (booleans and fractional numbers included) or does not fit a
+             64-bit column.
+    """
+    if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+        return None
+    try:
+        number = int(value.strip()) if isinstance(value, str) else int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return number if -MAX_INTEGER <= number <= MAX_INTEGER else None
+
+
+class Importer:
+    """
+    Streams records into the database in bounded memory.
+
+    Records are queued per kind and written with bulk_create once a kind has batch_size pending rows; each batch is
+    its own transaction. Band and category names are resolved to primary keys through in-memory name -> pk maps that
+    grow as new bands and categories are written.
+    """
+
+    def __init__(self, batch_size, report):
+        self.batch_size = batch_size
+        self.report = report
+        self.pending = {kind: [] for kind in KINDS}
+        self.written = {kind: 0 for kind in KINDS}
+        self.errors = 0
+        self.category_ids = dict(Category.objects.values_list('name', 'pk'))
+        self.band_ids = dict(Band.objects.values_list('name', 'pk'))
+        self.user_ids = {}
+
+    def add(self, kind, record):
+        if kind not in self.pending:
+            raise CommandError(f'Unknown record kind {kind!r}; expected one of {", ".join(KINDS)}.')
+        self.pending[kind].append(record)
+        if len(self.pending[kind]) >= self.batch_size:
+            self.flush(kind)
+
+    def flush(self, kind):
+        for dependency in DEPENDENCIES[kind]:
+            self.flush(dependency)
+        rows, self.pending[kind] = self.pending[kind], []
+        if not rows:
+            return
+        with transaction.atomic():
+            written = getattr(self, f'_write_{kind}')(rows)
+        self.written[kind] += written
+        self.report(kind, written)
+
+    def finish(self):
+        for kind in KINDS:
+            self.flush(kind)
+
+    def error(self, message):
+        self.errors += 1
+        self.report(None, 0, message)
+
+    def _write_category(self, rows):
+        names = list({row['name'] for row in rows})
+        Category.objects.bulk_create([Category(name=name) for name in names], ignore_conflicts=True)
+        self.category_ids.update(Category.objects.filter(name__in=names).values_list('name', 'pk'))
+        return len(names)
+
+    def _write_band(self, rows):
+        bands = {}
+        for row in rows:
+            band = bands.setdefault(row['name'], Band(name=row['name'], genre=''))
+            band.genre = row.get('genre') or band.genre
+        # An empty genre cell leaves the stored genre alone: those bands are only created if they do not exist.
+        with_genre = [band for band in bands.values() if band.genre]
+        Band.objects.bulk_create(with_genre, update_conflicts=True, unique_fields=['name'], update_fields=['genre'])
+        Band.objects.bulk_create([band for band in bands.values() if not band.genre], ignore_conflicts=True)
+        self.band_ids.update(Band.objects.filter(name__in=list(bands)).values_list('name', 'pk'))
+        return len(bands)
+
+    def _write_item(self, rows):
+        with_id, without_id = [], []
+        for row in rows:
+            category_id = self.category_ids.get(row.get('category'))
+            band_id = self.band_ids.get(row.get('band'))
+            if category_id is None or band_id is None:
+                self.error(
+                    f'Item {row.get("name")!r}: unknown category {row.get("category")!r} or band {row.get("band")!r}.'
+                )
+                continue
+            has_id = row.get('id') not in (None, '')
+            item_id = parse_int(row['id']) if has_id else None
+            try:
+                price = Decimal(str(row['price']))
+            except (KeyError, ArithmeticError):
+                price = None
+            if (has_id and item_id is None) or price is None or not price.is_finite():
+                self.error(f'Item {row.get("name")!r}: invalid id {row.get("id")!r} or price {row.get("price")!r}.')
+                continue
+            item = Item(
+                name=row['name'],
+                description=row.get('description', ''),
+                price=price,
+                category_id=category_id,
+                band_id=band_id,
+                image=row.get('image') or None,
+                is_featured=parse_bool(row.get('is_featured', False)),
+            )
+            if item_id is not None:
+                item.pk = item_id
+                with_id.append(item)
+            else:
+                without_id.append(item)
+
+        if with_id:
+            Item.objects.bulk_create(
+                with_id, update_conflicts=True, unique_fields=['id'], update_fields=ITEM_UPDATE_FIELDS
+            )
+        indexed = list(with_id)
+        if without_id and connections[router.db_for_write(Item)].features.can_return_rows_from_bulk_insert:
+            Item.objects.bulk_create(without_id)
+            indexed += without_id
+        else:
+            # The backend (e.g. MySQL) does not return the ids of bulk-inserted rows: save them one by one, which
+            # indexes them through the post_save signal.
+            for item in without_id:
+                item.save(force_insert=True)
+
+        # bulk_create sends no signals, so index the bulk-written items explicitly.
+        search.index_items([item.pk for item in indexed])
+        return len(with_id) + len(without_id)
+
+    def _write_rating(self, rows):
+        # Resolve the usernames not seen before with one query per batch.
+        unknown = {row['user'] for row in rows} - self.user_ids.keys()
+        if unknown:
+            self.user_ids.update(User.objects.filter(username__in=unknown).values_list('username', 'pk'))
+        submitted_ids = {parse_int(row.get('item_id')) for row in rows} - {None}
+        item_ids = set(Item.objects.filter(pk__in=submitted_ids).values_list('pk', flat=True))
+
+        ratings = {}
+        for row in rows:
+            user_id = self.user_ids.get(row['user'])
+            item_id, score = parse_int(row.get('item_id')), parse_int(row.get('score'))
+            if item_id is None or score is None:
+                self.error(
+                    f'Rating of item {row.get("item_id")!r} by {row["user"]!r}: item_id and score must be integers.'
+                )
+                continue
+            if user_id is None or item_id not in item_ids or not 1 <= score <= 5:
+                self.error(f'Rating of item {item_id} by {row["user"]!r}: unknown user or item, or invalid score.')
+                continue
+            ratings[(item_id, user_id)] = Rating(item_id=item_id, user_id=user_id, score=score)
+
+        Rating.objects.bulk_create(
+            list(ratings.values()), update_conflicts=True, unique_fields=['item', 'user'], update_fields=['score']
+        )
+        # Bring the aggregates of the rated items up to date with two set-based statements.
+        recompute_rating_aggregates(Item.objects.filter(pk__in={item_id for item_id, _user_id in ratings}))
+        return len(ratings)
+
+
+class Command(BaseCommand):
+    """
+    Streams the catalog (categories, bands, items and ratings) in or out as JSON Lines or CSV in bounded memory.
+
+    JSON Lines records carry a "model" key ("category", "band", "item" or "rating") so one file can hold every kind;
+    a CSV file holds a single kind, given with --model. Items reference their band and category by name and ratings
+    reference their user by username, so exports can be imported into another database.
+
+    Usage:
+        python manage.py catalog_data import catalog.jsonl [--batch-size N]
+        python manage.py catalog_data import items.csv --format csv --model item
+        python manage.py catalog_data export --output catalog.jsonl [--model item] [--chunk-size N]
+    """
+    help = 'Imports or exports the catalog as JSON Lines or CSV, streaming in batches.'
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action', required=True)
+
+        import_parser = subparsers.add_parser('import', help='Upsert records from a file (or - for stdin).')
+        import_parser.add_argument('path')
+        import_parser.add_argument('--format', choices=['jsonl', 'csv'], default='jsonl')
+        import_parser.add_argument('--model', choices=KINDS, help='Record kind of a CSV file.')
+        import_parser.add_argument('--batch-size', type=int, default=1000, help='Rows per bulk_create transaction.')
+
+        export_parser = subparsers.add_parser('export', help='Write records to a file (or stdout).')
+        export_parser.add_argument('--output', default='-')
+        export_parser.add_argument('--format', choices=['jsonl', 'csv'], default='jsonl')
+        export_parser.add_argument('--model', choices=KINDS, help='Export one kind only (required for CSV).')
+        export_parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched per database round-trip.')
+
+    def handle(self, *args, **options):
+        if options['format'] == 'csv' and not options['model']:
+            raise CommandError('--model is required with --format csv.')
+        self.started = time.monotonic()
+        self.total = 0
+        if options['action'] == 'import':
+            self.import_records(options)
+        else:
+            self.export_records(options)
+
+    def progress(self, kind, count, message=None):
+        """
+        Reports progress (on stderr, so exports to stdout stay clean) with the overall throughput.
+        """
+        if message:
+            self.stderr.write(self.style.WARNING(message))
+            return
+        self.total += count
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        self.stderr.write(f'{kind}: +{count} rows ({self.total} total, {self.total / elapsed:,.0f} rows/s)')
+
+    def import_records(self, options):
+        importer = Importer(options['batch_size'], self.progress)
+        source = sys.stdin if options['path'] == '-' else open(options['path'], newline='', encoding='utf-8')
+        try:
+            if options['format'] == 'csv':
+                for row in csv.DictReader(source):
+                    # Text cells may be escaped as the admin CSV export writes them.
+                    importer.add(options['model'], {key: unescape_formula(value) for key, value in row.items()})
+            else:
+                for line_number, line in enumerate(source, start=1):
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError as e:
+                        raise CommandError(f'Line {line_number}: invalid JSON ({e}).')
+                    importer.add(options['model'] or record.pop('model', None), record)
+            importer.finish()
+        finally:
+            if source is not sys.stdin:
+                source.close()
+
+        # Bulk writes send no signals, so invalidate the cached pages built from the imported models.
+        for model in (Category, Band, Item):
+            cache.bump_model_version(model)
+
+        elapsed = time.monotonic() - self.started
+        summary = ', '.join(f'{count} {kind}' for kind, count in importer.written.items())
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {summary} in {elapsed:.2f}s ({importer.errors} rows skipped).'
+        ))
+
+    def export_records(self, options):
+        querysets = {
+            'category': Category.objects.order_by('pk').values_list('name'),
+            'band': Band.objects.order_by('pk').values_list('name', 'genre'),
+            'item': Item.objects.order_by('pk').values_list(
+                'id', 'name', 'description', 'price', 'category__name', 'band__name', 'image', 'is_featured'
+            ),
+            'rating': Rating.objects.order_by('pk').values_list('item_id', 'user__username', 'score'),
+        }
+        kinds = [options['model']] if options['model'] else list(KINDS)
+        output = sys.stdout if options['output'] == '-' else open(options['output'], 'w', newline='', encoding='utf-8')
+        try:
+            writer = csv.writer(output) if options['format'] == 'csv' else None
+            for kind in kinds:
+                if writer:
+                    writer.writerow(COLUMNS[kind])
+                count = 0
+                # iterator() streams rows from the database cursor without caching the whole queryset.
+                for row in querysets[kind].iterator(chunk_size=options['chunk_size']):
+                    if writer:
+                        writer.writerow(row)
+                    else:
+                        record = {'model': kind, **dict(zip(COLUMNS[kind], row))}
+                        output.write(json.dumps(record, default=str) + '\n')
+                    count += 1
+                    if count % options['chunk_size'] == 0:
+                        self.progress(kind, options['chunk_size'])
+                self.progress(kind, count % options['chunk_size'])
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+        elapsed = time.monotonic() - self.started
+        self.stderr.write(self.style.SUCCESS(f'Exported {self.total} rows in {elapsed:.2f}s.'))
@@ -0,0 +1,65 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import benchmark
+
+
+class Command(BaseCommand):
+    """
+    Compares the throughput of the read-heavy catalog routes served through WSGI (synchronous views) and through ASGI
+    (native async views) with the same number of concurrent requests.
+
+    Each interface is measured in its own process, because the views routed depend on the CATALOG_ASYNC_VIEWS setting
+    read at startup. Run it against a realistic dataset (see generate_catalog).
+
+    Usage: python manage.py compare_interfaces [--concurrency N] [--requests N] [--interface wsgi|asgi]
+    """
+    help = 'Compares WSGI and ASGI throughput of the read-heavy catalog routes at the same concurrency.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight at any time.')
+        parser.add_argument('--requests', type=int, default=500, help='Requests per interface.')
+        parser.add_argument('--interface', choices=['wsgi', 'asgi'],
+                            help='Measure one interface in this process and print the result as JSON.')
+
+    def handle(self, *args, **options):
+        if options['interface']:
+            try:
+                result = benchmark.measure_throughput(options['interface'], options['concurrency'], options['requests'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write(json.dumps(result))
+            return
+
+        results = [self.measure(interface, options) for interface in ('wsgi', 'asgi')]
+        self.stdout.write(f'{"interface":<10} {"views":<6} {"req/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} '
+                          f'{"errors":>7}')
+        for result in results:
+            views = 'async' if result['async_views'] else 'sync'
+            self.stdout.write(f'{result["interface"]:<10} {views:<6} {result["requests_per_second"]:>9} '
+                              f'{result["p50_ms"]:>9.2f} {result["p95_ms"]:>9.2f} {result["p99_ms"]:>9.2f} '
+                              f'{result["errors"]:>7}')
+        wsgi, asgi = results
+        ratio = asgi['requests_per_second'] / wsgi['requests_per_second'] if wsgi['requests_per_second'] else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'ASGI served {ratio:.2f}x the WSGI throughput at a concurrency of {options["concurrency"]}.'
+        ))
+
+    def measure(self, interface, options):
+        # A fresh process per interface, with the views that interface is deployed with.
+        environment = {**os.environ, 'CATALOG_ASYNC_VIEWS': 'true' if interface == 'asgi' else 'false'}
+        command = [
+            sys.executable, '-m', 'django', 'compare_interfaces', '--interface', interface,
+            '--concurrency', str(options['concurrency']), '--requests', str(options['requests']),
+        ]
+        if 'DJANGO_SETTINGS_MODULE' not in environment:
+            command += ['--settings', settings.SETTINGS_MODULE]
+        completed = subprocess.run(command, env=environment, cwd=settings.BASE_DIR, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise CommandError(f'Measuring {interface} failed:\n{completed.stderr}')
+        return json.loads(completed.stdout.strip().splitlines()[-1])
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from catalog import recommendations
+
+
+class Command(BaseCommand):
+    """
+    Computes the "fans who rated this also liked" recommendations shown on the item pages from the Rating table.
+
+    Run it with --incremental on a schedule (e.g. hourly) to refresh the items rated since the last run, and without
+    it from time to time (e.g. nightly) to recompute every item.
+
+    Usage: python manage.py compute_recommendations [--incremental] [--top-k N] [--max-pairs N]
+    """
+    help = 'Computes the item-to-item recommendations from the ratings (requires NumPy and SciPy).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only recompute the items rated since the previous run.')
+        parser.add_argument('--top-k', type=int, help='Number of recommendations kept per item.')
+        parser.add_argument('--max-pairs', type=int,
+                            help='Most similarity entries held in memory at once (lower it to use less memory).')
+
+    def handle(self, *args, **options):
+        settings = recommendations.get_options()
+        if options['top_k']:
+            settings['TOP_K'] = options['top_k']
+        if options['max_pairs']:
+            settings['MAX_PAIRS'] = options['max_pairs']
+
+        stats = recommendations.compute(incremental=options['incremental'], options=settings)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['mode'].capitalize()} computation from {stats['ratings']} ratings: "
+            f"recomputed {stats['recomputed']} items, merged {stats['merged']}, "
+            f"wrote {stats['rows']} recommendations in {stats['seconds']:.2f}s."
+        ))
@@ -0,0 +1,216 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from catalog import cache
+from catalog.models import Band, Category, Item, Rating, SearchHistory
+
+# Row counts of each scale preset; individual counts can be overridden with the matching option.
+SCALES = {
+    'small': {'categories': 12, 'bands': 50, 'items': 1000, 'users': 200, 'ratings': 10000, 'searches': 50000},
+    'medium': {'categories': 24, 'bands': 500, 'items': 10000, 'users': 2000, 'ratings': 100000, 'searches': 500000},
+    'large': {'categories': 48, 'bands': 5000, 'items': 100000, 'users': 20000, 'ratings': 1000000,
+              'searches': 5000000},
+}
+
+CATEGORY_NAMES = ['T-Shirts', 'Hoodies', 'Vinyl', 'CDs', 'Posters', 'Patches', 'Caps', 'Mugs', 'Tote Bags',
+                  'Pins', 'Jackets', 'Cassettes']
+GENRES = ['Heavy Metal', 'Hard Rock', 'Punk', 'Grunge', 'Thrash Metal', 'Doom Metal', 'Glam Rock', 'Prog Rock',
+          'Alternative', 'Stoner Rock']
+ADJECTIVES = ['Iron', 'Black', 'Electric', 'Burning', 'Silent', 'Savage', 'Crimson', 'Frozen', 'Broken', 'Wild',
+              'Steel', 'Howling', 'Midnight', 'Atomic', 'Thunder', 'Hollow']
+NOUNS = ['Wolves', 'Serpents', 'Riders', 'Ravens', 'Machines', 'Prophets', 'Giants', 'Skulls', 'Storms', 'Kings',
+         'Vipers', 'Saints', 'Ghosts', 'Hammers', 'Engines', 'Pilgrims']
+ITEM_KINDS = ['Tour Shirt', 'Logo Hoodie', 'LP', 'Live CD', 'Poster', 'Patch', 'Snapback', 'Mug', 'Tote', 'Pin',
+              'Denim Jacket', 'Tape']
+
+# Relative frequency of each rating score (1 to 5 stars).
+SCORE_WEIGHTS = [5, 10, 20, 35, 30]
+
+
+class Command(BaseCommand):
+    """
+    Generates a reproducible synthetic catalog for load testing and benchmarking.
+
+    Categories, bands, items, users, ratings and search history rows are written with bulk_create in batches, so
+    even the 'large' scale (100k items, 5k bands, 1M ratings, 5M searches) runs in bounded memory. The same --seed
+    always produces the same rows. Every generated name starts with --prefix; the command refuses to run if rows
+    with that prefix already exist, so generate into an empty or disposable database.
+
+    Usage:
+        python manage.py generate_catalog [--scale small|medium|large] [--seed N] [--items N] [--ratings N] ...
+    """
+    help = 'Generates a reproducible synthetic catalog at a chosen scale with bulk inserts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=list(SCALES), default='small', help='Row count preset.')
+        for kind in SCALES['small']:
+            parser.add_argument(f'--{kind}', type=int, help=f'Number of {kind} (overrides the preset).')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed; the same seed gives the same data.')
+        parser.add_argument('--prefix', default='Synthetic', help='Prefix of every generated name.')
+        parser.add_argument('--days', type=int, default=90, help='Search history spans this many days back.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk_create transaction.')
+
+    def handle(self, *args, **options):
+        counts = {kind: options[kind] if options[kind] is not None else default
+                  for kind, default in SCALES[options['scale']].items()}
+        needs_users = counts['ratings'] or counts['searches']
+        if counts['categories'] < 1 or counts['bands'] < 1 or (needs_users and counts['users'] < 1):
+            raise CommandError('At least one category and band, and one user for ratings or searches, are required.')
+
+        self.prefix = options['prefix']
+        if Band.objects.filter(name__startswith=f'{self.prefix} ').exists():
+            raise CommandError(f'Synthetic rows with the prefix {self.prefix!r} already exist; '
+                               f'use another --prefix or an empty database.')
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.started = time.monotonic()
+
+        category_ids = self.create_categories(counts['categories'])
+        band_ids = self.create_bands(counts['bands'])
+        item_ids, vocabulary = self.create_items(counts['items'], category_ids, band_ids)
+        user_ids = self.create_users(counts['users'])
+        self.create_ratings(counts['ratings'], user_ids, item_ids)
+        self.create_searches(counts['searches'], user_ids, vocabulary, options['days'])
+
+        # bulk_create sends no signals: bring the derived data up to date and invalidate the cached pages.
+        call_command('recompute_rating_aggregates', stdout=self.stderr)
+        call_command('rebuild_search_index', stdout=self.stderr)
+        for model in (Category, Band, Item):
+            cache.bump_model_version(model)
+
+        elapsed = time.monotonic() - self.started
+        summary = ', '.join(f'{count} {kind}' for kind, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'Generated {summary} in {elapsed:.2f}s.'))
+
+    def write(self, model, rows):
+        """
+        Inserts rows with bulk_create in batches, one transaction per batch, reporting progress.
+
+        :param model: The model class.
+        :param rows: An iterable of unsaved instances, consumed lazily.
+        """
+        total, batch = 0, []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                total += self.flush(model, batch)
+                batch = []
+        if batch:
+            total += self.flush(model, batch)
+        return total
+
+    def flush(self, model, batch):
+        with transaction.atomic():
+            model.objects.bulk_create(batch)
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        self.stderr.write(f'{model.__name__}: +{len(batch)} rows ({elapsed:.1f}s)')
+        return len(batch)
+
+    def created_ids(self, model, before):
+        # bulk_create does not return primary keys on every backend, so read back the rows just inserted.
+        return list(model.objects.filter(pk__gt=before).order_by('pk').values_list('pk', flat=True))
+
+    def max_pk(self, model):
+        return model.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+
+    def create_categories(self, count):
+        before = self.max_pk(Category)
+        self.write(Category, (
+            Category(name=f'{self.prefix} {CATEGORY_NAMES[index % len(CATEGORY_NAMES)]}'
+                          + (f' {index // len(CATEGORY_NAMES) + 1}' if index >= len(CATEGORY_NAMES) else ''))
+            for index in range(count)
+        ))
+        return self.created_ids(Category, before)
+
+    def create_bands(self, count):
+        before = self.max_pk(Band)
+        rng = self.rng
+        self.write(Band, (
+            Band(
+                name=f'{self.prefix} {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {index + 1}',
+                genre=rng.choice(GENRES),
+            )
+            for index in range(count)
+        ))
+        return self.created_ids(Band, before)
+
+    def create_items(self, count, category_ids, band_ids):
+        """
+        Creates the items, spread over the bands and categories.
+
+        :return: An (item ids, search vocabulary) tuple; the vocabulary holds the words searches are drawn from.
+        """
+        before = self.max_pk(Item)
+        rng = self.rng
+        band_names = dict(Band.objects.filter(pk__in=band_ids).values_list('pk', 'name'))
+
+        def items():
+            for index in range(count):
+                band_id = rng.choice(band_ids)
+                kind = rng.choice(ITEM_KINDS)
+                yield Item(
+                    name=f'{band_names[band_id].removeprefix(self.prefix + " ")} {kind}',
+                    description=f'Official {kind.lower()} by {band_names[band_id]}. Synthetic item #{index + 1}.',
+                    price=Decimal(rng.randint(500, 15000)) / 100,
+                    category_id=rng.choice(category_ids),
+                    band_id=band_id,
+                    is_featured=rng.random() < 0.01,
+                )
+
+        self.write(Item, items())
+        vocabulary = [word.lower() for word in ADJECTIVES + NOUNS + ITEM_KINDS + GENRES]
+        return self.created_ids(Item, before), vocabulary
+
+    def create_users(self, count):
+        before = self.max_pk(User)
+        # Hash once: every synthetic user gets the same unusable password.
+        password = make_password(None)
+        self.write(User, (
+            User(username=f'{self.prefix.lower()}_{index + 1}', password=password) for index in range(count)
+        ))
+        return self.created_ids(User, before)
+
+    def create_ratings(self, count, user_ids, item_ids):
+        rng = self.rng
+        count = min(count, len(user_ids) * len(item_ids))
+        per_user, extra = divmod(count, len(user_ids)) if user_ids else (0, 0)
+
+        def ratings():
+            for index, user_id in enumerate(user_ids):
+                # Sampling without replacement keeps (item, user) unique.
+                for item_id in rng.sample(item_ids, per_user + (index < extra)):
+                    score = rng.choices(range(1, 6), weights=SCORE_WEIGHTS)[0]
+                    yield Rating(item_id=item_id, user_id=user_id, score=score)
+
+        self.write(Rating, ratings())
+
+    def create_searches(self, count, user_ids, vocabulary, days):
+        rng = self.rng
+        # Zipf-like popularity, so a few queries dominate as they do in real search logs.
+        cumulative, total = [], 0.0
+        for rank in range(len(vocabulary)):
+            total += 1 / (rank + 1)
+            cumulative.append(total)
+        now = timezone.now()
+        span = days * 86400
+
+        def searches():
+            for _index in range(count):
+                query = ' '.join(rng.choices(vocabulary, cum_weights=cumulative, k=rng.choice((1, 1, 2))))
+                yield SearchHistory(
+                    user_id=rng.choice(user_ids),
+                    query=query,
+                    timestamp=now - timedelta(seconds=rng.randrange(span)),
+                )
+
+        self.write(SearchHistory, searches())
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog import search
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the catalog search index from scratch.
+
+    Usage: python manage.py rebuild_search_index [--batch-size N]
+    """
+    help = 'Rebuilds the catalog search index (SQLite FTS5 or the built-in inverted index).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of items indexed per batch.')
+
+    def handle(self, *args, **options):
+        backend = search.get_backend()
+        self.stdout.write(f'Rebuilding the search index using the "{backend.name}" backend...')
+
+        started = time.monotonic()
+        total = search.rebuild_index(batch_size=options['batch_size'])
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} items in {elapsed:.2f}s.'))
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.models import Item
+from catalog.ratings import recompute_rating_aggregates
+
+
+class Command(BaseCommand):
+    """
+    Recomputes the denormalized rating aggregates of every item from the Rating table.
+
+    Items are processed in primary key ranges so each transaction stays short.
+
+    Usage: python manage.py recompute_rating_aggregates [--batch-size N]
+    """
+    help = 'Recomputes Item.rating_count, rating_sum and rating_average from the Rating table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Number of items updated per transaction.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        started = time.monotonic()
+        total = 0
+
+        # Walk the primary keys in ranges; each range is recomputed with two set-based UPDATE statements.
+        last_pk = 0
+        while True:
+            remaining = Item.objects.filter(pk__gt=last_pk)
+            # The primary key closing this batch, or None when fewer than batch_size items remain.
+            boundary = list(remaining.order_by('pk').values_list('pk', flat=True)[batch_size - 1:batch_size])
+            if not boundary:
+                total += recompute_rating_aggregates(remaining)
+                break
+            total += recompute_rating_aggregates(remaining.filter(pk__lte=boundary[0]))
+            last_pk = boundary[0]
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'Recomputed rating aggregates for {total} items in {elapsed:.2f}s.'))
@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from catalog import search_analytics
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the hourly and daily search rollups of the last days from the SearchHistory table, and deletes the hourly
+    rollups older than CATALOG_SEARCH_ANALYTICS['HOURLY_RETENTION_DAYS'].
+
+    The rollups are kept up to date as searches are logged; run it once after upgrading, after importing searches, or
+    daily with --prune-only to bound the size of the hourly rollups.
+
+    Usage: python manage.py rollup_searches [--days N] [--prune-only]
+    """
+    help = 'Rebuilds the search rollups from the search history and prunes the expired hourly rollups.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=search_analytics.DEFAULTS['HOURLY_RETENTION_DAYS'],
+                            help='Number of days rebuilt, today included.')
+        parser.add_argument('--prune-only', action='store_true', help='Only delete the expired hourly rollups.')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError('--days must be at least 1.')
+        now = timezone.now()
+        if not options['prune_only']:
+            start = now - timedelta(days=options['days'] - 1)
+            # Count the results the search results page would show.
+            read = search_analytics.rebuild(start, now, getattr(settings, 'CATALOG_PAGE_SIZE', 24))
+            self.stdout.write(f'Rolled up {read} searches of the last {options["days"]} days.')
+        pruned = search_analytics.prune(now)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {pruned} expired hourly rollups.'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import vendor
+
+
+class Command(BaseCommand):
+    """
+    Downloads the pinned Bootstrap, jQuery and Google Fonts assets into catalog/static/catalog/vendor/, so the pages
+    stop loading them from third-party CDNs. Commit the files, then run collectstatic.
+
+    Usage: python manage.py vendor_assets [--only bootstrap.css fonts.css]
+    """
+    help = 'Downloads the third-party front-end assets so they are served with the static files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', nargs='+', choices=sorted(vendor.VENDOR_ASSETS), help='Vendor only these assets.')
+
+    def handle(self, *args, **options):
+        for name in options['only'] or vendor.VENDOR_ASSETS:
+            try:
+                written = vendor.vendor_asset(name)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Could not vendor {name}: {e}')
+            for path in written:
+                self.stdout.write(f'Wrote {path}')
+        self.stdout.write(self.style.SUCCESS('Run `python manage.py collectstatic` to publish the assets.'))
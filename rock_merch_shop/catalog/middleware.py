@@ -0,0 +1,236 @@
+import random
+from urllib.parse import urlsplit
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+from . import cache, instrumentation, routers
+from .staticfiles import StaticFileIndex
+
+
+class RequestInstrumentationMiddleware:
+    """
+    Records the SQL statements, SQL time, template render time and latency of a sample of requests.
+
+    The statements are recorded by the execute wrapper every database connection carries (see
+    catalog.instrumentation), so they are seen with DEBUG=False too. Finished requests are aggregated per URL name in
+    catalog.instrumentation.store and can be read from the staff-only request_stats view. With
+    CATALOG_INSTRUMENTATION['RESPONSE_HEADER'] set, sampled responses also carry a Server-Timing header and an
+    X-Query-Count header.
+
+    The middleware runs natively under both WSGI and ASGI; the metrics follow the request through sync_to_async
+    because they are held in a context variable.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        options = instrumentation.get_options()
+        if not self.sampled(options):
+            return self.get_response(request)
+
+        metrics = instrumentation.RequestMetrics()
+        token = instrumentation.activate(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            instrumentation.deactivate(token)
+        return self.finish(request, response, metrics, options)
+
+    async def __acall__(self, request):
+        options = instrumentation.get_options()
+        if not self.sampled(options):
+            return await self.get_response(request)
+
+        metrics = instrumentation.RequestMetrics()
+        token = instrumentation.activate(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            instrumentation.deactivate(token)
+        return self.finish(request, response, metrics, options)
+
+    @staticmethod
+    def sampled(options):
+        return options['ENABLED'] and random.random() < options['SAMPLE_RATE']
+
+    def finish(self, request, response, metrics, options):
+        instrumentation.store.record(
+            self.view_name(request), metrics, options['REPEAT_THRESHOLD'], options['MAX_PATTERNS']
+        )
+        if options['RESPONSE_HEADER']:
+            response['Server-Timing'] = (
+                f'sql;dur={metrics.sql_time * 1000:.1f}, '
+                f'render;dur={metrics.render_time * 1000:.1f}, '
+                f'total;dur={metrics.elapsed() * 1000:.1f}'
+            )
+            response['X-Query-Count'] = str(metrics.query_count)
+        return response
+
+    @staticmethod
+    def view_name(request):
+        """
+        Returns the name requests are aggregated under: the namespaced URL name, or the route if it has no name.
+        """
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return '<unresolved>'
+        return match.view_name or match.route
+
+
+class StaticAssetMiddleware:
+    """
+    Serves the collected static files (see catalog/staticfiles.py) when Django runs without a web server in front.
+
+    Enabled with the CATALOG_SERVE_STATIC setting; run `python manage.py collectstatic` first. Files are looked up in
+    an index of STATIC_ROOT built at startup, and each request gets the best variant it accepts: the WebP version of
+    an image for clients accepting image/webp, otherwise the Brotli or gzip version of a text asset according to
+    Accept-Encoding. Content-hashed files are cached for a year as immutable; other files are revalidated with
+    Last-Modified after STATIC_MAX_AGE seconds.
+    """
+    sync_capable = True
+    async_capable = True
+
+    IMMUTABLE = 'public, max-age=31536000, immutable'
+    STATIC_MAX_AGE = 60
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'CATALOG_SERVE_STATIC', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.index = StaticFileIndex(settings.STATIC_ROOT, urlsplit(settings.STATIC_URL).path)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        response = self.serve(request)
+        return response if response is not None else self.get_response(request)
+
+    async def __acall__(self, request):
+        response = self.serve(request)
+        return response if response is not None else await self.get_response(request)
+
+    def serve(self, request):
+        """
+        Returns the response serving a static file, or None when the request is not for a collected file.
+        """
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        static_file = self.index.get(request.path)
+        if static_file is None:
+            return None
+
+        path, content_type, encoding = static_file.path, static_file.content_type, None
+        vary = []
+        if static_file.webp:
+            vary.append('Accept')
+            if 'image/webp' in request.META.get('HTTP_ACCEPT', ''):
+                path, content_type = static_file.webp[0], 'image/webp'
+        if static_file.encodings:
+            vary.append('Accept-Encoding')
+            accepted = self.accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+            encoding = next((name for name in static_file.encodings if name in accepted), None)
+            if encoding:
+                path = static_file.encodings[encoding][0]
+
+        if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), static_file.mtime):
+            response = HttpResponseNotModified()
+        else:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['Last-Modified'] = http_date(static_file.mtime)
+        response['Cache-Control'] = (
+            self.IMMUTABLE if static_file.immutable else f'public, max-age={self.STATIC_MAX_AGE}'
+        )
+        patch_vary_headers(response, vary)
+        return response
+
+    @staticmethod
+    def accepted_encodings(header):
+        """
+        Returns the content codings an Accept-Encoding header accepts (those without q=0).
+        """
+        accepted = set()
+        for part in header.split(','):
+            coding, _separator, parameters = part.partition(';')
+            quality = 1.0
+            for parameter in parameters.split(';'):
+                name, _equals, value = parameter.strip().partition('=')
+                if name == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            if quality > 0:
+                accepted.add(coding.strip().lower())
+        return accepted
+
+
+class PrimaryPinningMiddleware:
+    """
+    Pins the reads of a user who just wrote to the primary database (see catalog/routers.py).
+
+    A request carrying the pinning cookie reads from the primary only. A request that writes sets the cookie for
+    CATALOG_DATABASE_ROUTING['STICKY_SECONDS'], so the user's following requests do not read from a replica that has
+    not caught up with the write yet. Requests of other users keep reading from the replicas, except for a few
+    seconds after a catalog edit invalidated the cached pages (see catalog.cache.primary_pinned), so that the pages
+    cached again are not rendered from stale rows.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not routers.replica_aliases():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.options = routers.get_options()
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        state = routers.RoutingState(pinned=self.pinned(request))
+        token = routers.activate(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.deactivate(token)
+        return self.finish(response, state)
+
+    async def __acall__(self, request):
+        state = routers.RoutingState(pinned=self.pinned(request))
+        token = routers.activate(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            routers.deactivate(token)
+        return self.finish(response, state)
+
+    def pinned(self, request):
+        return self.options['COOKIE_NAME'] in request.COOKIES or cache.primary_pinned()
+
+    def finish(self, response, state):
+        if state.wrote:
+            response.set_cookie(self.options['COOKIE_NAME'], '1', max_age=self.options['STICKY_SECONDS'], httponly=True,
+                                samesite='Lax')
+        return response
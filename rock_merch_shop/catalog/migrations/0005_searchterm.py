@@ -0,0 +1,47 @@
+# Generated by Django 5.0.3 on 2026-10-18 09:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.utils import OperationalError
+
+
+def create_fts_table(apps, schema_editor):
+    # The FTS5 index only exists on SQLite builds that ship the extension; other setups use SearchTerm instead.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS catalog_item_fts "
+            "USING fts5(name, band, category, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+    except OperationalError:
+        pass
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS catalog_item_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0004_rating'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.PositiveIntegerField(default=1)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='catalog.item')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['term', 'item'], name='catalog_searchterm_term_idx')],
+                'unique_together': {('item', 'term')},
+            },
+        ),
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.0.3 on 2026-10-18 09:42
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    # Populate the new columns from the existing ratings with a single grouped query.
+    Item = apps.get_model('catalog', 'Item')
+    Rating = apps.get_model('catalog', 'Rating')
+    totals = Rating.objects.values('item_id').annotate(count=Count('pk'), total=Sum('score')).order_by()
+    items = []
+    for row in totals:
+        items.append(Item(
+            pk=row['item_id'],
+            rating_count=row['count'],
+            rating_sum=row['total'],
+            rating_average=row['total'] / row['count'],
+        ))
+    Item.objects.bulk_update(items, ['rating_count', 'rating_sum', 'rating_average'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0005_searchterm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='rating_average',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.3 on 2026-10-18 09:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0006_item_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='image_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=16),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.3 on 2026-10-18 09:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0008_searchhistory_timestamp_default'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('is_featured', True)), fields=['id'], name='catalog_item_featured_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['category', '-rating_average', '-rating_count', 'id'], name='catalog_item_cat_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['category', '-rating_count', '-rating_average', 'id'], name='catalog_item_cat_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchhistory',
+            index=models.Index(fields=['user', '-timestamp', '-id'], name='catalog_sh_user_time_idx'),
+        ),
+        # Dropped after the composite index exists: MySQL needs an index covering user_id for the foreign key.
+        migrations.AlterField(
+            model_name='searchhistory',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
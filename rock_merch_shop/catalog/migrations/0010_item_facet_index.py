@@ -0,0 +1,17 @@
+# Generated by Django 5.0.3 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0009_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['category', 'band', 'price', 'rating_average'], name='catalog_item_facet_idx'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.db import migrations
+
+from catalog.search import FTS_TABLE, weighted_terms
+
+BATCH_SIZE = 1000
+
+
+def index_existing_items(apps, schema_editor):
+    # Items saved before migration 0005 created the search index (or loaded as fixtures before their saves were
+    # indexed) are not in it; rebuild the index the search backend will read from the whole item table.
+    Item = apps.get_model('catalog', 'Item')
+    SearchTerm = apps.get_model('catalog', 'SearchTerm')
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        fts = (
+            connection.vendor == 'sqlite'
+            and getattr(settings, 'CATALOG_SEARCH_BACKEND', 'auto') != 'inverted'
+            and FTS_TABLE in connection.introspection.table_names(cursor)
+        )
+    rows = (
+        Item.objects.using(connection.alias).order_by('pk')
+        .values_list('id', 'name', 'band__name', 'category__name')
+        .iterator(chunk_size=BATCH_SIZE)
+    )
+
+    def write(batch):
+        if fts:
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f'INSERT INTO {FTS_TABLE} (rowid, name, band, category) VALUES (%s, %s, %s, %s)', batch
+                )
+            return
+        SearchTerm.objects.using(connection.alias).bulk_create([
+            SearchTerm(term=token, item_id=item_id, weight=weight)
+            for item_id, name, band_name, category_name in batch
+            for token, weight in weighted_terms(name, band_name, category_name).items()
+        ], batch_size=500)
+
+    if fts:
+        schema_editor.execute(f'DELETE FROM {FTS_TABLE}')
+    else:
+        SearchTerm.objects.using(connection.alias).all().delete()
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            write(batch)
+            batch = []
+    if batch:
+        write(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0015_item_image_width'),
+    ]
+
+    operations = [
+        migrations.RunPython(index_existing_items, migrations.RunPython.noop),
+    ]
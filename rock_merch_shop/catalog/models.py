@@ -1,6 +1,6 @@
-from django.db.models import Avg
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 # Create your models here.
 class Category(models.Model):
@@ -57,9 +57,14 @@ class Item(models.Model):
         - band (ForeignKey): A reference to the Band model, indicating the band associated with this item.
         - image (ImageField): An image of the item. Stored in 'item_images/' directory.
         - is_featured (BooleanField): A flag to indicate whether the item is featured on the homepage or not.
+        - rating_count (PositiveIntegerField): The number of ratings the item has received (denormalized).
+        - rating_sum (PositiveIntegerField): The sum of all rating scores of the item (denormalized).
+        - rating_average (FloatField): The average rating score of the item, or 0 without ratings (denormalized).
+        - image_hash (CharField): The content hash naming the image's resized derivatives, empty until generated.
+        - image_width (PositiveIntegerField): The width in pixels of the image the derivatives were generated from.
 
     Methods:
-        - average_rating(self): Calculates the average rating of the item based on user reviews.
+        - average_rating(self): Returns the average rating of the item based on user reviews.
         - total_ratings(self): Returns the total number of ratings the item has received.
         - __str__(self): Returns the name of the item as its string representation.
         """
@@ -70,22 +75,44 @@ class Item(models.Model):
     band = models.ForeignKey(Band, on_delete=models.CASCADE)
     image = models.ImageField(upload_to='item_images/', blank=True, null=True)
     is_featured = models.BooleanField(default=False)
+    # Rating aggregates, maintained incrementally by catalog.ratings so list pages never aggregate per item.
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_average = models.FloatField(default=0, editable=False)
+    # Content hash of the image whose derivatives (see catalog.thumbnails) have been generated.
+    image_hash = models.CharField(max_length=16, blank=True, default='', editable=False)
+    # Its width, which tells the presets generated for it (smaller images are not upscaled).
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+
+    class Meta:
+        # Indexes follow the queries of catalog/views.py; catalog/tests.py checks their plans with EXPLAIN.
+        indexes = [
+            # Home page carousel: only the few featured items are indexed.
+            models.Index(fields=['id'], condition=models.Q(is_featured=True), name='catalog_item_featured_idx'),
+            # Item list sorted by rating and by popularity within a category, in the exact ITEM_SORTS orderings.
+            models.Index(fields=['category', '-rating_average', '-rating_count', 'id'],
+                         name='catalog_item_cat_rating_idx'),
+            models.Index(fields=['category', '-rating_count', '-rating_average', 'id'],
+                         name='catalog_item_cat_popular_idx'),
+            # Facet counts of a category (see catalog/facets.py), computed from the index alone.
+            models.Index(fields=['category', 'band', 'price', 'rating_average'], name='catalog_item_facet_idx'),
+        ]
 
     def average_rating(self):
         """
-        Calculates the average rating of the item.
+        Returns the average rating of the item from the stored aggregate, without querying the ratings.
 
         :return: The average rating as a float, or 0 if the item has no ratings.
         """
-        return self.ratings.aggregate(Avg('score'))['score__avg'] or 0
+        return self.rating_average
 
     def total_ratings(self):
         """
-        Returns the total number of ratings that the item has received.
+        Returns the total number of ratings that the item has received from the stored aggregate.
 
         :return: The total number of ratings as an integer.
         """
-        return self.ratings.count()
+        return self.rating_count
 
     def __str__(self):
         """
@@ -102,14 +129,28 @@ class SearchHistory(models.Model):
     Attributes:
         - user (ForeignKey): A reference to the User model, indicating which user performed the search.
         - query (CharField): The search query string that was input by the user.
-        - timestamp (DateTimeField): The date and time when the search was performed, automatically set to the current time.
+        - timestamp (DateTimeField): The date and time when the search was performed, defaulting to the current time.
+          It is set when the search is made, not when the buffered record is written (see catalog.search_log). For
+          collapsed repeats, it is the time of the latest one.
+        - count (PositiveIntegerField): The number of consecutive identical searches the record stands for (see
+          COLLAPSE_WINDOW in catalog.search_log).
 
     Methods:
         - __str__(self): Returns a string representation of the SearchHistory instance, showing the user and their query.
         """
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # The composite index below starts with the user, so the foreign key needs no index of its own.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     query = models.CharField(max_length=255)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+    count = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            # A user's history, newest first, as listed by the search_history view.
+            models.Index(fields=['user', '-timestamp', '-id'], name='catalog_sh_user_time_idx'),
+            # Every user's searches in a time range, in time order, as read by the staff export and the rollups.
+            models.Index(fields=['timestamp', 'id'], name='catalog_sh_time_idx'),
+        ]
 
     def __str__(self):
         """
@@ -119,6 +160,50 @@ class SearchHistory(models.Model):
         """
         return f'{self.user.username}: {self.query}'
 
+class SearchRollup(models.Model):
+    """
+    Represents the number of searches of one normalized query during one hour or one day.
+
+    The rollups are updated as buffered searches are written (see catalog/search_analytics.py), so the trending and
+    zero-result reports read them instead of scanning SearchHistory.
+
+    Attributes:
+        - period (CharField): The bucket length, 'hour' or 'day'.
+        - bucket_start (DateTimeField): The start of the bucket, in UTC.
+        - query (CharField): The normalized query (lowercased tokens without diacritics, separated by spaces).
+        - searches (PositiveIntegerField): The number of searches of the query during the bucket.
+        - zero_result_searches (PositiveIntegerField): The number of those searches that found nothing.
+        - results (PositiveIntegerField): The number of results shown by the latest of those searches, at most one page.
+
+    Meta:
+        - constraints: A unique (period, bucket_start, query) constraint; its index serves the reports' time ranges.
+    """
+    HOUR = 'hour'
+    DAY = 'day'
+    PERIOD_CHOICES = [(HOUR, 'Hour'), (DAY, 'Day')]
+
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    bucket_start = models.DateTimeField()
+    query = models.CharField(max_length=255)
+    searches = models.PositiveIntegerField(default=0)
+    zero_result_searches = models.PositiveIntegerField(default=0)
+    results = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['period', 'bucket_start', 'query'], name='catalog_searchrollup_bucket_uniq',
+            ),
+        ]
+
+    def __str__(self):
+        """
+        Returns a string representation of the SearchRollup instance, including the bucket, the query and its count.
+
+        :return: A formatted string showing the bucket, the query and the number of searches.
+        """
+        return f'{self.period} {self.bucket_start:%Y-%m-%d %H:%M}: {self.query} ({self.searches})'
+
 class Rating(models.Model):
     """
     Represents a user's rating of an item in the system.
@@ -149,4 +234,71 @@ class Rating(models.Model):
 
         :return: A formatted string showing the user's username, the name of the item, and the rating score.
         """
-        return f'{self.user.username} rating for {self.item.name}: {self.score}'
\ No newline at end of file
+        return f'{self.user.username} rating for {self.item.name}: {self.score}'
+
+class ItemRecommendation(models.Model):
+    """
+    Represents one precomputed "fans who rated this also liked" recommendation.
+
+    The rows are computed offline from the Rating table by `python manage.py compute_recommendations` (see
+    catalog/recommendations.py) and read by the item detail page with a single indexed query.
+
+    Attributes:
+        - item (ForeignKey): A reference to the Item model, indicating the item the recommendation is shown on.
+        - recommended (ForeignKey): A reference to the Item model, indicating the recommended item.
+        - rank (PositiveSmallIntegerField): The position of the recommendation on the item's page, starting at 1.
+        - score (FloatField): The similarity between the two items' ratings.
+        - computed_at (DateTimeField): When the recommendation was computed.
+
+    Meta:
+        - constraints: A unique (item, rank) constraint whose index serves the item detail page's lookup.
+    """
+    # The (item, rank) constraint starts with the item, so the foreign key needs no index of its own.
+    item = models.ForeignKey('Item', on_delete=models.CASCADE, related_name='recommendations', db_index=False)
+    recommended = models.ForeignKey('Item', on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    computed_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['item', 'rank'], name='catalog_itemrec_item_rank_uniq')]
+
+    def __str__(self):
+        """
+        Returns a string representation of the ItemRecommendation instance, including both item ids and the rank.
+
+        :return: A formatted string showing the item, the rank and the recommended item.
+        """
+        return f'{self.item_id} #{self.rank} -> {self.recommended_id}'
+
+class SearchTerm(models.Model):
+    """
+    Represents one entry of the built-in inverted search index.
+
+    Each row maps a normalized token to an item that contains it, together with a weight that reflects which fields
+    (item name, band name, category name) the token appeared in. It is only queried when SQLite FTS5 is not available.
+
+    Attributes:
+        - term (CharField): The normalized (lowercased, diacritics stripped) token.
+        - item (ForeignKey): A reference to the Item model, indicating the item that contains the token.
+        - weight (PositiveIntegerField): The relevance weight of the token for the item.
+
+    Meta:
+        - unique_together: Ensures that a token is stored only once per item.
+        - indexes: A composite index on (term, item) so prefix lookups are served by a B-tree range scan.
+    """
+    term = models.CharField(max_length=64)
+    item = models.ForeignKey('Item', on_delete=models.CASCADE, related_name='search_terms')
+    weight = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        unique_together = ['item', 'term']
+        indexes = [models.Index(fields=['term', 'item'], name='catalog_searchterm_term_idx')]
+
+    def __str__(self):
+        """
+        Returns a string representation of the SearchTerm instance, including the token and the item id.
+
+        :return: A formatted string showing the token and the item it points to.
+        """
+        return f'{self.term} -> {self.item_id}'
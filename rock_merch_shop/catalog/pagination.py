@@ -0,0 +1,375 @@
+"""
+Keyset (cursor) pagination for catalog listings.
+
+Instead of OFFSET/LIMIT, each page is fetched with a WHERE condition on the sort key of the last row of the previous
+page, so page 1000 costs the same as page 1. The position is carried in an opaque, URL-safe cursor token that HTML
+pages put in their next/previous links and JSON consumers can pass back unchanged.
+
+Every ordering must end with a unique field (normally the primary key) so the sort key is stable.
+"""
+import base64
+import datetime
+import json
+import math
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.db.models import Q
+from django.http import QueryDict
+
+# Range of the integer sort keys a cursor may carry (64-bit signed columns).
+MAX_INTEGER = 2 ** 63 - 1
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    JSON encoder for cursor values. Unlike DjangoJSONEncoder it keeps the microseconds of datetimes, which the
+    keyset conditions need to compare timestamps exactly.
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class InvalidCursor(ValueError):
+    """
+    Raised when a cursor token cannot be decoded or does not belong to the requested ordering.
+    """
+
+
+def encode_cursor(ordering, values, forward=True):
+    """
+    Encodes a position in an ordering into an opaque cursor token.
+
+    :param ordering: The ordering the position belongs to, as a sequence of field names (e.g. ['-timestamp', 'id']).
+    :param values: The sort key values of the row the page starts after (or before, when going backwards).
+    :param forward: True for a 'next page' cursor, False for a 'previous page' cursor.
+    :return: The URL-safe cursor token as a string.
+    """
+    payload = {'o': ','.join(ordering), 'k': list(values), 'f': int(forward)}
+    raw = json.dumps(payload, cls=CursorEncoder, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, ordering):
+    """
+    Decodes a cursor token produced by encode_cursor.
+
+    :param token: The cursor token.
+    :param ordering: The ordering the cursor is expected to belong to.
+    :return: A (values, forward) tuple.
+    :raises InvalidCursor: If the token is malformed or was issued for another ordering.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+        values, forward = payload['k'], bool(payload['f'])
+        matches_ordering = payload['o'] == ','.join(ordering)
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor('Malformed cursor.')
+    if not matches_ordering or not isinstance(values, list) or len(values) != len(ordering):
+        raise InvalidCursor('Cursor does not match the requested ordering.')
+    return values, forward
+
+
+def clean_cursor_value(field, value):
+    """
+    Converts a value decoded from a cursor to the Python type of the field it sorts on.
+
+    Cursors come from the client, so a tampered one may carry any JSON value: integers must be JSON integers of a
+    64-bit column, floats finite JSON numbers, and other fields (decimals and datetimes, encoded as strings) must be
+    accepted by the field's to_python().
+
+    :param field: The model field, or None for a sort key that is not a model field (the value is kept as is).
+    :param value: The decoded value.
+    :return: The converted value.
+    :raises InvalidCursor: If the value does not fit the field.
+    """
+    if field is None or value is None:
+        return value
+    if isinstance(field, (models.IntegerField, models.AutoField)):
+        if not isinstance(value, int) or isinstance(value, bool) or not -MAX_INTEGER <= value <= MAX_INTEGER:
+            raise InvalidCursor('Invalid integer in cursor.')
+        return value
+    if isinstance(field, models.FloatField):
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or not math.isfinite(value):
+            raise InvalidCursor('Invalid number in cursor.')
+        return float(value)
+    if not isinstance(value, str):
+        raise InvalidCursor('Invalid value in cursor.')
+    try:
+        return field.to_python(value)
+    except (ValidationError, ValueError, TypeError, OverflowError):
+        raise InvalidCursor('Invalid value in cursor.')
+
+
+def clean_cursor_values(fields, values):
+    """
+    Converts the values decoded from a cursor with clean_cursor_value, field by field.
+
+    :param fields: The model fields of the ordering (None for keys that are not model fields).
+    :param values: The decoded values, one per field.
+    :return: A list of converted values.
+    :raises InvalidCursor: If a value does not fit its field.
+    """
+    return [clean_cursor_value(field, value) for field, value in zip(fields, values)]
+
+
+def ordering_fields(model, ordering):
+    """
+    Returns the model field of each key of an ordering, or None for the keys that are not fields of the model.
+    """
+    fields = []
+    for name in ordering:
+        try:
+            fields.append(model._meta.get_field(name.lstrip('-')))
+        except FieldDoesNotExist:
+            fields.append(None)
+    return fields
+
+
+def get_page_size(request):
+    """
+    Reads the page size from the 'page_size' GET parameter, bounded by the configured maximum.
+
+    :param request: The incoming HTTP request.
+    :return: The page size to use.
+    """
+    default = getattr(settings, 'CATALOG_PAGE_SIZE', 24)
+    maximum = getattr(settings, 'CATALOG_MAX_PAGE_SIZE', 100)
+    try:
+        page_size = int(request.GET.get('page_size', default))
+    except ValueError:
+        page_size = default
+    return max(1, min(page_size, maximum))
+
+
+def keyset_condition(ordering, values, forward=True):
+    """
+    Builds the WHERE condition selecting the rows that come after (or before) a sort key.
+
+    For an ordering (a DESC, b ASC) and key (x, y), going forward this is: a < x OR (a = x AND b > y).
+
+    :param ordering: The ordering, as a sequence of field names with an optional '-' prefix.
+    :param values: The sort key values to start from.
+    :param forward: True to select the rows after the key, False for the rows before it.
+    :return: A Q object.
+    """
+    condition = Q()
+    for index, field in enumerate(ordering):
+        name, descending = field.lstrip('-'), field.startswith('-')
+        lookup = 'lt' if descending == forward else 'gt'
+        clause = Q(**{f'{name}__{lookup}': values[index]})
+        for previous_field, previous_value in zip(ordering[:index], values[:index]):
+            clause &= Q(**{previous_field.lstrip('-'): previous_value})
+        condition |= clause
+    return condition
+
+
+def reverse_ordering(ordering):
+    """
+    Flips the direction of every field in an ordering.
+
+    :param ordering: The ordering, as a sequence of field names with an optional '-' prefix.
+    :return: The reversed ordering as a list.
+    """
+    return [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+
+
+class KeysetPage:
+    """
+    One page of keyset-paginated results.
+
+    Attributes:
+        - object_list (list): The rows of the page, in display order.
+        - next_cursor (str): The cursor of the following page, or None on the last page.
+        - previous_cursor (str): The cursor of the preceding page, or None on the first page.
+        - page_size (int): The requested page size.
+
+    Methods:
+        - next_query / previous_query: The current query string with the cursor replaced, for template links.
+        - metadata(): The pagination details as a dict, for JSON responses.
+    """
+
+    def __init__(self, object_list, next_cursor, previous_cursor, page_size, query_params=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.page_size = page_size
+        self._query_params = query_params
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def _query_with_cursor(self, cursor):
+        params = self._query_params.copy() if self._query_params is not None else QueryDict(mutable=True)
+        params['cursor'] = cursor
+        return params.urlencode()
+
+    @property
+    def next_query(self):
+        return self._query_with_cursor(self.next_cursor) if self.has_next else ''
+
+    @property
+    def previous_query(self):
+        return self._query_with_cursor(self.previous_cursor) if self.has_previous else ''
+
+    def metadata(self):
+        """
+        Returns the pagination details for JSON consumers, who pass the cursors back in the 'cursor' parameter.
+
+        :return: A dict with the next and previous cursors and the page size.
+        """
+        return {'next': self.next_cursor, 'previous': self.previous_cursor, 'page_size': self.page_size}
+
+
+def paginate_keyed(fetch, key, ordering, cursor=None, page_size=24, query_params=None):
+    """
+    Paginates any keyed sequence given a function that fetches the rows following a sort key.
+
+    :param fetch: A callable (values, forward, limit) returning up to 'limit' rows after (or before, when forward is
+                  False) the sort key 'values' in the direction of travel; values is None for the first page.
+    :param key: A callable returning the sort key values of a row.
+    :param ordering: The ordering, used to tag and validate cursor tokens.
+    :param cursor: The cursor token from the request, or None for the first page.
+    :param page_size: The number of rows per page.
+    :param query_params: The request's GET parameters, used to build the next/previous links.
+    :return: A KeysetPage.
+    :raises InvalidCursor: If the cursor token is invalid.
+    """
+    values, forward = decode_cursor(cursor, ordering) if cursor else (None, True)
+
+    # Fetch one extra row to find out whether there is another page in the direction of travel.
+    rows = list(fetch(values, forward, page_size + 1))
+    return build_page(rows, key, ordering, values, forward, page_size, query_params)
+
+
+def build_page(rows, key, ordering, values, forward, page_size, query_params=None):
+    """
+    Builds a KeysetPage from the rows fetched after (or before) a sort key, with one extra row when there are more.
+
+    :param rows: Up to page_size + 1 rows, in the direction of travel.
+    :param key: A callable returning the sort key values of a row.
+    :param ordering: The ordering, used to tag the cursor tokens.
+    :param values: The sort key the rows were fetched from, or None for the first page.
+    :param forward: The direction of travel.
+    :param page_size: The number of rows per page.
+    :param query_params: The request's GET parameters, used to build the next/previous links.
+    :return: A KeysetPage.
+    """
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if not forward:
+        rows.reverse()
+
+    # Going forward there is a previous page whenever we started from a cursor, and vice versa.
+    has_next = has_more if forward else values is not None
+    has_previous = values is not None if forward else has_more
+
+    next_cursor = encode_cursor(ordering, key(rows[-1]), forward=True) if has_next and rows else None
+    previous_cursor = encode_cursor(ordering, key(rows[0]), forward=False) if has_previous and rows else None
+    return KeysetPage(rows, next_cursor, previous_cursor, page_size, query_params)
+
+
+def paginate_queryset(queryset, ordering, cursor=None, page_size=24, query_params=None):
+    """
+    Paginates a queryset by keyset on the given ordering.
+
+    :param queryset: The queryset to paginate (any existing ordering is replaced).
+    :param ordering: The ordering, as a sequence of field names ending with a unique field.
+    :param cursor: The cursor token from the request, or None for the first page.
+    :param page_size: The number of rows per page.
+    :param query_params: The request's GET parameters, used to build the next/previous links.
+    :return: A KeysetPage of model instances, or of dicts for a values() queryset, which must then select every
+             field of the ordering.
+    :raises InvalidCursor: If the cursor token is invalid.
+    """
+    ordering = list(ordering)
+
+    def fetch(values, forward, limit):
+        return keyset_slice(queryset, ordering, values, forward, limit)
+
+    def key(row):
+        return row_key(row, ordering)
+
+    return paginate_keyed(fetch, key, ordering, cursor, page_size, query_params)
+
+
+def row_key(row, ordering):
+    """
+    Returns the sort key values of a row: a model instance or a values() dict.
+    """
+    names = [field.lstrip('-') for field in ordering]
+    if isinstance(row, dict):
+        return [row[name] for name in names]
+    return [getattr(row, name) for name in names]
+
+
+def keyset_slice(queryset, ordering, values, forward, limit):
+    """
+    Returns the (lazy) queryset of the 'limit' rows following a sort key in the direction of travel.
+
+    :raises InvalidCursor: If the sort key values do not fit the fields of the ordering.
+    """
+    rows = queryset.order_by(*(ordering if forward else reverse_ordering(ordering)))
+    if values is not None:
+        values = clean_cursor_values(ordering_fields(queryset.model, ordering), values)
+        try:
+            rows = rows.filter(keyset_condition(ordering, values, forward))
+        except (ValidationError, ValueError, TypeError):
+            # A sort key that is not a model field, and whose cursor value the lookup rejected.
+            raise InvalidCursor('Invalid value in cursor.')
+    return rows[:limit]
+
+
+async def apaginate_queryset(queryset, ordering, cursor=None, page_size=24, query_params=None):
+    """
+    Asynchronous version of paginate_queryset, fetching the page with the async ORM.
+    """
+    ordering = list(ordering)
+    values, forward = decode_cursor(cursor, ordering) if cursor else (None, True)
+    rows = [obj async for obj in keyset_slice(queryset, ordering, values, forward, page_size + 1)]
+
+    def key(row):
+        return row_key(row, ordering)
+
+    return build_page(rows, key, ordering, values, forward, page_size, query_params)
+
+
+def paginate_request(request, queryset, ordering):
+    """
+    Paginates a queryset using the 'cursor' and 'page_size' GET parameters of a request.
+
+    :param request: The incoming HTTP request.
+    :param queryset: The queryset to paginate.
+    :param ordering: The ordering, as a sequence of field names ending with a unique field.
+    :return: A KeysetPage of model instances.
+    :raises InvalidCursor: If the cursor token is invalid.
+    """
+    return paginate_queryset(
+        queryset, ordering, request.GET.get('cursor'), get_page_size(request), request.GET
+    )
+
+
+async def apaginate_request(request, queryset, ordering):
+    """
+    Asynchronous version of paginate_request.
+    """
+    return await apaginate_queryset(
+        queryset, ordering, request.GET.get('cursor'), get_page_size(request), request.GET
+    )
@@ -0,0 +1,133 @@
+"""
+Maintenance of the denormalized rating aggregates stored on Item (rating_count, rating_sum and rating_average).
+
+Rating changes are applied incrementally with F() expressions so concurrent updates never lose a write, and the
+aggregates can be recomputed from the Rating table in bulk when they need to be repaired.
+
+The updates bypass the model signals, so every change also bumps the cache versions the item pages' ETags are built
+from (see catalog/conditional.py) once its transaction commits.
+"""
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
+
+from . import cache
+from .models import Item, Rating
+
+# Average computed from the stored count and sum columns.
+AVERAGE_EXPRESSION = Case(
+    When(rating_count=0, then=Value(0.0)),
+    default=Cast(F('rating_sum'), FloatField()) / F('rating_count'),
+    output_field=FloatField(),
+)
+
+
+def apply_rating_delta(item_id, count_delta, sum_delta):
+    """
+    Applies an incremental change to an item's rating aggregates.
+
+    The count and sum are updated first and the average is derived from the new values in a second statement, so
+    the result is correct on every database backend (MySQL evaluates SET assignments left to right).
+
+    :param item_id: The primary key of the rated Item.
+    :param count_delta: The change in the number of ratings (1 for a new rating, -1 for a deleted one, 0 otherwise).
+    :param sum_delta: The change in the sum of scores.
+    """
+    items = Item.objects.filter(pk=item_id)
+    with transaction.atomic():
+        items.update(rating_count=F('rating_count') + count_delta, rating_sum=F('rating_sum') + sum_delta)
+        items.update(rating_average=AVERAGE_EXPRESSION)
+        transaction.on_commit(lambda: cache.bump_object_versions(Item, [item_id]))
+
+
+def recompute_rating_aggregates(items=None):
+    """
+    Recomputes the rating aggregates of the given items from the Rating table.
+
+    Each call runs two UPDATE statements with correlated subqueries, whatever the number of items.
+
+    :param items: An Item queryset restricting the items to recompute, or None for all items.
+    :return: The number of items updated.
+    """
+    items = Item.objects.all() if items is None else items
+    ratings = Rating.objects.filter(item=OuterRef('pk')).order_by().values('item')
+    count = Subquery(ratings.annotate(total=Count('pk')).values('total'), output_field=IntegerField())
+    total = Subquery(ratings.annotate(total=Sum('score')).values('total'), output_field=IntegerField())
+
+    with transaction.atomic():
+        updated = items.update(rating_count=Coalesce(count, 0), rating_sum=Coalesce(total, 0))
+        items.update(rating_average=AVERAGE_EXPRESSION)
+        transaction.on_commit(lambda: cache.bump_model_version(Item))
+    return updated
+
+
+def rate_items(user, scores):
+    """
+    Creates or updates many ratings by one user in a single transaction and keeps the items' aggregates in step.
+
+    The statements issued do not depend on the number of ratings: one query locks the rated items (and checks that
+    they exist), one reads the user's previous scores, one upserts every rating with bulk_create(update_conflicts=True)
+    on the (item, user) unique constraint, and two UPDATE statements apply the aggregate deltas of all items at once.
+    A changed rating also gets the current timestamp.
+
+    :param user: The User submitting the ratings.
+    :param scores: A dict mapping Item primary keys to scores (integers from 1 to 5).
+    :return: A dict mapping each item id to 'created', 'updated', 'unchanged' or 'missing' (no such item).
+    """
+    if not scores:
+        return {}
+
+    with transaction.atomic():
+        # Locking the items serializes concurrent ratings of the same item, so the previous scores read below stay
+        # accurate until the aggregates are updated.
+        existing_ids = set(Item.objects.select_for_update().filter(pk__in=list(scores)).values_list('pk', flat=True))
+        outcomes = {item_id: 'missing' for item_id in scores if item_id not in existing_ids}
+        scores = {item_id: score for item_id, score in scores.items() if item_id in existing_ids}
+        if not scores:
+            return outcomes
+
+        previous = dict(
+            Rating.objects.filter(user=user, item_id__in=list(scores)).values_list('item_id', 'score')
+        )
+        changed = {item_id: score for item_id, score in scores.items() if previous.get(item_id) != score}
+        for item_id in scores:
+            if item_id not in changed:
+                outcomes[item_id] = 'unchanged'
+        if not changed:
+            return outcomes
+
+        Rating.objects.bulk_create(
+            [Rating(user=user, item_id=item_id, score=score) for item_id, score in changed.items()],
+            update_conflicts=True,
+            unique_fields=['item', 'user'],
+            # A re-rating counts as given now, so incremental recommendation refreshes pick it up.
+            update_fields=['score', 'timestamp'],
+        )
+
+        # Apply every item's count and sum delta in one statement, then derive the averages in a second one.
+        count_deltas, sum_deltas = [], []
+        for item_id, score in changed.items():
+            created = item_id not in previous
+            outcomes[item_id] = 'created' if created else 'updated'
+            count_deltas.append(When(pk=item_id, then=Value(int(created))))
+            sum_deltas.append(When(pk=item_id, then=Value(score - previous.get(item_id, 0))))
+        items = Item.objects.filter(pk__in=list(changed))
+        items.update(
+            rating_count=F('rating_count') + Case(*count_deltas, default=Value(0), output_field=IntegerField()),
+            rating_sum=F('rating_sum') + Case(*sum_deltas, default=Value(0), output_field=IntegerField()),
+        )
+        items.update(rating_average=AVERAGE_EXPRESSION)
+        transaction.on_commit(lambda: cache.bump_object_versions(Item, list(changed)))
+    return outcomes
+
+
+def rate_item(user, item_id, score):
+    """
+    Creates or updates a single rating through the same upsert path as rate_items.
+
+    :param user: The User submitting the rating.
+    :param item_id: The primary key of the Item being rated.
+    :param score: The score, an integer from 1 to 5.
+    :return: 'created', 'updated', 'unchanged' or 'missing' (no such item).
+    """
+    return rate_items(user, {item_id: score})[item_id]
@@ -0,0 +1,283 @@
+"""
+Item-to-item recommendations ("fans who rated this also liked"), computed offline from the Rating table.
+
+The ratings are read in chunks into a sparse item x user matrix (SciPy CSR). Each item's row is scaled to unit length,
+so multiplying a block of rows by the transposed matrix gives the cosine similarity of those items with every item
+sharing a rater, in one vectorized sparse product. Similarities supported by few common raters are shrunk towards
+zero (cosine * common / (common + SHRINKAGE)), and the TOP_K best neighbours of each item are picked with a single
+sort of the whole block. They are stored as ItemRecommendation rows, which the item detail page reads with one
+indexed query.
+
+Memory stays bounded: the ratings take three 4-byte values each, and the items are processed in blocks whose
+similarity matrices hold at most MAX_PAIRS entries (estimated beforehand from the number of ratings of their raters).
+
+A full refresh recomputes every item. An incremental refresh only recomputes the items rated since the previous run,
+and updates the lists of the items they are similar to; a list can then lack a neighbour whose similarity dropped,
+until the next full refresh. Settings are read from the CATALOG_RECOMMENDATIONS dict.
+
+NumPy and SciPy are only needed by the computation (`python manage.py compute_recommendations`), not to serve pages.
+"""
+import logging
+import time
+from itertools import islice
+
+import numpy as np
+from scipy import sparse
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import cache
+from .models import ItemRecommendation, Rating
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Recommendations kept per item.
+    'TOP_K': 8,
+    # Common raters at which a similarity keeps half its value.
+    'SHRINKAGE': 5,
+    # Most similarity entries computed at once; bounds the memory of a block of items.
+    'MAX_PAIRS': 5_000_000,
+    # Ratings read per database round-trip.
+    'CHUNK_SIZE': 100_000,
+}
+
+# Items whose recommendations are replaced per transaction, and ids per IN (...) condition.
+BATCH_SIZE = 500
+
+# Columns written for each recommendation, in the order of write_lists' rows.
+INSERT_FIELDS = ('item', 'recommended', 'rank', 'score', 'computed_at')
+
+
+def get_options():
+    """
+    Returns the CATALOG_RECOMMENDATIONS setting merged over the defaults.
+
+    :return: A dict of options.
+    """
+    return {**DEFAULTS, **getattr(settings, 'CATALOG_RECOMMENDATIONS', {})}
+
+
+class RatingMatrix:
+    """
+    The ratings as a sparse item x user matrix.
+
+    Attributes:
+        - item_ids (ndarray): The primary key of the item of each row, in increasing order.
+        - normalized (csr_matrix): The scores, each row scaled to unit length.
+        - rated (csr_matrix): 1 where a user rated an item.
+        - ratings (int): The number of ratings.
+    """
+
+    def __init__(self, item_ids, user_ids, scores):
+        self.item_ids, item_rows = np.unique(item_ids, return_inverse=True)
+        user_ids, user_columns = np.unique(user_ids, return_inverse=True)
+        shape = (len(self.item_ids), len(user_ids))
+        matrix = sparse.csr_matrix((scores.astype(np.float32), (item_rows, user_columns)), shape=shape)
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        self.normalized = sparse.diags(1 / norms).dot(matrix).tocsr()
+        self.rated = matrix.copy()
+        self.rated.data[:] = 1
+        self.ratings = matrix.nnz
+        # Upper bound of the number of items sharing a rater with each item: the ratings of its raters.
+        ratings_per_user = np.asarray(self.rated.sum(axis=0)).ravel()
+        self.pair_estimates = np.minimum(self.rated.dot(ratings_per_user), len(self.item_ids))
+
+    @classmethod
+    def load(cls, chunk_size=DEFAULTS['CHUNK_SIZE']):
+        """
+        Reads every rating from the database, chunk_size rows per round-trip.
+
+        :return: The RatingMatrix.
+        """
+        rows = Rating.objects.order_by().values_list('user_id', 'item_id', 'score').iterator(chunk_size=chunk_size)
+        chunks = []
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            chunks.append(np.array(chunk, dtype=np.int32))
+        data = np.concatenate(chunks) if chunks else np.empty((0, 3), dtype=np.int32)
+        return cls(data[:, 1], data[:, 0], data[:, 2])
+
+    def rows_of(self, item_ids):
+        """
+        Returns the rows of the given items, leaving out items without ratings.
+        """
+        item_ids = np.asarray(sorted(item_ids), dtype=self.item_ids.dtype)
+        positions = np.searchsorted(self.item_ids, item_ids)
+        found = positions < len(self.item_ids)
+        found[found] = self.item_ids[positions[found]] == item_ids[found]
+        return positions[found]
+
+    def blocks(self, rows, max_pairs):
+        """
+        Splits rows into consecutive blocks whose similarity matrices hold at most max_pairs entries (or one row).
+        """
+        costs = np.cumsum(self.pair_estimates[rows])
+        start = 0
+        while start < len(rows):
+            offset = costs[start - 1] if start else 0
+            end = max(int(np.searchsorted(costs, offset + max_pairs, side='right')), start + 1)
+            yield rows[start:end]
+            start = end
+
+    def similarities(self, rows, shrinkage):
+        """
+        Computes the shrunk cosine similarities of a block of items with every item sharing a rater.
+
+        :param rows: The rows of the block.
+        :param shrinkage: Common raters at which a similarity keeps half its value.
+        :return: (block positions, rows, similarities) arrays of the non-zero pairs, self-pairs excluded.
+        """
+        cosine = self.normalized[rows].dot(self.normalized.T)
+        common = self.rated[rows].dot(self.rated.T).tocsr()
+        common.data = common.data / (common.data + shrinkage)
+        scores = cosine.multiply(common).tocsr()
+        scores.sort_indices()
+        scores = scores.tocoo()
+        keep = (scores.col != rows[scores.row]) & (scores.data > 0)
+        return scores.row[keep], scores.col[keep], scores.data[keep]
+
+
+def top_neighbours(positions, columns, values, block_length, top_k):
+    """
+    Keeps the top_k most similar items of each row of a block, with one sort of all its pairs.
+
+    :return: (block positions, rows, similarities, ranks) arrays, ranks starting at 0.
+    """
+    # By block position, then best similarity first (similarities are in (0, 1], so one sort key orders both); the
+    # stable sort keeps ties in item order.
+    order = np.argsort(positions - values.astype(np.float64) / 2, kind='stable')
+    positions, columns, values = positions[order], columns[order], values[order]
+    starts = np.searchsorted(positions, np.arange(block_length))
+    ranks = np.arange(len(positions)) - starts[positions]
+    keep = ranks < top_k
+    return positions[keep], columns[keep], values[keep], ranks[keep]
+
+
+def batches(values, size=BATCH_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def write_lists(lists, computed_at):
+    """
+    Replaces the recommendations of the given items.
+
+    Rows are inserted with executemany() rather than bulk_create(), which spends most of a full computation preparing
+    model instances.
+
+    :param lists: A dict mapping item ids to lists of (recommended item id, score), best first.
+    :param computed_at: The computation's timestamp.
+    :return: The number of rows written.
+    """
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(ItemRecommendation._meta.get_field(name).column) for name in INSERT_FIELDS)
+    sql = (f'INSERT INTO {quote(ItemRecommendation._meta.db_table)} ({columns}) '
+           f'VALUES ({", ".join(["%s"] * len(INSERT_FIELDS))})')
+    timestamp = connection.ops.adapt_datetimefield_value(computed_at)
+    written = 0
+    for item_ids in batches(lists):
+        rows = [
+            (item_id, recommended_id, rank, score, timestamp)
+            for item_id in item_ids
+            for rank, (recommended_id, score) in enumerate(lists[item_id], start=1)
+        ]
+        with transaction.atomic():
+            ItemRecommendation.objects.filter(item_id__in=item_ids).delete()
+            with connection.cursor() as cursor:
+                cursor.executemany(sql, rows)
+        written += len(rows)
+    return written
+
+
+def block_lists(matrix, rows, positions, columns, values, top_k):
+    """
+    Returns the recommendation lists of a block of items, from its similarities.
+    """
+    positions, columns, values, _ranks = top_neighbours(positions, columns, values, len(rows), top_k)
+    lists = {int(item_id): [] for item_id in matrix.item_ids[rows]}
+    for item_id, recommended_id, score in zip(matrix.item_ids[rows[positions]].tolist(),
+                                              matrix.item_ids[columns].tolist(), values.tolist()):
+        lists[item_id].append((recommended_id, score))
+    return lists
+
+
+def merge_lists(matrix, rows, positions, columns, values, top_k, skip):
+    """
+    Returns the updated recommendation lists of the items similar to a block of recomputed items.
+
+    The stored lists of every item sharing a rater with the block, or listing one of its items, lose their entries
+    for the block's items and gain the new similarities, since similarity is symmetric.
+
+    :param skip: Item ids whose lists are recomputed in full, and so are not merged.
+    """
+    block_ids = set(matrix.item_ids[rows].tolist())
+    merged = {}
+    for item_id, recommended_id, score in zip(matrix.item_ids[columns].tolist(),
+                                              matrix.item_ids[rows[positions]].tolist(), values.tolist()):
+        if item_id not in skip:
+            merged.setdefault(item_id, []).append((recommended_id, score))
+    for recommended_ids in batches(block_ids):
+        listing = ItemRecommendation.objects.filter(recommended_id__in=recommended_ids)
+        for item_id in listing.values_list('item_id', flat=True):
+            if item_id not in skip:
+                merged.setdefault(item_id, [])
+    for item_ids in batches(merged):
+        stored = ItemRecommendation.objects.filter(item_id__in=item_ids)
+        for item_id, recommended_id, score in stored.values_list('item_id', 'recommended_id', 'score'):
+            if recommended_id not in block_ids:
+                merged[item_id].append((recommended_id, score))
+    return {
+        item_id: sorted(neighbours, key=lambda neighbour: (-neighbour[1], neighbour[0]))[:top_k]
+        for item_id, neighbours in merged.items()
+    }
+
+
+def compute(incremental=False, options=None):
+    """
+    Recomputes the item recommendations from the Rating table.
+
+    :param incremental: Only recompute the items rated since the previous computation (a full computation is made
+                        when there was none).
+    :param options: The recommendation options, defaults to get_options().
+    :return: A dict with the mode, the number of ratings read, of items recomputed and merged, of rows written, and the
+             duration in seconds.
+    """
+    options = options or get_options()
+    started = time.monotonic()
+    computed_at = timezone.now()
+    since = ItemRecommendation.objects.aggregate(last=Max('computed_at'))['last'] if incremental else None
+    mode = 'incremental' if since else 'full'
+
+    matrix = RatingMatrix.load(options['CHUNK_SIZE'])
+    if since:
+        # Re-ratings refresh the timestamp as well (see catalog.ratings.rate_items).
+        changed = Rating.objects.filter(timestamp__gte=since).values_list('item_id', flat=True).distinct()
+        rows = matrix.rows_of(set(changed))
+    else:
+        rows = np.arange(len(matrix.item_ids))
+    recomputed_ids = set(matrix.item_ids[rows].tolist())
+
+    stats = {'mode': mode, 'ratings': matrix.ratings, 'recomputed': 0, 'merged': 0, 'rows': 0}
+    for block in matrix.blocks(rows, options['MAX_PAIRS']):
+        positions, columns, values = matrix.similarities(block, options['SHRINKAGE'])
+        lists = block_lists(matrix, block, positions, columns, values, options['TOP_K'])
+        stats['recomputed'] += len(lists)
+        stats['rows'] += write_lists(lists, computed_at)
+        if since:
+            merged = merge_lists(matrix, block, positions, columns, values, options['TOP_K'], recomputed_ids)
+            stats['merged'] += len(merged)
+            stats['rows'] += write_lists(merged, computed_at)
+
+    if not since:
+        # Items that lost all their ratings keep no recommendations.
+        ItemRecommendation.objects.filter(computed_at__lt=computed_at).delete()
+    cache.bump_model_version(ItemRecommendation)
+    stats['seconds'] = round(time.monotonic() - started, 2)
+    logger.info('Computed recommendations: %s', stats)
+    return stats
@@ -0,0 +1,108 @@
+"""
+Read/write splitting between the primary database ('default') and its read replicas (every other DATABASES alias,
+configured from the DATABASE_REPLICAS environment variable in settings.py).
+
+PrimaryReplicaRouter sends the reads of the catalog models (items and their rating aggregates, bands, categories and
+recommendations) made by web requests to a randomly chosen replica, and everything else (ratings, search history,
+sessions, auth, all writes, and the reads of management commands) to the primary. Replicas lag behind the primary,
+so a user who just wrote something must not read from them:
+
+    - within a request, the first write pins every following read of the request to the primary;
+    - PrimaryPinningMiddleware then sets a short-lived cookie (STICKY_SECONDS) that pins the user's next requests too,
+      so that e.g. the page shown after rating an item reflects the new rating.
+
+Replicas get their schema and data through replication, so migrations only run on the primary. Settings are read
+from the CATALOG_DATABASE_ROUTING dict.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+DEFAULTS = {
+    # Models whose reads may be served by a replica, as 'app_label.model_name'.
+    'REPLICA_MODELS': ('catalog.item', 'catalog.band', 'catalog.category', 'catalog.itemrecommendation'),
+    # How long a user's reads stick to the primary after they wrote, covering the replication lag.
+    'STICKY_SECONDS': 5,
+    'COOKIE_NAME': 'catalog_primary',
+}
+
+
+def get_options():
+    """
+    Returns the CATALOG_DATABASE_ROUTING setting merged over the defaults.
+
+    :return: A dict of options.
+    """
+    return {**DEFAULTS, **getattr(settings, 'CATALOG_DATABASE_ROUTING', {})}
+
+
+class RoutingState:
+    """
+    The routing state of one request.
+
+    Attributes:
+        - pinned (bool): Every read goes to the primary.
+        - wrote (bool): The request wrote to the database.
+    """
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+_current = ContextVar('catalog_routing_state', default=None)
+
+
+def activate(state):
+    """
+    Makes state the routing state of the request being processed in this context.
+
+    :return: A token to pass to deactivate().
+    """
+    return _current.set(state)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+def replica_aliases():
+    """
+    Returns the database aliases of the read replicas: every configured alias but the primary.
+    """
+    return [alias for alias in settings.DATABASES if alias != DEFAULT_DB_ALIAS]
+
+
+class PrimaryReplicaRouter:
+    """
+    Routes the catalog reads to the replicas, and every write and pinned read to the primary.
+    """
+
+    def __init__(self, replicas=None, replica_models=None):
+        self.replicas = replica_aliases() if replicas is None else list(replicas)
+        self.replica_models = set(replica_models or get_options()['REPLICA_MODELS'])
+
+    def db_for_read(self, model, **hints):
+        state = _current.get()
+        if not self.replicas or model._meta.label_lower not in self.replica_models:
+            return DEFAULT_DB_ALIAS
+        # Outside requests (management commands, background threads) reads follow the writes to the primary.
+        if state is None or state.pinned:
+            return DEFAULT_DB_ALIAS
+        return random.choice(self.replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _current.get()
+        if state is not None:
+            # The user's next reads must see this write, which the replicas may not have yet.
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same data as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
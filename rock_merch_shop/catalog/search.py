@@ -0,0 +1,379 @@
+"""
+Full-text search index for catalog items.
+
+Items are indexed on their own name, their band's name and their category's name. Two interchangeable backends are
+provided:
+
+    - FTS5Backend: an SQLite FTS5 virtual table ranked with bm25(). Used whenever the table exists.
+    - InvertedIndexBackend: a plain inverted index stored in the SearchTerm model. Works on every database backend.
+
+The backend is chosen by the CATALOG_SEARCH_BACKEND setting ('auto', 'fts5' or 'inverted'). The index is kept up to
+date by the signal handlers in catalog/signals.py (fixture loads included), filled with the existing items by
+migration 0016, and can be rebuilt with `python manage.py rebuild_search_index`.
+"""
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, FloatField, IntegerField, Max, Q, Sum, When
+
+from .models import Item, SearchTerm
+from .pagination import clean_cursor_values, paginate_keyed
+
+# Relative weight of a token match in each indexed field (name matches rank above band and category matches).
+FIELD_WEIGHTS = {'name': 10, 'band': 5, 'category': 2}
+
+# Name of the FTS5 virtual table created by migration 0005.
+FTS_TABLE = 'catalog_item_fts'
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Fields the (relevance score, item id) keys of search cursors are checked against.
+SEARCH_CURSOR_FIELDS = (FloatField(), Item._meta.pk)
+
+
+def tokenize(text):
+    """
+    Splits a piece of text into normalized search tokens.
+
+    Tokens are lowercased and stripped of diacritics so that they match the behaviour of the FTS5 'unicode61'
+    tokenizer used by the FTS5 backend.
+
+    :param text: The text to tokenize.
+    :return: A list of tokens, in order of appearance.
+    """
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return [token[:SearchTerm._meta.get_field('term').max_length] for token in TOKEN_RE.findall(stripped.lower())]
+
+
+def _indexable_rows(item_ids):
+    """
+    Fetches the fields that are indexed for the given items in a single joined query.
+
+    :param item_ids: An iterable of Item primary keys.
+    :return: A list of (id, name, band name, category name) tuples.
+    """
+    return list(
+        Item.objects.filter(pk__in=list(item_ids)).values_list('id', 'name', 'band__name', 'category__name')
+    )
+
+
+def weighted_terms(name, band_name, category_name):
+    """
+    Returns the inverted index terms of an item, each weighted by the fields it appears in.
+
+    :param name: The item name.
+    :param band_name: The name of the item's band.
+    :param category_name: The name of the item's category.
+    :return: A dict mapping each token to its weight.
+    """
+    weights = {}
+    for field, text in (('name', name), ('band', band_name), ('category', category_name)):
+        for token in set(tokenize(text)):
+            weights[token] = weights.get(token, 0) + FIELD_WEIGHTS[field]
+    return weights
+
+
+class InvertedIndexBackend:
+    """
+    Search backend storing a token -> item inverted index in the SearchTerm table.
+
+    Query tokens are matched as prefixes with a range condition on the (term, item) index, so a lookup never scans
+    the Item table. Every query token must match for an item to be returned, and items are ranked by the sum of the
+    field weights of the matched terms.
+    """
+    name = 'inverted'
+
+    def index_items(self, item_ids):
+        """
+        (Re)indexes the given items, replacing any terms previously stored for them.
+
+        :param item_ids: An iterable of Item primary keys.
+        """
+        item_ids = list(item_ids)
+        terms = []
+        for item_id, name, band_name, category_name in _indexable_rows(item_ids):
+            weights = weighted_terms(name, band_name, category_name)
+            terms.extend(SearchTerm(term=token, item_id=item_id, weight=weight) for token, weight in weights.items())
+
+        with transaction.atomic():
+            SearchTerm.objects.filter(item_id__in=item_ids).delete()
+            SearchTerm.objects.bulk_create(terms, batch_size=500)
+
+    def remove_items(self, item_ids):
+        """
+        Removes the given items from the index.
+
+        :param item_ids: An iterable of Item primary keys.
+        """
+        SearchTerm.objects.filter(item_id__in=list(item_ids)).delete()
+
+    def clear(self):
+        """
+        Empties the whole index.
+        """
+        SearchTerm.objects.all().delete()
+
+    def is_empty(self):
+        """
+        Tells whether no item is indexed.
+        """
+        return not SearchTerm.objects.exists()
+
+    def search(self, query, limit=None, after=None, forward=True):
+        """
+        Returns the items matching every token of the query, best match first.
+
+        :param query: The raw search query string.
+        :param limit: The maximum number of results to return, or None for all of them.
+        :param after: An optional (score, item_id) key; only results ranked after it (before it when forward is False)
+                      are returned. Used for keyset pagination.
+        :param forward: False to walk the ranking backwards from 'after'.
+        :return: A list of (item_id, score) tuples, ordered by ascending score (lower is better), or descending when
+                 forward is False.
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+
+        # Prefix match each token with a range condition, which the (term, item) index serves directly.
+        conditions = [Q(term__gte=token, term__lt=token + '\uffff') for token in tokens]
+        any_token = Q()
+        for condition in conditions:
+            any_token |= condition
+
+        # One grouped query: a flag per token records whether it matched, so items must match all of them.
+        flags = {
+            f'matched_{index}': Max(Case(When(condition, then=1), default=0, output_field=IntegerField()))
+            for index, condition in enumerate(conditions)
+        }
+        rows = (
+            SearchTerm.objects.filter(any_token)
+            .values('item_id')
+            .annotate(score=Sum('weight'), **flags)
+            .filter(**{flag: 1 for flag in flags})
+            .order_by(*(('-score', 'item_id') if forward else ('score', '-item_id')))
+            .values_list('item_id', 'score')
+        )
+        if after is not None:
+            # The public score is the negated weight sum, so "ranked after" means a smaller sum.
+            weight, item_id = -after[0], after[1]
+            if forward:
+                rows = rows.filter(Q(score__lt=weight) | Q(score=weight, item_id__gt=item_id))
+            else:
+                rows = rows.filter(Q(score__gt=weight) | Q(score=weight, item_id__lt=item_id))
+        if limit is not None:
+            rows = rows[:limit]
+        return [(item_id, -score) for item_id, score in rows]
+
+
+class FTS5Backend:
+    """
+    Search backend using the SQLite FTS5 virtual table created by migration 0005.
+
+    The rowid of each FTS row is the Item primary key. Results are ranked with bm25(), weighting the name, band and
+    category columns according to FIELD_WEIGHTS.
+    """
+    name = 'fts5'
+
+    def index_items(self, item_ids):
+        """
+        (Re)indexes the given items, replacing any rows previously stored for them.
+
+        :param item_ids: An iterable of Item primary keys.
+        """
+        item_ids = list(item_ids)
+        rows = _indexable_rows(item_ids)
+        with transaction.atomic(), connection.cursor() as cursor:
+            self._delete(cursor, item_ids)
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, band, category) VALUES (%s, %s, %s, %s)', rows
+            )
+
+    def remove_items(self, item_ids):
+        """
+        Removes the given items from the index.
+
+        :param item_ids: An iterable of Item primary keys.
+        """
+        with connection.cursor() as cursor:
+            self._delete(cursor, list(item_ids))
+
+    def clear(self):
+        """
+        Empties the whole index.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+
+    def is_empty(self):
+        """
+        Tells whether no item is indexed.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT 1 FROM {FTS_TABLE} LIMIT 1')
+            return cursor.fetchone() is None
+
+    def search(self, query, limit=None, after=None, forward=True):
+        """
+        Returns the items matching every token of the query, best match first.
+
+        :param query: The raw search query string.
+        :param limit: The maximum number of results to return, or None for all of them.
+        :param after: An optional (score, item_id) key; only results ranked after it (before it when forward is False)
+                      are returned. Used for keyset pagination.
+        :param forward: False to walk the ranking backwards from 'after'.
+        :return: A list of (item_id, score) tuples, ordered by ascending bm25 score (lower is better), or descending
+                 when forward is False.
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+
+        # Each token becomes a quoted prefix query; FTS5 joins adjacent phrases with an implicit AND.
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        weights = ', '.join(str(FIELD_WEIGHTS[field]) for field in ('name', 'band', 'category'))
+        sql = (
+            f'SELECT rowid, score FROM ('
+            f'SELECT rowid, bm25({FTS_TABLE}, {weights}) AS score FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s)'
+        )
+        params = [match]
+        if after is not None:
+            comparison = '>' if forward else '<'
+            sql += f' WHERE score {comparison} %s OR (score = %s AND rowid {comparison} %s)'
+            params.extend([after[0], after[0], after[1]])
+        sql += ' ORDER BY score, rowid' if forward else ' ORDER BY score DESC, rowid DESC'
+        if limit is not None:
+            sql += ' LIMIT %s'
+            params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [(item_id, score) for item_id, score in cursor.fetchall()]
+
+    @staticmethod
+    def _delete(cursor, item_ids):
+        # Delete in chunks to stay below SQLite's bound-parameter limit.
+        for start in range(0, len(item_ids), 500):
+            chunk = item_ids[start:start + 500]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', chunk)
+
+
+# Cache of the FTS5 table lookup, keyed by database name, so the schema is only introspected once per process.
+_fts5_tables = {}
+
+
+def fts5_table_exists():
+    """
+    Checks whether the FTS5 virtual table is present in the current database.
+
+    :return: True if the catalog_item_fts table exists, False otherwise.
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    name = str(connection.settings_dict['NAME'])
+    if name not in _fts5_tables:
+        with connection.cursor() as cursor:
+            _fts5_tables[name] = FTS_TABLE in connection.introspection.table_names(cursor)
+    return _fts5_tables[name]
+
+
+def get_backend():
+    """
+    Returns the search backend selected by the CATALOG_SEARCH_BACKEND setting.
+
+    With 'auto' (the default) the FTS5 backend is used when its table exists and the inverted index otherwise.
+
+    :return: An instance of FTS5Backend or InvertedIndexBackend.
+    """
+    choice = getattr(settings, 'CATALOG_SEARCH_BACKEND', 'auto')
+    if choice == 'fts5' or (choice == 'auto' and fts5_table_exists()):
+        return FTS5Backend()
+    return InvertedIndexBackend()
+
+
+def index_items(item_ids):
+    """
+    (Re)indexes the given items in the active search backend.
+
+    :param item_ids: An iterable of Item primary keys.
+    """
+    get_backend().index_items(item_ids)
+
+
+def remove_items(item_ids):
+    """
+    Removes the given items from the active search backend.
+
+    :param item_ids: An iterable of Item primary keys.
+    """
+    get_backend().remove_items(item_ids)
+
+
+def rebuild_index(batch_size=1000):
+    """
+    Rebuilds the active search index from scratch.
+
+    :param batch_size: The number of items indexed per batch.
+    :return: The total number of items indexed.
+    """
+    backend = get_backend()
+    backend.clear()
+    item_ids = Item.objects.order_by('pk').values_list('pk', flat=True)
+    total = 0
+    batch = []
+    for item_id in item_ids.iterator(chunk_size=batch_size):
+        batch.append(item_id)
+        if len(batch) >= batch_size:
+            backend.index_items(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        backend.index_items(batch)
+        total += len(batch)
+    return total
+
+
+def index_is_empty():
+    """
+    Tells whether the active search backend has no item indexed (e.g. before it was ever built).
+    """
+    return get_backend().is_empty()
+
+
+def search_item_ids(query, limit=None):
+    """
+    Returns the primary keys of the items matching a query, most relevant first.
+
+    :param query: The raw search query string.
+    :param limit: The maximum number of results to return, or None for all of them.
+    :return: A list of Item primary keys in relevance order.
+    """
+    return [item_id for item_id, _score in get_backend().search(query, limit=limit)]
+
+
+def paginate_search(query, cursor=None, page_size=24, query_params=None):
+    """
+    Returns one keyset-paginated page of search results, keyed on (relevance score, item id).
+
+    :param query: The raw search query string.
+    :param cursor: The cursor token from the request, or None for the first page.
+    :param page_size: The number of results per page.
+    :param query_params: The request's GET parameters, used to build the next/previous links.
+    :return: A KeysetPage whose object_list holds (item_id, score) tuples.
+    :raises InvalidCursor: If the cursor token is invalid.
+    """
+    backend = get_backend()
+
+    def fetch(values, forward, limit):
+        if values is not None:
+            values = clean_cursor_values(SEARCH_CURSOR_FIELDS, values)
+        after = (values[0], values[1]) if values is not None else None
+        return backend.search(query, limit=limit, after=after, forward=forward)
+
+    def key(row):
+        return [row[1], row[0]]
+
+    return paginate_keyed(fetch, key, ['relevance', 'id'], cursor, page_size, query_params)
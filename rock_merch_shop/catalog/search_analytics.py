@@ -0,0 +1,307 @@
+"""
+Shop-wide search analytics: hourly and daily rollups of the searched queries, and the reports read from them.
+
+Every search written to SearchHistory (see catalog/search_log.py) is also counted in two SearchRollup buckets, the hour
+and the day it was made in, under its normalized query (the search tokens joined by spaces, so 'Iron  Maiden' and
+'iron maiden' count together). The counts are added with one upsert statement per flushed batch, which increments
+the stored counters in the database, so concurrent processes never lose a search. Each bucket also records how many
+of its searches found nothing and how many results the latest one showed.
+
+The trending and zero-result reports aggregate the buckets of their time window only: their cost depends on the
+number of distinct queries in the window, not on the size of SearchHistory. They are cached for REPORT_CACHE_TIMEOUT
+seconds.
+
+`python manage.py rollup_searches` rebuilds the rollups of a time range from SearchHistory (e.g. after an import),
+leaving the buckets of archived searches as they are, and prunes the hourly buckets older than
+HOURLY_RETENTION_DAYS. Settings are read from the CATALOG_SEARCH_ANALYTICS dict.
+"""
+from datetime import timedelta, timezone as dt_timezone
+from itertools import islice
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import cache
+from .models import SearchHistory, SearchRollup
+from .search import get_backend, tokenize
+
+DEFAULTS = {
+    # Hourly buckets older than this are deleted by `rollup_searches`; daily buckets are kept.
+    'HOURLY_RETENTION_DAYS': 14,
+    'REPORT_CACHE_TIMEOUT': 60,
+    'REPORT_LIMIT': 20,
+}
+
+# Longest query the SearchRollup.query column accepts.
+QUERY_MAX_LENGTH = SearchRollup._meta.get_field('query').max_length
+
+# Rows per upsert statement.
+BATCH_SIZE = 500
+
+
+def get_options():
+    """
+    Returns the CATALOG_SEARCH_ANALYTICS setting merged over the defaults.
+
+    :return: A dict of options.
+    """
+    return {**DEFAULTS, **getattr(settings, 'CATALOG_SEARCH_ANALYTICS', {})}
+
+
+def normalize_query(query):
+    """
+    Returns the form a query is counted under: its search tokens joined by spaces.
+
+    :param query: The raw query string.
+    :return: The normalized query, or an empty string if it has no searchable token.
+    """
+    return ' '.join(tokenize(query))[:QUERY_MAX_LENGTH]
+
+
+def bucket_starts(timestamp):
+    """
+    Returns the start of the hour and of the day a moment falls in, in UTC.
+
+    :return: An (hour start, day start) tuple of aware datetimes.
+    """
+    hour = timestamp.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return hour, hour.replace(hour=0)
+
+
+def aggregate(searches, buckets=None):
+    """
+    Counts searches into rollup buckets.
+
+    :param searches: An iterable of (query, timestamp, results, count) tuples, count being the number of identical
+                     searches the tuple stands for.
+    :param buckets: The dict the searches are added to, a new one by default.
+    :return: A dict mapping (period, bucket start, normalized query) to [searches, zero-result searches, results of
+             the latest search, timestamp of the latest search].
+    """
+    buckets = {} if buckets is None else buckets
+    for query, timestamp, results, count in searches:
+        normalized = normalize_query(query)
+        if not normalized:
+            continue
+        for period, start in zip((SearchRollup.HOUR, SearchRollup.DAY), bucket_starts(timestamp)):
+            bucket = buckets.setdefault((period, start, normalized), [0, 0, 0, timestamp])
+            bucket[0] += count
+            bucket[1] += count if results == 0 else 0
+            if timestamp >= bucket[3]:
+                bucket[2], bucket[3] = results, timestamp
+    return buckets
+
+
+def upsert_sql():
+    """
+    Returns the INSERT statement adding a bucket's counts to the stored ones, for the database in use.
+    """
+    quote = connection.ops.quote_name
+    table = quote(SearchRollup._meta.db_table)
+    names = ('period', 'bucket_start', 'query', 'searches', 'zero_result_searches', 'results')
+    columns = [quote(SearchRollup._meta.get_field(name).column) for name in names]
+    period, bucket_start, query, searches, zero_result_searches, results = columns
+    insert = f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join(["%s"] * len(columns))})'
+    if connection.vendor == 'mysql':
+        return (
+            f'{insert} ON DUPLICATE KEY UPDATE {searches} = {searches} + VALUES({searches}), '
+            f'{zero_result_searches} = {zero_result_searches} + VALUES({zero_result_searches}), '
+            f'{results} = VALUES({results})'
+        )
+    # SQLite and PostgreSQL.
+    return (
+        f'{insert} ON CONFLICT ({period}, {bucket_start}, {query}) DO UPDATE SET '
+        f'{searches} = {table}.{searches} + excluded.{searches}, '
+        f'{zero_result_searches} = {table}.{zero_result_searches} + excluded.{zero_result_searches}, '
+        f'{results} = excluded.{results}'
+    )
+
+
+def add_buckets(buckets):
+    """
+    Adds the counts of aggregated buckets to the stored ones, with one upsert statement per BATCH_SIZE buckets.
+
+    :param buckets: A dict returned by aggregate().
+    :return: The number of buckets updated.
+    """
+    adapt = connection.ops.adapt_datetimefield_value
+    rows = [
+        (period, adapt(start), query, count, zero, results)
+        for (period, start, query), (count, zero, results, _latest) in buckets.items()
+    ]
+    if rows:
+        sql = upsert_sql()
+        with transaction.atomic(), connection.cursor() as cursor:
+            for start in range(0, len(rows), BATCH_SIZE):
+                cursor.executemany(sql, rows[start:start + BATCH_SIZE])
+    return len(rows)
+
+
+def add_searches(searches):
+    """
+    Adds searches to the rollups. Call it in the transaction that writes them to SearchHistory.
+
+    :param searches: An iterable of (query, timestamp, results) tuples, results being the number of results shown.
+    :return: The number of buckets updated.
+    """
+    return add_buckets(aggregate((query, timestamp, results, 1) for query, timestamp, results in searches))
+
+
+def window_counts(period, start, end):
+    """
+    Returns the searches and zero-result searches of each query in the buckets starting in [start, end).
+
+    :return: A dict mapping normalized queries to dicts with 'searches', 'zero_result_searches' and 'results' (of the
+             latest bucket).
+    """
+    buckets = (
+        SearchRollup.objects
+        .filter(period=period, bucket_start__gte=start, bucket_start__lt=end)
+        .order_by('bucket_start')
+        .values_list('query', 'searches', 'zero_result_searches', 'results')
+    )
+    counts = {}
+    for query, searches, zero_result_searches, results in buckets.iterator(chunk_size=2000):
+        entry = counts.setdefault(query, {'searches': 0, 'zero_result_searches': 0, 'results': 0})
+        entry['searches'] += searches
+        entry['zero_result_searches'] += zero_result_searches
+        entry['results'] = results
+    return counts
+
+
+def cached_report(name, compute, *args):
+    """
+    Returns a report from the catalog cache, computing and storing it for REPORT_CACHE_TIMEOUT seconds on a miss.
+    """
+    key = f'catalog:search-analytics:{name}:' + ':'.join(str(arg) for arg in args)
+    report = cache.get_cache().get(key)
+    if report is None:
+        report = compute(*args)
+        cache.get_cache().set(key, report, timeout=get_options()['REPORT_CACHE_TIMEOUT'])
+    return report
+
+
+def _trending(hours, limit):
+    end = bucket_starts(timezone.now())[0] + timedelta(hours=1)
+    start = end - timedelta(hours=hours)
+    current = window_counts(SearchRollup.HOUR, start, end)
+    previous = window_counts(SearchRollup.HOUR, start - timedelta(hours=hours), start)
+    report = []
+    for query, counts in current.items():
+        before = previous.get(query, {}).get('searches', 0)
+        report.append({
+            'query': query,
+            'searches': counts['searches'],
+            'previous_searches': before,
+            'growth': round((counts['searches'] - before) / before, 2) if before else None,
+        })
+    # Most searched first; among equals, the queries growing the most (new ones first).
+    report.sort(key=lambda entry: (-entry['searches'], -(entry['growth'] if entry['growth'] is not None else 1e9),
+                                   entry['query']))
+    return report[:limit]
+
+
+def trending(hours=24, limit=None):
+    """
+    Returns the most searched queries of the last hours, compared with the same number of hours before.
+
+    The window ends with the current hour, which is included.
+
+    :param hours: The length of the window, in hours.
+    :param limit: The number of queries returned, defaults to REPORT_LIMIT.
+    :return: A list of dicts with the query, its searches in the window and in the previous window, and the growth
+             ratio between them (None for queries not searched in the previous window), most searched first.
+    """
+    return cached_report('trending', _trending, hours, limit or get_options()['REPORT_LIMIT'])
+
+
+def _zero_results(days, limit):
+    end = bucket_starts(timezone.now())[1] + timedelta(days=1)
+    counts = window_counts(SearchRollup.DAY, end - timedelta(days=days), end)
+    report = [
+        {'query': query, 'zero_result_searches': entry['zero_result_searches'], 'searches': entry['searches'],
+         'results': entry['results']}
+        for query, entry in counts.items() if entry['zero_result_searches']
+    ]
+    report.sort(key=lambda entry: (-entry['zero_result_searches'], entry['query']))
+    return report[:limit]
+
+
+def zero_results(days=7, limit=None):
+    """
+    Returns the queries that most often found nothing during the last days (today included).
+
+    :param days: The length of the window, in days.
+    :param limit: The number of queries returned, defaults to REPORT_LIMIT.
+    :return: A list of dicts with the query, its zero-result searches, its searches and the number of results its
+             latest search found (non-zero once the catalog has caught up), most zero-result searches first.
+    """
+    return cached_report('zero_results', _zero_results, days, limit or get_options()['REPORT_LIMIT'])
+
+
+def rebuild(start, end, results_limit, chunk_size=5000):
+    """
+    Recomputes the rollups of the days from start to end from SearchHistory.
+
+    Each record counts as the number of identical searches it stands for. Only the buckets of queries SearchHistory
+    still holds searches of are replaced: the others keep their counts, since the records they were counted from may
+    have been archived and deleted (see catalog/search_retention.py). The result counts are those of the current
+    catalog, searched again once per distinct query.
+
+    :param start: The first day rebuilt; it is truncated to the start of its UTC day.
+    :param end: The moment the rebuild stops at (exclusive); it is rounded up to the end of its UTC day.
+    :param results_limit: The most results counted per search (the search results page size).
+    :param chunk_size: SearchHistory rows read per database round-trip.
+    :return: The number of searches read.
+    """
+    start = bucket_starts(start)[1]
+    end = bucket_starts(end - timedelta(microseconds=1))[1] + timedelta(days=1)
+    backend = get_backend()
+    results = {}
+
+    def count_results(query):
+        normalized = normalize_query(query)
+        if normalized not in results:
+            results[normalized] = len(backend.search(normalized, limit=results_limit)) if normalized else 0
+        return results[normalized]
+
+    with transaction.atomic():
+        history = (
+            SearchHistory.objects
+            .filter(timestamp__gte=start, timestamp__lt=end)
+            .order_by()
+            .values_list('query', 'timestamp', 'count')
+            .iterator(chunk_size=chunk_size)
+        )
+        buckets = {}
+        read = 0
+        while True:
+            chunk = list(islice(history, chunk_size))
+            if not chunk:
+                break
+            aggregate(((query, timestamp, count_results(query), count) for query, timestamp, count in chunk), buckets)
+            read += sum(count for _query, _timestamp, count in chunk)
+
+        # The stored buckets that are recomputed, grouped by period and start.
+        queries = {}
+        for period, bucket_start, query in buckets:
+            queries.setdefault((period, bucket_start), []).append(query)
+        for (period, bucket_start), bucket_queries in queries.items():
+            for offset in range(0, len(bucket_queries), BATCH_SIZE):
+                SearchRollup.objects.filter(
+                    period=period, bucket_start=bucket_start, query__in=bucket_queries[offset:offset + BATCH_SIZE]
+                ).delete()
+        add_buckets(buckets)
+    return read
+
+
+def prune(now=None):
+    """
+    Deletes the hourly buckets older than HOURLY_RETENTION_DAYS.
+
+    :return: The number of buckets deleted.
+    """
+    cutoff = (now or timezone.now()) - timedelta(days=get_options()['HOURLY_RETENTION_DAYS'])
+    deleted, _ = SearchRollup.objects.filter(period=SearchRollup.HOUR, bucket_start__lt=cutoff).delete()
+    return deleted
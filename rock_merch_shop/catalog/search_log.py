@@ -0,0 +1,329 @@
+"""
+Buffered writer for SearchHistory records.
+
+Searches are appended to an in-process buffer instead of being inserted one by one inside the request. A background
+thread writes the buffer with a single bulk_create when it reaches FLUSH_SIZE entries or every FLUSH_INTERVAL
+seconds, and the buffer is flushed one last time when the process exits. The same transaction adds the batch to the
+hourly and daily search rollups (see catalog/search_analytics.py).
+
+The buffer holds at most MAX_SIZE entries. When it is full the OVERFLOW policy applies:
+
+    - 'drop_oldest': discard the oldest buffered entry to make room (the default).
+    - 'drop_newest': discard the entry being recorded.
+    - 'block': wait up to BLOCK_TIMEOUT seconds for the background thread to make room (backpressure), then discard
+      the entry being recorded.
+
+A flush that fails on a database error is logged and its entries are counted as failed. When the batch fails on an
+integrity error (e.g. the user of one search was deleted meanwhile), its entries are written one by one instead, so
+only the offending ones are lost. With the buffer disabled, a search that cannot be written is logged and the request
+goes on.
+
+A search repeating the user's previous query within COLLAPSE_WINDOW seconds of it does not add a row: the previous
+row's count is incremented and its timestamp moved forward. The retention settings (MAX_PER_USER, MAX_AGE_DAYS and
+ARCHIVE_DIR) are applied by `python manage.py archive_search_history` (see catalog/search_retention.py).
+
+Settings are read from the CATALOG_SEARCH_LOG dict; set 'ENABLED' to False to write every search synchronously.
+"""
+import atexit
+import logging
+import threading
+from collections import deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DatabaseError, IntegrityError, close_old_connections, transaction
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import search_analytics
+from .models import SearchHistory
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MAX_SIZE': 10000,
+    'FLUSH_SIZE': 200,
+    'FLUSH_INTERVAL': 5.0,
+    'OVERFLOW': 'drop_oldest',
+    # Seconds a search waits for room in a full buffer under the 'block' policy.
+    'BLOCK_TIMEOUT': 1.0,
+    # Seconds within which a repeated query increments the previous record instead of adding one (0 disables it).
+    'COLLAPSE_WINDOW': 600,
+    # Retention applied by `archive_search_history`: newest records kept per user, and age limit (None for no limit).
+    'MAX_PER_USER': 1000,
+    'MAX_AGE_DAYS': 365,
+    # Directory the expired records are archived to, as gzip-compressed JSON Lines.
+    'ARCHIVE_DIR': 'search_history_archive',
+}
+
+OVERFLOW_POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+# Longest query the SearchHistory.query column accepts.
+QUERY_MAX_LENGTH = SearchHistory._meta.get_field('query').max_length
+
+
+class SearchHistoryBuffer:
+    """
+    A bounded, thread-safe buffer of pending SearchHistory rows, flushed in bulk by a background thread.
+
+    Attributes:
+        - recorded (int): Entries accepted into the buffer.
+        - flushed (int): Entries written to the database.
+        - dropped (int): Entries discarded because the buffer was full.
+        - failed (int): Entries lost because a flush raised a database error.
+    """
+
+    def __init__(self, max_size=10000, flush_size=200, flush_interval=5.0, overflow='drop_oldest', block_timeout=1.0):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'Unknown overflow policy {overflow!r}; expected one of {OVERFLOW_POLICIES}.')
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+
+        self._entries = deque()
+        self._lock = threading.Lock()
+        # Notified when a flush empties the buffer, for the searches waiting under the 'block' policy.
+        self._not_full = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        self.recorded = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def record(self, user_id, query, timestamp=None, results=0):
+        """
+        Adds a search to the buffer.
+
+        :param user_id: The primary key of the user who searched.
+        :param query: The search query string.
+        :param timestamp: When the search happened, defaults to now.
+        :param results: The number of results the search showed.
+        :return: True if the entry was buffered, False if it was dropped.
+        """
+        entry = (user_id, query[:QUERY_MAX_LENGTH], timestamp or timezone.now(), results)
+        self._ensure_thread()
+
+        with self._lock:
+            if self.overflow == 'block' and len(self._entries) >= self.max_size:
+                # Backpressure: wait for the background thread to write the buffer, checking again under the lock.
+                self._wakeup.set()
+                self._not_full.wait_for(lambda: len(self._entries) < self.max_size, timeout=self.block_timeout)
+            if len(self._entries) >= self.max_size:
+                self.dropped += 1
+                if self.overflow != 'drop_oldest':
+                    return False
+                self._entries.popleft()
+            self._entries.append(entry)
+            self.recorded += 1
+            flush_due = len(self._entries) >= self.flush_size
+
+        if flush_due:
+            self._wakeup.set()
+        return True
+
+    def flush(self):
+        """
+        Writes every buffered entry to the database with bulk_create, and adds them to the search rollups.
+
+        :return: The number of entries written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._entries)
+                self._entries.clear()
+                self._not_full.notify_all()
+            if not batch:
+                return 0
+
+            try:
+                write_searches(batch)
+                written = len(batch)
+            except IntegrityError:
+                logger.warning('Could not write %d search history entries at once; writing them one by one.',
+                               len(batch), exc_info=True)
+                written = sum(write_searches_safely([entry]) for entry in batch)
+            except Exception:
+                logger.exception('Could not write %d search history entries.', len(batch))
+                written = 0
+
+            with self._lock:
+                self.flushed += written
+                self.failed += len(batch) - written
+            return written
+
+    def stats(self):
+        """
+        Returns the buffer's counters.
+
+        :return: A dict with the pending, recorded, flushed, dropped and failed entry counts.
+        """
+        with self._lock:
+            return {
+                'pending': len(self._entries),
+                'recorded': self.recorded,
+                'flushed': self.flushed,
+                'dropped': self.dropped,
+                'failed': self.failed,
+            }
+
+    def close(self):
+        """
+        Stops the background thread and flushes the remaining entries. Called when the process exits.
+        """
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='search-history-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            # The thread keeps its own database connection; honour CONN_MAX_AGE like a request would.
+            close_old_connections()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_options():
+    """
+    Returns the CATALOG_SEARCH_LOG setting merged over the defaults.
+
+    :return: A dict of options.
+    """
+    return {**DEFAULTS, **getattr(settings, 'CATALOG_SEARCH_LOG', {})}
+
+
+def get_buffer():
+    """
+    Returns the process-wide search history buffer, creating it from the CATALOG_SEARCH_LOG setting on first use.
+
+    :return: The SearchHistoryBuffer instance.
+    """
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                options = get_options()
+                _buffer = SearchHistoryBuffer(
+                    max_size=options['MAX_SIZE'],
+                    flush_size=options['FLUSH_SIZE'],
+                    flush_interval=options['FLUSH_INTERVAL'],
+                    overflow=options['OVERFLOW'],
+                    block_timeout=options['BLOCK_TIMEOUT'],
+                )
+                atexit.register(_buffer.close)
+    return _buffer
+
+
+def latest_searches(user_ids):
+    """
+    Returns the newest SearchHistory record of each user, in one query served by the (user, -timestamp, -id) index.
+
+    :param user_ids: An iterable of user primary keys.
+    :return: A dict mapping user ids to SearchHistory instances; users without history are left out.
+    """
+    newest = SearchHistory.objects.filter(user_id=OuterRef('pk')).order_by('-timestamp', '-id').values('pk')[:1]
+    latest_ids = User.objects.filter(pk__in=user_ids).values(latest=Subquery(newest))
+    return {row.user_id: row for row in SearchHistory.objects.filter(pk__in=latest_ids)}
+
+
+def collapse_searches(entries, latest, window):
+    """
+    Folds each search repeating the user's previous query within window into the previous record.
+
+    :param entries: A list of (user id, query, timestamp, results) tuples, in the order the searches were made.
+    :param latest: A dict mapping user ids to their newest stored SearchHistory record.
+    :param window: A timedelta; repeats further apart than this are kept as separate records.
+    :return: A (new SearchHistory instances, dict mapping stored record ids to (repeats, latest timestamp)) tuple.
+    """
+    rows, repeats = [], {}
+    previous = dict(latest)
+    for user_id, query, timestamp, _ in entries:
+        last = previous.get(user_id)
+        if last is not None and last.query == query and abs(timestamp - last.timestamp) <= window:
+            last.count += 1
+            last.timestamp = max(last.timestamp, timestamp)
+            if last.pk is not None:
+                count, _latest = repeats.get(last.pk, (0, None))
+                repeats[last.pk] = (count + 1, last.timestamp)
+            continue
+        row = SearchHistory(user_id=user_id, query=query, timestamp=timestamp)
+        rows.append(row)
+        previous[user_id] = row
+    return rows, repeats
+
+
+def write_searches(entries):
+    """
+    Writes searches to SearchHistory, collapsing repeated queries, and adds them to the search rollups, in one
+    transaction.
+
+    :param entries: A list of (user id, query, timestamp, results) tuples.
+    """
+    seconds = get_options()['COLLAPSE_WINDOW']
+    with transaction.atomic():
+        if seconds:
+            latest = latest_searches({user_id for user_id, _query, _timestamp, _results in entries})
+            rows, repeats = collapse_searches(entries, latest, timedelta(seconds=seconds))
+        else:
+            rows = [SearchHistory(user_id=user_id, query=query, timestamp=timestamp)
+                    for user_id, query, timestamp, _ in entries]
+            repeats = {}
+        # Increment in the database, so that a concurrent flush repeating the same record is not lost.
+        for pk, (count, timestamp) in repeats.items():
+            SearchHistory.objects.filter(pk=pk).update(
+                count=F('count') + count, timestamp=Greatest('timestamp', Value(timestamp)),
+            )
+        SearchHistory.objects.bulk_create(rows, batch_size=500)
+        search_analytics.add_searches((query, timestamp, results) for _, query, timestamp, results in entries)
+
+
+def write_searches_safely(entries):
+    """
+    Writes searches with write_searches(), logging a database error instead of raising it.
+
+    :param entries: A list of (user id, query, timestamp, results) tuples.
+    :return: The number of entries written: all of them, or 0 if the write failed.
+    """
+    try:
+        write_searches(entries)
+    except DatabaseError:
+        logger.exception('Could not write %d search history entries.', len(entries))
+        return 0
+    return len(entries)
+
+
+def record_search(user, query, results=0):
+    """
+    Records a search made by a user, buffered unless CATALOG_SEARCH_LOG['ENABLED'] is False.
+
+    :param user: The User who searched.
+    :param query: The search query string.
+    :param results: The number of results the search showed.
+    """
+    if not get_options()['ENABLED']:
+        write_searches_safely([(user.pk, query[:QUERY_MAX_LENGTH], timezone.now(), results)])
+        return
+    get_buffer().record(user.pk, query, results=results)
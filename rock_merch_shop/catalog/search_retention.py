@@ -0,0 +1,149 @@
+"""
+Retention of the SearchHistory table: expired records are archived to gzip-compressed JSON Lines, then deleted.
+
+A record expires when it is older than MAX_AGE_DAYS, or when its user has at least MAX_PER_USER newer records (both
+read from the CATALOG_SEARCH_LOG dict, None disabling a limit). Users are processed one at a time, their expired
+records being found through the (user, -timestamp, -id) index rather than by scanning the table.
+
+Expired records are read in chunks. Each chunk is appended to the archive and flushed to disk before its records are
+deleted in short batches, each in its own transaction, so that the searches being logged meanwhile never wait long
+for a write lock, and an interrupted run loses nothing (re-running it may archive the last chunk twice).
+"""
+import gzip
+import json
+import os
+from datetime import timedelta
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import SearchHistory
+from .pagination import keyset_condition
+from .search_log import get_options
+
+# Newest first, as listed by the search_history view and ordered by the index.
+HISTORY_ORDERING = ('-timestamp', '-id')
+
+# Fields written to the archive for each record.
+ARCHIVE_FIELDS = ('id', 'user_id', 'query', 'count', 'timestamp')
+
+
+def expired_condition(user_id, now, options):
+    """
+    Returns the condition selecting a user's expired records.
+
+    :param user_id: The primary key of the user.
+    :param now: The moment the ages are measured from.
+    :param options: The search log options.
+    :return: A Q object, or None if none of the user's records expired.
+    """
+    condition = Q()
+    if options['MAX_AGE_DAYS'] is not None:
+        condition |= Q(timestamp__lt=now - timedelta(days=options['MAX_AGE_DAYS']))
+    if options['MAX_PER_USER'] is not None:
+        # The oldest record kept, if the user has more than MAX_PER_USER; every record after it expired.
+        cap = options['MAX_PER_USER']
+        history = SearchHistory.objects.filter(user_id=user_id).order_by(*HISTORY_ORDERING)
+        last_kept = list(history.values_list('timestamp', 'id')[cap - 1:cap + 1])
+        if len(last_kept) == 2:
+            condition |= keyset_condition(HISTORY_ORDERING, last_kept[0])
+    return condition or None
+
+
+class Archive:
+    """
+    A gzip-compressed JSON Lines file the expired records are appended to, created on the first write.
+
+    Attributes:
+        - path (Path): The path of the archive file.
+        - records (int): The number of records written.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.records = 0
+        self._file = None
+
+    def write(self, rows):
+        """
+        Appends records to the archive, and makes sure they reached the disk.
+
+        :param rows: A list of dicts with the ARCHIVE_FIELDS of each record.
+        """
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = gzip.open(self.path, 'at', encoding='utf-8')
+        for row in rows:
+            self._file.write(json.dumps({**row, 'timestamp': row['timestamp'].isoformat()}) + '\n')
+        # A sync flush keeps the archive readable up to this point even if the run is interrupted.
+        self._file.flush()
+        os.fsync(self._file.buffer.fileobj.fileno())
+        self.records += len(rows)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def archive_user(user_id, condition, archive, chunk_size, batch_size):
+    """
+    Archives and deletes a user's expired records, oldest first.
+
+    :return: The number of records archived.
+    """
+    archived = 0
+    expired = SearchHistory.objects.filter(condition, user_id=user_id).order_by('timestamp', 'id')
+    while True:
+        rows = list(expired.values(*ARCHIVE_FIELDS)[:chunk_size])
+        if not rows:
+            return archived
+        archive.write(rows)
+        pks = [row['id'] for row in rows]
+        for start in range(0, len(pks), batch_size):
+            # Autocommit: each batch holds the write lock briefly.
+            SearchHistory.objects.filter(pk__in=pks[start:start + batch_size]).delete()
+        archived += len(rows)
+
+
+def archive_expired(output_dir=None, now=None, options=None, chunk_size=5000, batch_size=500, dry_run=False):
+    """
+    Archives and deletes every expired SearchHistory record.
+
+    :param output_dir: The directory of the archive, defaults to ARCHIVE_DIR.
+    :param now: The moment the ages are measured from, defaults to now.
+    :param options: The search log options, defaults to get_options().
+    :param chunk_size: Records read and archived at once.
+    :param batch_size: Records deleted per statement.
+    :param dry_run: Only count the expired records.
+    :return: A dict with the number of users processed, of expired records, and the archive path (None if nothing
+             was archived).
+    """
+    options = options or get_options()
+    now = now or timezone.now()
+    archive = Archive(Path(output_dir or options['ARCHIVE_DIR']) / f'search-history-{now:%Y%m%dT%H%M%S}.jsonl.gz')
+    stats = {'users': 0, 'expired': 0, 'archive': None}
+    last_user_id = 0
+    try:
+        while True:
+            user_ids = list(
+                User.objects.filter(pk__gt=last_user_id).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+            )
+            if not user_ids:
+                break
+            for user_id in user_ids:
+                condition = expired_condition(user_id, now, options)
+                if condition is None:
+                    continue
+                if dry_run:
+                    stats['expired'] += SearchHistory.objects.filter(condition, user_id=user_id).count()
+                else:
+                    stats['expired'] += archive_user(user_id, condition, archive, chunk_size, batch_size)
+            stats['users'] += len(user_ids)
+            last_user_id = user_ids[-1]
+    finally:
+        archive.close()
+    if archive.records:
+        stats['archive'] = str(archive.path)
+    return stats
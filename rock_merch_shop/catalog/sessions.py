@@ -0,0 +1,150 @@
+"""
+Session engine serving sessions from the cache, with the database written behind it (SESSION_ENGINE =
+'catalog.sessions').
+
+Sessions are read from the SESSION_CACHE_ALIAS cache, and from the django_session table only on a cache miss (the
+entry expired or was evicted, or another process wrote it). Saving a session:
+
+    - creating one (login, key rotation) writes the database at once, which detects key collisions;
+    - a session whose data did not actually change is not written at all (Django saves every session that was
+      assigned to, even with the values it already held);
+    - other changes update the cache at once and are written to the database after the response was sent, when the
+      request_finished signal fires (see catalog/signals.py), coalesced per session.
+
+The cache hit rate and the write counts are served by the staff-only request_stats view. Settings are read from the
+CATALOG_SESSIONS dict; set 'WRITE_BEHIND' to False to write every change before the response.
+
+Deleting a session (logout, flush) leaves a marker in the cache for SESSION_COOKIE_AGE, so that a request still holding
+the session cannot put it back in the cache with a deferred save. SESSION_CACHE_ALIAS must be shared by every worker
+process, which is why the settings only enable this engine when CATALOG_CACHE_BACKEND is a shared cache.
+"""
+import atexit
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.sessions.backends import cached_db
+from django.contrib.sessions.backends.base import UpdateError
+from django.db import router, transaction
+
+from .instrumentation import CacheCounter
+
+DEFAULTS = {
+    'WRITE_BEHIND': True,
+}
+
+# Session cache lookups, and how session saves were handled ('written', 'deferred', 'unchanged').
+cache_counter = CacheCounter()
+write_counts = Counter()
+_counts_lock = threading.Lock()
+
+# Deferred writes by session key: the latest (encoded session data, expiry date) of each session.
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def get_options():
+    """
+    Returns the CATALOG_SESSIONS setting merged over the defaults.
+
+    :return: A dict of options.
+    """
+    return {**DEFAULTS, **getattr(settings, 'CATALOG_SESSIONS', {})}
+
+
+def count_write(outcome):
+    with _counts_lock:
+        write_counts[outcome] += 1
+
+
+def stats():
+    """
+    Returns the session cache hit counts, the save counts and the number of writes waiting for the database.
+    """
+    with _counts_lock, _pending_lock:
+        return {'cache': cache_counter.snapshot(), 'saves': dict(write_counts), 'pending': len(_pending)}
+
+
+def write_pending(**kwargs):
+    """
+    Writes the deferred session changes to the database, in one transaction.
+
+    Sessions deleted meanwhile (e.g. by a logout in another request) are not recreated.
+
+    :return: The number of sessions written.
+    """
+    with _pending_lock:
+        pending = list(_pending.items())
+        _pending.clear()
+    if not pending:
+        return 0
+    model = SessionStore.get_model_class()
+    with transaction.atomic(using=router.db_for_write(model)):
+        for session_key, (session_data, expire_date) in pending:
+            model.objects.filter(session_key=session_key).update(session_data=session_data, expire_date=expire_date)
+    return len(pending)
+
+
+atexit.register(write_pending)
+
+
+class SessionStore(cached_db.SessionStore):
+    """
+    A cached_db session store counting its cache hits, skipping unchanged saves and deferring database writes.
+    """
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._loaded_state = None
+
+    def load(self):
+        try:
+            data = self._cache.get(self.cache_key)
+        except Exception:
+            # Some backends raise on invalid cache keys; the session is reset, as cached_db does.
+            data = None
+        cache_counter.record(data is not None)
+
+        if data is None:
+            session = self._get_session_from_db()
+            if session:
+                data = self.decode(session.session_data)
+                self._cache.set(self.cache_key, data, self.get_expiry_age(expiry=session.expire_date))
+            else:
+                data = {}
+        self._loaded_state = self.serializer().dumps(data)
+        return data
+
+    @property
+    def deleted_key(self):
+        return f'{self.cache_key}:deleted'
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        if not must_create and not settings.SESSION_SAVE_EVERY_REQUEST:
+            if self._loaded_state is not None and self.serializer().dumps(self._get_session()) == self._loaded_state:
+                count_write('unchanged')
+                return
+        if must_create or not get_options()['WRITE_BEHIND']:
+            super().save(must_create)
+            count_write('written')
+        else:
+            # The session was deleted meanwhile (as the database backend does when the row is gone).
+            if self._cache.get(self.deleted_key):
+                raise UpdateError
+            session = self.create_model_instance(self._get_session())
+            self._cache.set(self.cache_key, self._session, self.get_expiry_age())
+            with _pending_lock:
+                _pending[session.session_key] = (session.session_data, session.expire_date)
+            count_write('deferred')
+        self._loaded_state = self.serializer().dumps(self._session)
+
+    def delete(self, session_key=None):
+        session_key = session_key or self.session_key
+        if session_key is None:
+            return
+        with _pending_lock:
+            _pending.pop(session_key, None)
+        self._cache.set(f'{self.cache_key_prefix}{session_key}:deleted', True, settings.SESSION_COOKIE_AGE)
+        super().delete(session_key)
@@ -0,0 +1,171 @@
+"""
+Signal handlers keeping the catalog's derived data in sync with the models it is computed from.
+
+The handlers are connected when the app registry is ready (see CatalogConfig.ready).
+"""
+import os
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.signals import request_finished
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from . import autocomplete, auth_backends, cache, instrumentation, search, sessions, thumbnails
+from .models import Band, Category, Item, Rating
+from .ratings import apply_rating_delta
+
+
+@receiver(post_save, sender=Item)
+def index_saved_item(sender, instance, raw=False, using=None, **kwargs):
+    """
+    Re-indexes an item in the search index after it is created or updated.
+
+    Items loaded from fixtures (raw saves) are indexed once the fixture is committed, since their band and category
+    may be loaded after them.
+    """
+    if raw:
+        pk = instance.pk
+        transaction.on_commit(lambda: search.index_items([pk]), using=using)
+        return
+    search.index_items([instance.pk])
+
+
+@receiver(post_delete, sender=Item)
+def unindex_deleted_item(sender, instance, **kwargs):
+    """
+    Removes a deleted item from the search index.
+    """
+    search.remove_items([instance.pk])
+
+
+@receiver(post_save, sender=Band)
+@receiver(post_save, sender=Category)
+def reindex_related_items(sender, instance, raw=False, update_fields=None, **kwargs):
+    """
+    Re-indexes the items of a band or category after it is saved, since their indexed band/category name may have
+    changed. Saves that explicitly leave the name untouched are ignored.
+    """
+    if raw or (update_fields is not None and 'name' not in update_fields):
+        return
+    related_field = 'band' if sender is Band else 'category'
+    item_ids = Item.objects.filter(**{related_field: instance}).values_list('pk', flat=True)
+    search.index_items(item_ids)
+
+
+@receiver(post_delete, sender=Rating)
+def subtract_deleted_rating(sender, instance, **kwargs):
+    """
+    Removes a deleted rating from its item's rating aggregates (covers admin deletes and cascades from users).
+    """
+    apply_rating_delta(instance.item_id, -1, -instance.score)
+
+
+@receiver(post_init, sender=Item)
+def remember_loaded_image(sender, instance, **kwargs):
+    """
+    Remembers the image an item was loaded with, so that saving it without replacing the image generates nothing.
+    """
+    # The raw field value: the stored name of a loaded item, a file (or nothing) for a new one.
+    image = instance.__dict__.get('image')
+    instance._loaded_image = getattr(image, 'name', image) or ''
+
+
+@receiver(post_save, sender=Item)
+def generate_image_derivatives(sender, instance, raw=False, update_fields=None, **kwargs):
+    """
+    Generates the responsive derivatives of an item's image when it is uploaded or replaced, and records the image's
+    content hash and width on the item. Derivatives that already exist on disk are not generated again.
+
+    Saves that leave the image alone (update_fields without 'image', or the image the item was loaded with, whose
+    derivatives are on disk) neither read nor decode it.
+
+    This handler is connected before invalidate_cached_pages, so cached pages are invalidated after the hash changes.
+    """
+    if raw or (update_fields is not None and 'image' not in update_fields):
+        return
+    media_root = str(settings.MEDIA_ROOT)
+    name = instance.image.name if instance.image else ''
+    if name == instance._loaded_image and instance.image_hash and thumbnails.derivatives_exist(
+            instance.image_hash, instance.image_width, media_root):
+        return
+    digest, width = '', None
+    if instance.image and os.path.exists(instance.image.path):
+        digest, width, _written = thumbnails.render_derivatives(instance.image.path, media_root)
+    if (digest, width) != (instance.image_hash, instance.image_width):
+        # A queryset update avoids sending post_save again.
+        Item.objects.filter(pk=instance.pk).update(image_hash=digest, image_width=width)
+        instance.image_hash, instance.image_width = digest, width
+    instance._loaded_image = name
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+@receiver(post_save, sender=Band)
+@receiver(post_delete, sender=Band)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_cached_pages(sender, **kwargs):
+    """
+    Invalidates the cached pages rendered from the saved or deleted model (see catalog/cache.py).
+    """
+    cache.bump_model_version(sender)
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_save, sender=Band)
+@receiver(post_save, sender=Category)
+def refresh_autocomplete_suggestion(sender, instance, raw=False, **kwargs):
+    """
+    Refreshes the suggestion of a saved item, band or category in this process's autocomplete index, once the
+    transaction commits. Other processes pick the change up when their index is rebuilt (see catalog/autocomplete.py).
+    """
+    if raw:
+        return
+    transaction.on_commit(lambda: autocomplete.update_instance(instance))
+
+
+@receiver(post_delete, sender=Item)
+@receiver(post_delete, sender=Band)
+@receiver(post_delete, sender=Category)
+def remove_autocomplete_suggestion(sender, instance, **kwargs):
+    """
+    Removes the suggestion of a deleted item, band or category from this process's autocomplete index.
+    """
+    # The instance's primary key is cleared once the deletion completes.
+    pk = instance.pk
+    transaction.on_commit(lambda: autocomplete.remove_suggestion(sender, pk))
+
+
+@receiver(connection_created, dispatch_uid='catalog.install_query_recorder')
+def install_query_recorder(sender, connection, **kwargs):
+    """
+    Installs the request instrumentation's execute wrapper on every new database connection.
+
+    Connections are per thread, so this also covers the threads async views run their queries on. The signal is sent
+    again whenever a connection object reconnects; install() leaves a wrapper already in place alone.
+    """
+    instrumentation.install(connection)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """
+    Drops a saved or deleted user from the user cache (see catalog/auth_backends.py), at once and again when the
+    transaction commits, in case a concurrent request cached the old row meanwhile.
+    """
+    pk = instance.pk
+    auth_backends.invalidate_user(pk)
+    transaction.on_commit(lambda: auth_backends.invalidate_user(pk))
+
+
+@receiver(request_finished)
+def write_pending_sessions(sender, **kwargs):
+    """
+    Writes the session changes deferred during the request to the database, after the response was sent (see
+    catalog/sessions.py).
+    """
+    sessions.write_pending()
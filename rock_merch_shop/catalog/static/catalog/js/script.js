@@ -68,3 +68,34 @@ $(document).ready(function(){
     });
 });
 
+// This script fills the navbar search box's suggestion list as the user types.
+$(document).ready(function(){
+    var searchInput = $('#navbar-search');
+    var suggestionList = $('#search-suggestions');
+    var pendingRequest = null;
+    var typingTimer = null;
+
+    searchInput.on('input', function(){
+        var query = $(this).val().trim();
+        // Wait until the user pauses typing, so that one request is sent per word rather than per keystroke.
+        clearTimeout(typingTimer);
+        if (!query) {
+            suggestionList.empty();
+            return;
+        }
+        typingTimer = setTimeout(function(){
+            // A newer request makes the previous one irrelevant.
+            if (pendingRequest) {
+                pendingRequest.abort();
+            }
+            pendingRequest = $.getJSON(autocompleteUrl, {'q': query}, function(response){
+                suggestionList.empty();
+                $.each(response.results, function(index, suggestion){
+                    // The option's value is copied into the search box when chosen; its label gives the context.
+                    var detail = suggestion.detail ? suggestion.detail + ' · ' + suggestion.type : suggestion.type;
+                    suggestionList.append($('<option>').attr('value', suggestion.label).attr('label', detail));
+                });
+            });
+        }, 150);
+    });
+});
@@ -0,0 +1,194 @@
+"""
+Static asset pipeline: content-hashed file names, pre-compressed variants and an index to serve them from.
+
+CompressedManifestStaticFilesStorage (the 'staticfiles' storage) runs at collectstatic time. On top of Django's
+manifest storage, which copies every file under a name carrying a hash of its content and rewrites the references
+between CSS files, it:
+
+    - writes a .gz (and, with the optional 'brotli' package installed, a .br) variant of every text asset,
+    - recompresses PNG images losslessly and writes a .webp variant of PNG and JPEG images when it is smaller (the
+      names keep the hash of the original content, which still changes whenever the source image does).
+
+Hashed files never change, so they can be cached for a year. StaticFileIndex lists the collected files and their
+variants once, so catalog.middleware.StaticAssetMiddleware can serve them (with the CATALOG_SERVE_STATIC setting)
+when no web server sits in front of Django.
+
+Until collectstatic has been run (development, tests), {% static %} falls back to the unhashed names.
+"""
+import gzip
+import io
+import json
+import logging
+import mimetypes
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:  # Optional: without it only gzip variants are written.
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Extensions of the assets worth compressing; images and fonts are already compressed.
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.mjs', '.json', '.map', '.svg', '.txt', '.xml', '.html', '.ico', '.ttf',
+                           '.otf', '.eot'}
+
+# Extensions of the images recompressed and given a WebP variant.
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+
+# Content-Encoding of each pre-compressed variant, by file suffix, in order of preference.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# A variant is only kept when it saves at least this fraction of the original size.
+MIN_SAVING = 0.05
+
+
+def smaller(size, original_size):
+    return size <= original_size * (1 - MIN_SAVING)
+
+
+def write_if_smaller(path, data, original_size):
+    """
+    Writes a variant of a file, unless it would not be worth serving instead of the original.
+
+    :return: True if the variant was written.
+    """
+    if not smaller(len(data), original_size):
+        return False
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as output:
+        output.write(data)
+    os.replace(temporary, path)
+    return True
+
+
+def compress_file(path):
+    """
+    Writes the .gz and .br variants of a text asset.
+
+    :param path: The filesystem path of the asset.
+    :return: The number of variants written.
+    """
+    with open(path, 'rb') as source:
+        data = source.read()
+    # mtime=0 keeps the output identical across runs.
+    written = write_if_smaller(f'{path}.gz', gzip.compress(data, compresslevel=9, mtime=0), len(data))
+    if brotli is not None:
+        written += write_if_smaller(f'{path}.br', brotli.compress(data, quality=11), len(data))
+    return int(written)
+
+
+def optimize_image(path):
+    """
+    Recompresses a PNG image losslessly in place and writes a .webp variant of a PNG or JPEG image.
+
+    :param path: The filesystem path of the image.
+    :return: The number of files written.
+    """
+    from PIL import Image
+
+    original_size = os.path.getsize(path)
+    written = 0
+    with Image.open(path) as image:
+        image.load()
+        if image.format == 'PNG':
+            buffer = io.BytesIO()
+            image.save(buffer, 'PNG', optimize=True)
+            written += write_if_smaller(path, buffer.getvalue(), original_size)
+        buffer = io.BytesIO()
+        converted = image if image.mode in ('RGB', 'RGBA') else image.convert('RGBA')
+        converted.save(buffer, 'WEBP', quality=82, method=6)
+        written += write_if_smaller(f'{path}.webp', buffer.getvalue(), original_size)
+    return written
+
+
+def process_file(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension in COMPRESSIBLE_EXTENSIONS:
+        return compress_file(path)
+    if extension in IMAGE_EXTENSIONS:
+        return optimize_image(path)
+    return 0
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Manifest storage that also pre-compresses the hashed files (see the module docstring).
+    """
+    # Without a manifest, url() falls back to the unhashed name instead of failing (see stored_name).
+    manifest_strict = False
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        # Only the hashed copies are referenced by the pages, so only they are compressed.
+        hashed_paths = [self.path(name) for name in set(self.hashed_files.values())]
+        with ThreadPoolExecutor() as pool:
+            written = sum(pool.map(process_file, hashed_paths))
+        logger.info('Wrote %d compressed variants of %d static files.', written, len(hashed_paths))
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            # The file has not been collected yet.
+            return name
+
+
+class StaticFile:
+    """
+    A collected static file and its pre-compressed variants.
+
+    Attributes:
+        - path (str): The filesystem path of the file.
+        - content_type (str): The MIME type of the file.
+        - size (int): The size of the file in bytes.
+        - mtime (float): The modification time of the file.
+        - immutable (bool): Whether the name carries a content hash, so the file can be cached forever.
+        - encodings (dict): The path and size of each pre-compressed variant, by Content-Encoding.
+        - webp (tuple): The path and size of the WebP variant of an image, or None.
+    """
+
+    def __init__(self, path, immutable):
+        stat = os.stat(path)
+        self.path = path
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.immutable = immutable
+        self.encodings = {}
+        for encoding, suffix in ENCODINGS:
+            if os.path.exists(path + suffix):
+                self.encodings[encoding] = (path + suffix, os.path.getsize(path + suffix))
+        self.webp = (path + '.webp', os.path.getsize(path + '.webp')) if os.path.exists(path + '.webp') else None
+
+
+class StaticFileIndex:
+    """
+    The collected static files by URL path, read from STATIC_ROOT once so serving a file never searches the disk.
+    """
+
+    def __init__(self, root, url_prefix):
+        self.files = {}
+        if not root or not os.path.isdir(root):
+            return
+        hashed_names = set()
+        manifest = os.path.join(root, ManifestStaticFilesStorage.manifest_name)
+        if os.path.exists(manifest):
+            with open(manifest, encoding='utf-8') as source:
+                hashed_names = set(json.load(source).get('paths', {}).values())
+        variant_suffixes = tuple(suffix for _encoding, suffix in ENCODINGS) + ('.webp',)
+        for directory, _subdirectories, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, root).replace(os.sep, '/')
+                if name.endswith(variant_suffixes) and os.path.exists(path.rsplit('.', 1)[0]):
+                    continue
+                self.files[url_prefix + name] = StaticFile(path, immutable=name in hashed_names)
+
+    def get(self, path):
+        return self.files.get(path)
@@ -0,0 +1,34 @@
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html
+
+from catalog.vendor import VENDOR_ASSETS, is_vendored
+
+register = template.Library()
+
+
+@register.simple_tag
+def vendor_asset(name):
+    """
+    Renders the <link> or <script> element of a third-party asset.
+
+    Usage: {% vendor_asset 'bootstrap.css' %}
+
+    The self-hosted copy (see catalog/vendor.py) is linked through {% static %}, so it gets the hashed, compressed
+    version collectstatic writes; until `python manage.py vendor_assets` has been run, the CDN copy is linked with
+    its integrity hash instead.
+
+    :param name: The asset name, a key of catalog.vendor.VENDOR_ASSETS.
+    :return: The HTML markup.
+    """
+    asset = VENDOR_ASSETS[name]
+    if is_vendored(name):
+        url, attributes = static(asset['path']), ''
+    else:
+        url = asset['url']
+        attributes = (
+            format_html(' integrity="{}" crossorigin="anonymous"', asset['integrity']) if asset['integrity'] else ''
+        )
+    if asset['path'].endswith('.css'):
+        return format_html('<link href="{}" rel="stylesheet"{}>', url, attributes)
+    return format_html('<script src="{}"{}></script>', url, attributes)
@@ -0,0 +1,29 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from catalog import fragments
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def item_cards(context, items, template_name):
+    """
+    Renders one card per item with the given template, reusing the cards cached by previous requests.
+
+    Usage: {% item_cards items 'catalog/cards/list_item.html' %}
+
+    The card template is rendered with the item as `item`; it must only depend on the item, its category and its
+    band, which the cache keys are versioned on (see catalog/fragments.py).
+
+    :param items: The Item instances to render.
+    :param template_name: The card template.
+    :return: The concatenated cards.
+    """
+    card_template = context.template.engine.get_template(template_name)
+
+    def render(item):
+        with context.push(item=item):
+            return card_template.render(context)
+
+    return mark_safe(''.join(fragments.render_cards(template_name, items, render)))
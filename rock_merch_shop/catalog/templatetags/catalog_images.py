@@ -0,0 +1,48 @@
+from django import template
+from django.utils.html import format_html
+
+from catalog.thumbnails import FORMATS, derivative_url, display_preset, srcset
+
+register = template.Library()
+
+# Default 'sizes' attribute of each preset: how wide the image is displayed at different viewport widths.
+PRESET_SIZES = {
+    'thumb': '100px',
+    'card': '(max-width: 576px) 100vw, 350px',
+    'detail': '(max-width: 800px) 100vw, 800px',
+}
+
+
+@register.simple_tag
+def responsive_image(item, preset, css_class='', sizes=None):
+    """
+    Renders an item's image as a <picture> element with WebP and PNG srcsets of its resized derivatives.
+
+    Usage: {% responsive_image item 'card' css_class='img-fluid' %}
+
+    Falls back to a plain <img> of the original upload when the derivatives have not been generated yet.
+
+    :param item: The Item whose image is rendered.
+    :param preset: The preset the image is displayed at ('thumb', 'card' or 'detail'), used for 'src' and 'sizes'.
+    :param css_class: CSS classes added to the <img> element.
+    :param sizes: A 'sizes' attribute overriding the preset default.
+    :return: The HTML markup, or an empty string if the item has no image.
+    """
+    if not item.image:
+        return ''
+    if not item.image_hash:
+        return format_html('<img src="{}" alt="{}" class="{}" loading="lazy">', item.image.url, item.name, css_class)
+
+    sizes = sizes or PRESET_SIZES[preset]
+    preferred, fallback = FORMATS
+    width = item.image_width
+    return format_html(
+        '<picture>'
+        '<source type="image/{}" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="lazy" decoding="async">'
+        '</picture>',
+        preferred, srcset(item.image_hash, preferred, width), sizes,
+        derivative_url(item.image_hash, display_preset(preset, width), fallback),
+        srcset(item.image_hash, fallback, width), sizes,
+        item.name, css_class,
+    )
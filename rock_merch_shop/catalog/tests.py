@@ -1,3 +1,1851 @@
-from django.test import TestCase
+import base64
+import csv
+import gzip
+import importlib
+import json
+import os
+import re
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.contrib.admin import helpers
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.base import UpdateError
+from django.contrib.sessions.models import Session
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.backends.signals import connection_created
+from django.http import QueryDict
+from django.test import (
+    AsyncClient, AsyncRequestFactory, Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, resolve, reverse
+from django.utils import timezone
+
+from . import (
+    async_views, autocomplete, benchmark, cache, exports, facets, fragments, instrumentation, pagination,
+    recommendations, routers, search, search_analytics, search_log, sessions, thumbnails, views,
+)
+from .admin import MAX_PRICE, EstimatedCountPaginator, estimated_row_count
+from .models import Band, Category, Item, ItemRecommendation, Rating, SearchHistory, SearchRollup
+from .ratings import rate_item, rate_items, recompute_rating_aggregates
+from .templatetags import catalog_images
+
+# Statements about the database schema itself (e.g. checking that the FTS5 table exists) are not plan-checked.
+SCHEMA_TABLES_RE = re.compile(r'\b(sqlite_master|information_schema)\b', re.IGNORECASE)
+
+
+def capture_selects(function):
+    """
+    Calls function and returns its result with the SELECT statements it executed.
+
+    :param function: A callable taking no arguments.
+    :return: A (result, list of (sql, params) tuples) tuple.
+    """
+    statements = []
+
+    def record(execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith('SELECT') and not SCHEMA_TABLES_RE.search(sql):
+            statements.append((sql, params))
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(record):
+        result = function()
+    return result, statements
+
+
+def sqlite_plan_problems(sql, params, allowed_scans, sorted_ranges=()):
+    """
+    Runs EXPLAIN QUERY PLAN on a statement and lists what it should not do.
+
+    A statement with a WHERE clause must not scan a table (other than through a partial index), and no statement may
+    sort in a temporary B-tree, except the relevance ordering of a full-text virtual table and the rows an index range
+    on one of the sorted_ranges columns found.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        details = [row[3] for row in cursor.fetchall()]
+
+    problems = []
+    filtered = ' WHERE ' in sql.upper()
+    virtual = any('VIRTUAL TABLE' in detail for detail in details)
+    ranged = any(
+        re.search(rf'^SEARCH \w+ USING (?:COVERING )?INDEX \w+ \(.*\b{column}[<>]', detail)
+        for column in sorted_ranges for detail in details
+    )
+    for detail in details:
+        scan = re.match(r'SCAN (\w+)(?: USING (?:COVERING )?INDEX (\w+))?', detail)
+        if scan and filtered and scan.group(1) not in allowed_scans and 'VIRTUAL TABLE' not in detail:
+            table, index = scan.groups()
+            if index is None or not is_partial_index(table, index):
+                problems.append(f'full scan ({detail})')
+        if 'USE TEMP B-TREE' in detail and not virtual and not ranged:
+            problems.append(f'temporary sort ({detail})')
+    return problems
+
+
+def is_partial_index(table, index):
+    with connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA index_list("{table}")')
+        return any(row[1] == index and row[4] for row in cursor.fetchall())
+
+
+def mysql_plan_problems(sql, params, allowed_scans, sorted_ranges=()):
+    """
+    Runs EXPLAIN on a statement and lists full table scans of filtered statements, filesorts and temporary tables.
+    With sorted_ranges, the rows read through an index range may be sorted.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN {sql}', params)
+        columns = [column[0] for column in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    problems = []
+    filtered = ' WHERE ' in sql.upper()
+    for row in rows:
+        extra = row.get('Extra') or ''
+        if row['type'] == 'ALL' and filtered and row['table'] not in allowed_scans:
+            problems.append(f'full scan of {row["table"]}')
+        sorted_range = sorted_ranges and row['type'] == 'range'
+        if ('Using filesort' in extra or 'Using temporary' in extra) and not sorted_range:
+            problems.append(f'{extra} on {row["table"]}')
+    return problems
+
+
+# The interchangeable search backends (see catalog/search.py).
+SEARCH_BACKENDS = ('fts5', 'inverted')
+
+
+class SearchIndexTests(TestCase):
+    """
+    Checks the ranking of both search backends and that saving and deleting items, bands and categories keeps the
+    index in step.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shirts = Category.objects.create(name='Shirts')
+        cls.goods = Category.objects.create(name='Iron Goods')
+        cls.slayer = Band.objects.create(name='Slayer', genre='Thrash')
+        cls.maiden = Band.objects.create(name='Iron Maiden', genre='Heavy Metal')
+        cls.motorhead = Band.objects.create(name='Motörhead', genre='Rock')
+        # Items matching "iron" in their name, their band's name and their category's name respectively.
+        cls.by_name = cls.create_item('Iron Cross Tee', cls.slayer, cls.shirts)
+        cls.by_band = cls.create_item('Logo Tee', cls.maiden, cls.shirts)
+        cls.by_category = cls.create_item('Logo Mug', cls.slayer, cls.goods)
+        cls.ace = cls.create_item('Ace Poster', cls.motorhead, cls.shirts)
+
+    @classmethod
+    def create_item(cls, name, band, category):
+        return Item.objects.create(name=name, description='', price=Decimal('20'), category=category, band=band)
+
+    def test_name_matches_rank_above_band_and_category_matches(self):
+        for backend in SEARCH_BACKENDS:
+            with self.subTest(backend=backend), override_settings(CATALOG_SEARCH_BACKEND=backend):
+                search.rebuild_index()
+                self.assertEqual(
+                    search.search_item_ids('iron'), [self.by_name.pk, self.by_band.pk, self.by_category.pk]
+                )
+
+    def test_prefixes_every_token_and_diacritics(self):
+        for backend in SEARCH_BACKENDS:
+            with self.subTest(backend=backend), override_settings(CATALOG_SEARCH_BACKEND=backend):
+                search.rebuild_index()
+                self.assertEqual(search.search_item_ids('maid'), [self.by_band.pk])
+                self.assertCountEqual(search.search_item_ids('iron logo'), [self.by_band.pk, self.by_category.pk])
+                self.assertEqual(search.search_item_ids('motorhead'), [self.ace.pk])
+                self.assertEqual(search.search_item_ids('iron ace'), [])
+                self.assertEqual(search.search_item_ids('  !? '), [])
+
+    def test_saves_and_deletes_refresh_the_index(self):
+        for backend in SEARCH_BACKENDS:
+            with self.subTest(backend=backend), override_settings(CATALOG_SEARCH_BACKEND=backend):
+                search.rebuild_index()
+                with transaction.atomic():
+                    item = self.create_item('Warpig Hoodie', self.slayer, self.shirts)
+                    self.assertEqual(search.search_item_ids('warpig'), [item.pk])
+                    item.name = 'Paranoid Hoodie'
+                    item.save()
+                    self.assertEqual(search.search_item_ids('warpig'), [])
+                    self.assertEqual(search.search_item_ids('paranoid'), [item.pk])
+                    item.delete()
+                    self.assertEqual(search.search_item_ids('paranoid'), [])
+                    transaction.set_rollback(True)
+
+    def test_band_and_category_renames_reindex_their_items(self):
+        for backend in SEARCH_BACKENDS:
+            with self.subTest(backend=backend), override_settings(CATALOG_SEARCH_BACKEND=backend):
+                search.rebuild_index()
+                with transaction.atomic():
+                    self.slayer.name = 'Kreator'
+                    self.slayer.save()
+                    self.assertCountEqual(search.search_item_ids('kreator'), [self.by_name.pk, self.by_category.pk])
+                    self.assertEqual(search.search_item_ids('slayer'), [])
+                    self.goods.name = 'Merch'
+                    self.goods.save()
+                    self.assertEqual(search.search_item_ids('merch'), [self.by_category.pk])
+                    transaction.set_rollback(True)
+
+    def test_fixture_loads_are_indexed(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'items.json')
+        with open(path, 'w', encoding='utf-8') as output:
+            json.dump([{'model': 'catalog.item', 'pk': 1000, 'fields': {
+                'name': 'Sabbath Patch', 'description': '', 'price': '5.00', 'category': self.shirts.pk,
+                'band': self.slayer.pk,
+            }}], output)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('loaddata', path, verbosity=0)
+        self.assertEqual(search.search_item_ids('sabbath'), [1000])
+
+    def test_migration_indexes_existing_items(self):
+        migration = importlib.import_module('catalog.migrations.0016_index_existing_items')
+        schema_editor = mock.Mock(connection=connection)
+        schema_editor.execute.side_effect = lambda sql: connection.cursor().execute(sql)
+        for backend in SEARCH_BACKENDS:
+            with self.subTest(backend=backend), override_settings(CATALOG_SEARCH_BACKEND=backend):
+                search.get_backend().clear()
+                self.assertEqual(search.search_item_ids('iron'), [])
+                migration.index_existing_items(django_apps, schema_editor)
+                self.assertEqual(
+                    search.search_item_ids('iron'), [self.by_name.pk, self.by_band.pk, self.by_category.pk]
+                )
+
+    def test_saves_leaving_the_name_alone_do_not_reindex(self):
+        with mock.patch.object(search, 'index_items') as index_items:
+            self.maiden.genre = 'NWOBHM'
+            self.maiden.save(update_fields=['genre'])
+        index_items.assert_not_called()
+
+    def test_search_results_page_ranks_items(self):
+        response = self.client.get(reverse('search_results'), {'q': 'iron'})
+        self.assertEqual(
+            [item.pk for item in response.context['items']], [self.by_name.pk, self.by_band.pk, self.by_category.pk]
+        )
+        self.assertContains(response, 'Iron Cross Tee')
+
+
+class RatingAggregateTests(TestCase):
+    """
+    Checks that the rating count, sum and average stored on items follow every rating change, and can be repaired.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category, band = Category.objects.create(name='Shirts'), Band.objects.create(name='Rockers', genre='Rock')
+        cls.item, cls.other_item = [
+            Item.objects.create(name=name, description='', price=Decimal('20'), category=category, band=band)
+            for name in ('Tour Tee', 'Tour Cap')
+        ]
+        cls.first, cls.second = [User.objects.create_user(name, password='secret') for name in ('first', 'second')]
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def assertAggregates(self, item, count, total, average):
+        item.refresh_from_db()
+        self.assertEqual((item.rating_count, item.rating_sum, item.rating_average), (count, total, average))
+
+    def test_ratings_update_the_aggregates(self):
+        self.assertEqual(rate_items(self.first, {self.item.pk: 4, self.other_item.pk: 1}),
+                         {self.item.pk: 'created', self.other_item.pk: 'created'})
+        self.assertAggregates(self.item, 1, 4, 4.0)
+        self.assertEqual(rate_item(self.second, self.item.pk, 1), 'created')
+        self.assertAggregates(self.item, 2, 5, 2.5)
+        # A changed score moves the sum only; an unchanged one and an unknown item change nothing.
+        self.assertEqual(rate_items(self.first, {self.item.pk: 2, self.other_item.pk: 1, 999999: 5}),
+                         {self.item.pk: 'updated', self.other_item.pk: 'unchanged', 999999: 'missing'})
+        self.assertAggregates(self.item, 2, 3, 1.5)
+        self.assertAggregates(self.other_item, 1, 1, 1.0)
+
+    def test_deleted_ratings_are_subtracted(self):
+        rate_items(self.first, {self.item.pk: 5, self.other_item.pk: 3})
+        rate_item(self.second, self.item.pk, 2)
+        Rating.objects.get(user=self.second, item=self.item).delete()
+        self.assertAggregates(self.item, 1, 5, 5.0)
+        # Deleting a user cascades to their ratings.
+        self.first.delete()
+        self.assertAggregates(self.item, 0, 0, 0.0)
+        self.assertAggregates(self.other_item, 0, 0, 0.0)
+
+    def test_recompute_repairs_the_aggregates(self):
+        rate_item(self.first, self.item.pk, 4)
+        rate_item(self.second, self.item.pk, 3)
+        Item.objects.update(rating_count=9, rating_sum=1, rating_average=0.1)
+        self.assertEqual(recompute_rating_aggregates(), 2)
+        self.assertAggregates(self.item, 2, 7, 3.5)
+        self.assertAggregates(self.other_item, 0, 0, 0.0)
+
+    def test_changes_invalidate_the_item_versions(self):
+        def item_versions():
+            return cache.model_versions([], [(Item, self.item.pk), (Item, self.other_item.pk)])
+
+        before = item_versions()
+        with self.captureOnCommitCallbacks(execute=True):
+            rate_item(self.first, self.item.pk, 4)
+        after = item_versions()
+        self.assertNotEqual(after[0], before[0])
+        self.assertEqual(after[1], before[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            Rating.objects.filter(user=self.first).delete()
+        self.assertNotEqual(item_versions()[0], after[0])
+
+
+class PageCacheTests(TestCase):
+    """
+    Checks that the home, category and band list pages are served from the cache to anonymous visitors, and that
+    saving or deleting a model invalidates exactly the pages rendered from it.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Shirts')
+        cls.band = Band.objects.create(name='Rockers', genre='Rock')
+        cls.item = Item.objects.create(name='Tour Tee', description='', price=Decimal('20'), category=cls.category,
+                                       band=cls.band, is_featured=True)
+        cls.user = User.objects.create_user('visitor', password='secret')
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.urls = {name: reverse(name) for name in ('home', 'category_list', 'band_list')}
+
+    def cache_states(self):
+        return {name: self.client.get(url).get('X-Page-Cache') for name, url in self.urls.items()}
+
+    def test_anonymous_pages_are_cached(self):
+        for name, url in self.urls.items():
+            with self.subTest(page=name):
+                first = self.client.get(url)
+                self.assertEqual(first['X-Page-Cache'], 'miss')
+                with self.assertNumQueries(0):
+                    second = self.client.get(url)
+                self.assertEqual(second['X-Page-Cache'], 'hit')
+                self.assertEqual(second.content, first.content)
+
+    def test_changes_invalidate_dependent_pages(self):
+        self.cache_states()
+        self.band.name = 'Renamed Rockers'
+        self.band.save()
+        self.assertEqual(self.cache_states(), {'home': 'miss', 'category_list': 'hit', 'band_list': 'miss'})
+        self.assertContains(self.client.get(self.urls['band_list']), 'Renamed Rockers')
+
+        Category.objects.create(name='Posters')
+        self.assertEqual(self.cache_states(), {'home': 'miss', 'category_list': 'miss', 'band_list': 'hit'})
+        self.assertContains(self.client.get(self.urls['category_list']), 'Posters')
+
+        self.item.delete()
+        self.assertEqual(self.cache_states(), {'home': 'miss', 'category_list': 'hit', 'band_list': 'hit'})
+        self.assertNotContains(self.client.get(self.urls['home']), 'Tour Tee')
+
+    def test_logged_in_users_bypass_the_page_cache(self):
+        self.cache_states()
+        self.client.force_login(self.user)
+        for name, url in self.urls.items():
+            with self.subTest(page=name):
+                response = self.client.get(url)
+                self.assertNotIn('X-Page-Cache', response)
+                self.assertContains(response, 'visitor')
+
+
+class InstrumentationTests(TestCase):
+    """
+    Checks the per-request SQL and render time metrics, the detection of repeated (N+1) statements and the stats
+    endpoint serving them.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_catalog', categories=1, bands=2, items=6, users=0, ratings=0, searches=0,
+            stdout=StringIO(), stderr=StringIO(),
+        )
+        cls.staff = User.objects.create_user('operator', password='secret', is_staff=True)
+        cls.item = Item.objects.order_by('pk').first()
+
+    def setUp(self):
+        cache.get_cache().clear()
+        instrumentation.store.reset()
+        self.addCleanup(instrumentation.store.reset)
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            instrumentation.normalize_sql('SELECT * FROM t WHERE id IN (%s, %s, %s) AND a = %s LIMIT 21'),
+            instrumentation.normalize_sql('SELECT * FROM t WHERE id IN (%s) AND a = %s LIMIT 5'),
+        )
+
+    @override_settings(CATALOG_INSTRUMENTATION={'RESPONSE_HEADER': True})
+    def test_requests_are_measured(self):
+        url = reverse('item_detail', args=[self.item.pk])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(int(response['X-Query-Count']), len(queries))
+        self.assertRegex(response['Server-Timing'], r'^sql;dur=[\d.]+, render;dur=[\d.]+, total;dur=[\d.]+$')
+
+        stats = instrumentation.store.snapshot()[resolve(url).view_name]
+        self.assertEqual(stats['queries']['count'], 1)
+        self.assertEqual(stats['queries']['max'], len(queries))
+        self.assertGreater(stats['render_ms']['max'], 0)
+        self.assertGreaterEqual(stats['latency_ms']['max'], stats['sql_ms']['max'] + stats['render_ms']['max'])
+
+    def test_repeated_statements_are_reported(self):
+        metrics = instrumentation.RequestMetrics()
+        token = instrumentation.activate(metrics)
+        try:
+            # One query per item, the N+1 pattern, and one list query.
+            for item in Item.objects.all():
+                Item.objects.get(pk=item.pk)
+        finally:
+            instrumentation.deactivate(token)
+        self.assertEqual(metrics.query_count, 7)
+        [(pattern, count)] = metrics.repeated_patterns(5)
+        self.assertEqual(count, 6)
+        self.assertIn('WHERE "catalog_item"."id" = %s', pattern)
+
+        instrumentation.store.record('catalog:test', metrics, threshold=5, max_patterns=10)
+        stats = instrumentation.store.snapshot()['catalog:test']
+        self.assertEqual(stats['repeated_queries'], [{'sql': pattern, 'requests': 1}])
+
+    def test_unsampled_requests_are_not_recorded(self):
+        for options in ({'ENABLED': False}, {'SAMPLE_RATE': 0.0}):
+            with self.subTest(options=options), override_settings(CATALOG_INSTRUMENTATION=options):
+                response = self.client.get(reverse('item_detail', args=[self.item.pk]))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(instrumentation.store.snapshot(), {})
+
+    def test_histogram_percentiles(self):
+        histogram = instrumentation.Histogram(instrumentation.LATENCY_BUCKETS_MS)
+        for value in [3] * 50 + [40] * 45 + [7000] * 5:
+            histogram.add(value)
+        snapshot = histogram.snapshot()
+        self.assertEqual((snapshot['p50'], snapshot['p95'], snapshot['p99']), (5, 50, 7000))
+        self.assertEqual((snapshot['buckets']['<=5'], snapshot['buckets']['>5000']), (50, 5))
+
+    def test_stats_endpoint(self):
+        url = reverse('request_stats')
+        self.client.get(reverse('item_detail', args=[self.item.pk]))
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.staff)
+
+        views = self.client.get(url, {'reset': 1}).json()['views']
+        self.assertEqual(views[resolve(reverse('item_detail', args=[self.item.pk])).view_name]['queries']['count'], 1)
+        # Only the reading request itself was recorded since the reset.
+        self.assertEqual(list(self.client.get(url).json()['views']), [resolve(url).view_name])
+
+
+@override_settings(CATALOG_SEARCH_LOG={'ENABLED': False})
+class QueryPlanTests(TestCase):
+    """
+    Checks the query plans of every catalog view against a seeded synthetic catalog.
+
+    Each view is requested with the test client, every SELECT it runs is explained (EXPLAIN QUERY PLAN on SQLite,
+    EXPLAIN on MySQL), and the test fails when a filtered query scans a whole table or a query sorts its rows in a
+    temporary B-tree (a filesort on MySQL). Statements without a WHERE clause, such as the full category and band
+    lists, read every row by design and may scan.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_catalog', categories=4, bands=10, items=300, users=10, ratings=1500, searches=500,
+            stdout=StringIO(), stderr=StringIO(),
+        )
+        cls.user = User.objects.filter(pk__in=SearchHistory.objects.values('user')).first()
+        cls.item = Item.objects.order_by('-rating_count', 'pk').first()
+
+    def setUp(self):
+        # Cached pages run no queries, so render everything.
+        cache.get_cache().clear()
+
+    def plan_problems(self, sql, params, allowed_scans, sorted_ranges=()):
+        if connection.vendor == 'sqlite':
+            return sqlite_plan_problems(sql, params, allowed_scans, sorted_ranges)
+        if connection.vendor == 'mysql':
+            return mysql_plan_problems(sql, params, allowed_scans, sorted_ranges)
+        self.skipTest(f'No query plan checks for the {connection.vendor} backend.')
+
+    def assertIndexedPlans(self, url, data=None, login=False, follow_pages=True, allowed_scans=(), sorted_ranges=()):
+        """
+        Requests a URL (and, if paginated, its second page) and asserts that none of its queries has a bad plan.
+
+        :param url: The URL to request.
+        :param data: Optional GET parameters.
+        :param login: Request as the seeded user.
+        :param follow_pages: Also check the page after the first one, whose keyset condition differs.
+        :param allowed_scans: Tables that may be scanned by these queries.
+        :param sorted_ranges: Columns whose index ranges may be sorted, when the requested ordering is another index's.
+        """
+        if login:
+            self.client.force_login(self.user)
+        response, statements = capture_selects(lambda: self.client.get(url, data))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(statements, f'{url} ran no queries; is the page cached?')
+
+        page = response.context.get('page') if response.context else None
+        if follow_pages and page is not None and page.has_next:
+            cache.get_cache().clear()
+            next_page, more = capture_selects(lambda: self.client.get(f'{url}?{page.next_query}'))
+            self.assertEqual(next_page.status_code, 200)
+            statements += more
+
+        for sql, params in statements:
+            problems = self.plan_problems(sql, params, allowed_scans, sorted_ranges)
+            self.assertEqual(problems, [], f'{url}: {sql}')
+
+    def test_home(self):
+        # Databases without partial indexes (MySQL) have no index for the featured items.
+        allowed = () if connection.features.supports_partial_indexes else ('catalog_item',)
+        self.assertIndexedPlans(reverse('home'), allowed_scans=allowed)
+
+    def test_category_and_band_lists(self):
+        self.assertIndexedPlans(reverse('category_list'))
+        self.assertIndexedPlans(reverse('band_list'))
+
+    def test_item_list_orderings(self):
+        url = reverse('item_list', args=[self.item.category_id])
+        for sort in ('default', 'rating', 'popular'):
+            with self.subTest(sort=sort):
+                self.assertIndexedPlans(url, {'sort': sort, 'page_size': 10})
+
+    def test_item_list_min_rating(self):
+        url = reverse('item_list', args=[self.item.category_id])
+        # The rating index serves both the range and the rating ordering.
+        self.assertIndexedPlans(url, {'sort': 'rating', 'min_rating': 3, 'page_size': 10})
+        # Other orderings sort the items the (category, rating_average) range of the rating index finds.
+        for sort in ('default', 'popular'):
+            with self.subTest(sort=sort):
+                self.assertIndexedPlans(url, {'sort': sort, 'min_rating': 3, 'page_size': 10},
+                                        sorted_ranges=['rating_average'])
+
+    def test_item_list_facets(self):
+        url = reverse('item_list', args=[self.item.category_id])
+        filters = {'band': self.item.band_id, 'genre': self.item.band.genre, 'price': ['20-50', '50-100']}
+        for sort in ('default', 'rating'):
+            with self.subTest(sort=sort):
+                self.assertIndexedPlans(url, {'sort': sort, 'min_rating': 2, 'page_size': 10, **filters})
+
+    def test_item_detail(self):
+        self.assertIndexedPlans(reverse('item_detail', args=[self.item.pk]), login=True)
+
+    def test_band_detail(self):
+        self.assertIndexedPlans(reverse('band_detail', args=[self.item.band_id]), {'page_size': 10})
+
+    def test_search_results(self):
+        query = self.item.band.name.split()[-2].lower()
+        self.assertIndexedPlans(reverse('search_results'), {'q': query, 'page_size': 5}, login=True)
+
+    def test_json_api(self):
+        self.assertIndexedPlans(reverse('api_item_list'), {'category': self.item.category_id, 'page_size': 10})
+        self.assertIndexedPlans(reverse('api_item_list'), {
+            'category': self.item.category_id, 'sort': 'popular', 'fields': 'id,name,band_name', 'page_size': 10,
+        })
+        self.assertIndexedPlans(reverse('api_item_detail', args=[self.item.pk]))
+        self.assertIndexedPlans(reverse('api_band_list'), {'page_size': 5})
+        self.assertIndexedPlans(reverse('api_category_list'), {'page_size': 2})
+
+    def test_search_history(self):
+        self.assertIndexedPlans(reverse('search_history'), {'page_size': 5}, login=True)
+
+    def test_search_history_exports(self):
+        # The downloads run their queries while the response is streamed.
+        staff = User.objects.create_user('analyst', is_staff=True)
+        since = SearchHistory.objects.order_by('timestamp').values_list('timestamp', flat=True)[100]
+        downloads = [
+            (self.user, reverse('search_history_export'), {}),
+            (staff, reverse('search_history_export_all'), {}),
+            (staff, reverse('search_history_export_all'), {'since': since.isoformat(), 'format': 'jsonl'}),
+            (staff, reverse('search_history_export_all'), {'since': since.isoformat(), 'user': self.user.username}),
+        ]
+        for user, url, data in downloads:
+            self.client.force_login(user)
+            _content, statements = capture_selects(lambda: b''.join(self.client.get(url, data).streaming_content))
+            for sql, params in statements:
+                self.assertEqual(self.plan_problems(sql, params, ()), [], f'{url}: {sql}')
+
+
+def forge_cursor(ordering, values, forward=True):
+    """
+    Builds a cursor token the way a client could, with arbitrary sort key values.
+    """
+    payload = json.dumps({'o': ','.join(ordering), 'k': values, 'f': int(forward)}).encode()
+    return base64.urlsafe_b64encode(payload).decode()
+
+
+@override_settings(CATALOG_SEARCH_LOG={'ENABLED': False})
+class KeysetPaginationTests(TestCase):
+    """
+    Checks that cursors walk every row exactly once, and that tampered cursors are rejected with a 400.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_catalog', categories=1, bands=3, items=25, users=5, ratings=60, searches=0,
+            stdout=StringIO(), stderr=StringIO(),
+        )
+        cls.category_id = Item.objects.values_list('category', flat=True).first()
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.url = reverse('item_list', args=[self.category_id])
+
+    def test_cursor_round_trip(self):
+        ordering = ['-timestamp', 'id']
+        moment = timezone.now().replace(microsecond=123456)
+        token = pagination.encode_cursor(ordering, [moment, 7], forward=False)
+        values, forward = pagination.decode_cursor(token, ordering)
+        self.assertEqual(values, [moment.isoformat(), 7])
+        self.assertFalse(forward)
+        with self.assertRaises(pagination.InvalidCursor):
+            pagination.decode_cursor(token, ['id'])
+
+    def test_pages_cover_every_item_once(self):
+        for sort in views.ITEM_SORTS:
+            with self.subTest(sort=sort):
+                expected = list(Item.objects.order_by(*views.ITEM_SORTS[sort]).values_list('pk', flat=True))
+                seen, params = [], {'sort': sort, 'page_size': 7}
+                while True:
+                    page = self.client.get(self.url, params).context['page']
+                    seen += [item.pk for item in page.object_list]
+                    if not page.has_next:
+                        break
+                    params = QueryDict(page.next_query)
+                self.assertEqual(seen, expected)
+
+                # Walking back from the last page returns the previous one.
+                previous = self.client.get(self.url, QueryDict(page.previous_query)).context['page']
+                last = len(page.object_list)
+                self.assertEqual([item.pk for item in previous.object_list], seen[-last - 7:-last])
+
+    def test_tampered_cursors_are_rejected(self):
+        rating = views.ITEM_SORTS['rating']
+        tampered = [
+            ({}, 'not a cursor!'),
+            ({}, forge_cursor(['id'], ['abc'])),
+            ({}, forge_cursor(['id'], [[1]])),
+            ({}, forge_cursor(['id'], [True])),
+            ({}, forge_cursor(['id'], [10 ** 30])),
+            ({}, forge_cursor(['id'], [1, 2])),
+            ({'sort': 'rating'}, forge_cursor(rating, ['abc', 1, 1])),
+            ({'sort': 'rating'}, forge_cursor(rating, [4.5, 'x', 1])),
+            ({'sort': 'rating'}, forge_cursor(['id'], [1])),
+        ]
+        for params, cursor in tampered:
+            with self.subTest(params=params, cursor=cursor):
+                self.assertEqual(self.client.get(self.url, {**params, 'cursor': cursor}).status_code, 400)
+
+        self.assertEqual(self.client.get(self.url, {'cursor': forge_cursor(['id'], [1])}).status_code, 200)
+        history = forge_cursor(['-timestamp', '-id'], ['yesterday', 1])
+        user = User.objects.first()
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse('search_history'), {'cursor': history}).status_code, 400)
+        search = forge_cursor(['relevance', 'id'], ['abc', 1])
+        self.assertEqual(self.client.get(reverse('search_results'), {'q': 'shirt', 'cursor': search}).status_code, 400)
+        response = self.client.get(reverse('api_item_list'), {'cursor': forge_cursor(['id'], ['abc'])})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CATALOG_SEARCH_LOG={'ENABLED': False})
+class FacetTests(TestCase):
+    """
+    Checks the facet counts of the item list under filters, and that invalid filter values are ignored.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Shirts')
+        cls.rock = Band.objects.create(name='Rockers', genre='Rock')
+        cls.metal = Band.objects.create(name='Metallers', genre='Metal')
+        # (band, price, rating average)
+        for band, price, rating in [(cls.rock, '15', 4.5), (cls.rock, '30', 3.2), (cls.rock, '120', 0),
+                                    (cls.metal, '25', 4.1), (cls.metal, '45', 2.0)]:
+            Item.objects.create(name=f'{band.name} {price}', description='', price=Decimal(price),
+                                category=cls.category, band=band, rating_average=rating)
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.url = reverse('item_list', args=[self.category.pk])
+
+    def counts(self, facet_counts, facet):
+        return {option['value']: option['count'] for option in facet_counts[facet]}
+
+    def test_counts_under_filters(self):
+        response = self.client.get(self.url, {'price': '20-50', 'min_rating': 3})
+        facet_counts = response.context['facets']
+        # Items of $20 to $50 rated 3 and up: Rockers 30 and Metallers 25.
+        self.assertEqual(facet_counts['total'], 2)
+        self.assertEqual([item.name for item in response.context['items']], ['Rockers 30', 'Metallers 25'])
+        # Each facet counts with the other facets' filters only.
+        self.assertEqual(self.counts(facet_counts, 'band'), {self.rock.pk: 1, self.metal.pk: 1})
+        self.assertEqual(self.counts(facet_counts, 'genre'), {'Rock': 1, 'Metal': 1})
+        self.assertEqual(self.counts(facet_counts, 'price'), {'under-20': 1, '20-50': 2, '50-100': 0, '100-up': 0})
+        self.assertEqual(self.counts(facet_counts, 'rating'), {4: 1, 3: 2, 2: 3, 1: 3})
+
+        facet_counts = self.client.get(self.url, {'band': self.metal.pk, 'genre': 'Rock'}).context['facets']
+        self.assertEqual(facet_counts['total'], 0)
+        self.assertEqual(self.counts(facet_counts, 'band'), {self.rock.pk: 3, self.metal.pk: 0})
+        # The selected genre stays listed without matches.
+        self.assertEqual(self.counts(facet_counts, 'genre'), {'Metal': 2, 'Rock': 0})
+
+    def test_invalid_filters_are_ignored(self):
+        for params in ({'band': '\u00b2'}, {'band': '9' * 23}, {'band': '-1'}, {'band': '0'}, {'min_rating': 'nan'},
+                       {'min_rating': '1e400'}, {'price': 'free'}):
+            with self.subTest(params=params):
+                response = self.client.get(self.url, params)
+                self.assertEqual(response.status_code, 200)
+        self.assertEqual(facets.parse_filters(QueryDict('band=\u00b2&band=3&band=99999999999999999999')).bands, (3,))
+        self.assertEqual(facets.parse_filters(QueryDict('min_rating=1e400')).min_rating, 0)
+        self.assertEqual(facets.parse_filters(QueryDict('min_rating=9')).min_rating, 5)
+
+
+class JsonApiTests(TestCase):
+    """
+    Checks the JSON API payloads, field selection, cursor links and error bodies.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shirts = Category.objects.create(name='Shirts')
+        cls.posters = Category.objects.create(name='Posters')
+        cls.rock = Band.objects.create(name='Rockers', genre='Rock')
+        cls.metal = Band.objects.create(name='Metallers', genre='Metal')
+        cls.items = [
+            Item.objects.create(name=f'Item {index}', description='', price=Decimal('10.50') + index,
+                                category=cls.shirts if index < 5 else cls.posters,
+                                band=cls.rock if index % 2 else cls.metal)
+            for index in range(7)
+        ]
+
+    def get_json(self, url, status=200, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status)
+        return response.json()
+
+    def test_item_list_payload_and_cursors(self):
+        url = reverse('api_item_list')
+        first = self.get_json(url, category=self.shirts.pk, page_size=3)
+        item = self.items[0]
+        self.assertEqual(first['results'][0], {
+            'id': item.pk, 'name': 'Item 0', 'description': '', 'price': '10.50', 'category_id': self.shirts.pk,
+            'category_name': 'Shirts', 'band_id': self.metal.pk, 'band_name': 'Metallers', 'genre': 'Metal',
+            'is_featured': False, 'rating_count': 0, 'rating_average': 0.0, 'image': None,
+        })
+        self.assertEqual(first['pagination']['page_size'], 3)
+        self.assertIsNone(first['pagination']['previous'])
+
+        second = self.get_json(url, category=self.shirts.pk, page_size=3, cursor=first['pagination']['next'])
+        self.assertEqual([row['id'] for row in first['results'] + second['results']],
+                         [item.pk for item in self.items[:5]])
+        self.assertIsNone(second['pagination']['next'])
+        back = self.get_json(url, category=self.shirts.pk, page_size=3, cursor=second['pagination']['previous'])
+        self.assertEqual(back['results'], first['results'])
+
+    def test_field_selection_and_filters(self):
+        rows = self.get_json(reverse('api_item_list'), fields='name,band_name', band=self.rock.pk)['results']
+        self.assertEqual(rows, [{'name': item.name, 'band_name': 'Rockers'} for item in self.items[1::2]])
+        item = self.get_json(reverse('api_item_detail', args=[self.items[6].pk]), fields='id,category_name')
+        self.assertEqual(item, {'id': self.items[6].pk, 'category_name': 'Posters'})
+        bands = self.get_json(reverse('api_band_list'), genre='Metal')['results']
+        self.assertEqual(bands, [{'id': self.metal.pk, 'name': 'Metallers', 'genre': 'Metal'}])
+        categories = self.get_json(reverse('api_category_list'), fields='name')['results']
+        self.assertEqual(categories, [{'name': 'Shirts'}, {'name': 'Posters'}])
+
+    def test_errors(self):
+        url = reverse('api_item_list')
+        for category in ('abc', '\u00b2', '9' * 20, '0'):
+            with self.subTest(category=category):
+                body = self.get_json(url, status=400, category=category)
+                self.assertEqual(body, {'error': '"category" must be a category ID.'})
+        self.assertIn('Unknown fields: colour.', self.get_json(url, status=400, fields='name,colour')['error'])
+        self.assertEqual(self.get_json(url, status=400, cursor='garbage'), {'error': 'Invalid cursor.'})
+        for item_id in (self.items[-1].pk + 1, 10 ** 20):
+            with self.subTest(item_id=item_id):
+                body = self.get_json(reverse('api_item_detail', args=[item_id]), status=404)
+                self.assertEqual(body, {'error': 'Item does not exist.'})
+        self.assertEqual(self.client.post(url).status_code, 405)
+
+
+class ConditionalGetTests(TestCase):
+    """
+    Checks that catalog pages answer a matching If-None-Match with 304 Not Modified, without running the view, until
+    something they show changes.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_catalog', categories=2, bands=3, items=10, users=2, ratings=10, searches=0,
+            stdout=StringIO(), stderr=StringIO(),
+        )
+        cls.user = User.objects.filter(username__startswith='synthetic').first()
+        cls.item = Item.objects.order_by('pk').first()
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def revalidate(self, url, etag):
+        with self.assertNumQueries(0):
+            return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_not_modified(self):
+        for url in (reverse('home'), reverse('item_detail', args=[self.item.pk]),
+                    reverse('band_detail', args=[self.item.band_id])):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(self.revalidate(url, response['ETag']).status_code, 304)
+
+    def test_model_change_invalidates(self):
+        url = reverse('band_detail', args=[self.item.band_id])
+        etag = self.client.get(url)['ETag']
+        self.item.band.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_rating_invalidates_item_page(self):
+        url = reverse('item_detail', args=[self.item.pk])
+        self.client.force_login(self.user)
+        etag = self.client.get(url)['ETag']
+        previous = Rating.objects.filter(user=self.user, item=self.item).values_list('score', flat=True).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('submit_rating'), {'item_id': self.item.pk, 'score': 5 if previous != 5 else 4})
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_varies_per_user(self):
+        url = reverse('item_detail', args=[self.item.pk])
+        anonymous = self.client.get(url)
+        self.assertNotIn('private', anonymous['Cache-Control'])
+        self.client.force_login(self.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=anonymous['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+
+
+def reload_urlconf():
+    """
+    Re-imports the URLconfs, which route the sync or the async catalog views depending on CATALOG_ASYNC_VIEWS.
+    """
+    from rock_merch_shop import urls
+
+    from . import urls as catalog_urls
+
+    importlib.reload(catalog_urls)
+    importlib.reload(urls)
+    clear_url_caches()
+
+
+@override_settings(CATALOG_ASYNC_VIEWS=True, CATALOG_SEARCH_LOG={'ENABLED': False})
+class AsyncViewTests(TestCase):
+    """
+    Checks the native async catalog views, served with CATALOG_ASYNC_VIEWS on.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        # Registered first, so it runs once the settings are restored.
+        cls.addClassCleanup(reload_urlconf)
+        super().setUpClass()
+        reload_urlconf()
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_catalog', categories=2, bands=2, items=6, users=1, ratings=4, searches=0,
+            stdout=StringIO(), stderr=StringIO(),
+        )
+        cls.user = User.objects.filter(username__startswith='synthetic').first()
+        cls.item = Item.objects.order_by('pk').first()
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    async def test_pages(self):
+        urls = [
+            (reverse('home'), async_views.home),
+            (reverse('item_list', args=[self.item.category_id]), async_views.item_list),
+            (reverse('item_detail', args=[self.item.pk]), async_views.item_detail),
+            (reverse('band_detail', args=[self.item.band_id]), async_views.band_detail),
+            (reverse('search_results') + '?q=' + self.item.name.split()[0], async_views.search_results),
+        ]
+        client = AsyncClient()
+        for url, view in urls:
+            with self.subTest(url=url):
+                self.assertIs(resolve(url.split('?')[0]).func, view)
+                response = await client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, self.item.name if view is not async_views.home else 'Categories')
+
+        missing = await client.get(reverse('item_detail', args=[999999]))
+        self.assertEqual(missing.status_code, 404)
+
+    async def test_submit_rating(self):
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        response = await client.post(reverse('submit_rating'), {'item_id': self.item.pk, 'score': 5})
+        self.assertEqual(response.json(), {'success': True, 'score': 5, 'item_id': self.item.pk})
+        self.assertEqual(await Rating.objects.filter(user=self.user, item=self.item).values_list('score', flat=True)
+                         .aget(), 5)
+
+    def test_query_recorder_installed_once(self):
+        connection.ensure_connection()
+        for _ in range(2):
+            connection_created.send(sender=connection.__class__, connection=connection)
+        self.assertEqual(connection.execute_wrappers.count(instrumentation.record_query), 1)
+
+
+@override_settings(CATALOG_SEARCH_LOG={'ENABLED': False})
+class RatingBatchTests(TestCase):
+    """
+    Checks the batch rating endpoint: valid entries are written together, invalid ones are reported per entry.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_catalog', categories=1, bands=1, items=3, users=1, ratings=0, searches=0,
+            stdout=StringIO(), stderr=StringIO(),
+        )
+        cls.user = User.objects.filter(username__startswith='synthetic').first()
+        cls.items = list(Item.objects.order_by('pk'))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def submit(self, ratings):
+        return self.client.post(reverse('submit_ratings'), json.dumps({'ratings': ratings}),
+                                content_type='application/json')
+
+    def test_ratings_are_written(self):
+        first, second, _third = self.items
+        response = self.submit([{'item_id': first.pk, 'score': 4}, {'item_id': str(second.pk), 'score': '2'},
+                                {'item_id': first.pk, 'score': 5}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'success': True, 'results': [
+            {'item_id': first.pk, 'success': True, 'score': 5, 'status': 'created'},
+            {'item_id': second.pk, 'success': True, 'score': 2, 'status': 'created'},
+        ]})
+        self.assertEqual(dict(Rating.objects.filter(user=self.user).values_list('item_id', 'score')),
+                         {first.pk: 5, second.pk: 2})
+        first.refresh_from_db()
+        self.assertEqual((first.rating_count, first.rating_average), (1, 5))
+
+        response = self.submit([{'item_id': first.pk, 'score': 5}, {'item_id': second.pk, 'score': 3}])
+        self.assertEqual([result['status'] for result in response.json()['results']], ['unchanged', 'updated'])
+
+    def test_invalid_entries_are_reported(self):
+        item = self.items[0]
+        response = self.submit([
+            {'item_id': [1], 'score': 5}, {'item_id': {}, 'score': 5}, {'item_id': item.pk, 'score': 4.9},
+            {'item_id': item.pk, 'score': True}, {'item_id': '²', 'score': 5}, {'item_id': 2 ** 64, 'score': 5},
+            {'item_id': item.pk + 1, 'score': 6}, {'item_id': 999999, 'score': 5}, {'item_id': item.pk, 'score': 3},
+        ])
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertFalse(body['success'])
+        self.assertEqual([(result['item_id'], result.get('error')) for result in body['results']], [
+            ([1], 'item_id and score must be integers.'),
+            ({}, 'item_id and score must be integers.'),
+            (item.pk, None),
+            ('²', 'item_id and score must be integers.'),
+            (2 ** 64, 'item_id and score must be integers.'),
+            (item.pk + 1, 'Score must be between 1 and 5.'),
+            (999999, 'Item does not exist.'),
+        ])
+        # The last entry of an item wins.
+        self.assertEqual(list(Rating.objects.filter(user=self.user).values_list('item_id', 'score')), [(item.pk, 3)])
+
+    def test_malformed_requests(self):
+        for body in ('not json', '{"ratings": {}}', '{"ratings": [1]}', '{}'):
+            with self.subTest(body=body):
+                response = self.client.post(reverse('submit_ratings'), body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+        with override_settings(CATALOG_MAX_RATING_BATCH=2):
+            self.assertEqual(self.submit([{'item_id': self.items[0].pk, 'score': 1}] * 3).status_code, 400)
+        self.assertFalse(Rating.objects.exists())
+
+
+@override_settings(CATALOG_SEARCH_LOG={'ENABLED': False})
+class ItemImageTests(TestCase):
+    """
+    Checks that uploaded item images get their responsive derivatives once, at the widths the image allows.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_catalog', categories=1, bands=1, items=1, users=0, ratings=0, searches=0,
+            stdout=StringIO(), stderr=StringIO(),
+        )
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.media_root = media_root.name
+        self.item = Item.objects.get()
+
+    def upload(self, width, height):
+        from PIL import Image
+
+        content = BytesIO()
+        Image.new('RGB', (width, height), 'red').save(content, 'PNG')
+        self.item.image = SimpleUploadedFile('shirt.png', content.getvalue(), content_type='image/png')
+        self.item.save()
+
+    def derived_files(self):
+        return sorted(os.listdir(os.path.join(self.media_root, thumbnails.DERIVED_DIR)))
+
+    def test_derivatives_of_small_image(self):
+        self.upload(200, 100)
+        item = Item.objects.get()
+        self.assertEqual((len(item.image_hash), item.image_width), (16, 200))
+        self.assertEqual(self.derived_files(), [
+            f'{item.image_hash}-{preset}.{image_format}'
+            for preset in ('card', 'thumb') for image_format in ('png', 'webp')
+        ])
+
+        html = catalog_images.responsive_image(item, 'detail')
+        # The image is not upscaled: the srcsets list the thumb and the 200 pixel card only.
+        self.assertIn(f'-thumb.webp 100w, /media/derived/{item.image_hash}-card.webp 200w"', html)
+        self.assertNotIn('800w', html)
+        self.assertIn(f'src="/media/derived/{item.image_hash}-card.png"', html)
+
+    def test_unchanged_image_is_not_processed_again(self):
+        self.upload(1000, 500)
+        self.assertEqual(len(self.derived_files()), 6)
+        with mock.patch.object(thumbnails, 'render_derivatives', wraps=thumbnails.render_derivatives) as render:
+            self.item.save(update_fields=['name'])
+            self.item.save()
+            item = Item.objects.get()
+            item.price += 1
+            item.save()
+            self.assertEqual(render.call_count, 0)
+
+            # Missing derivatives are generated again.
+            os.remove(os.path.join(self.media_root, thumbnails.derivative_name(item.image_hash, 'detail', 'webp')))
+            item.save()
+            self.assertEqual(render.call_count, 1)
+        self.assertEqual(len(self.derived_files()), 6)
+
+        self.upload(300, 300)
+        self.assertNotEqual(Item.objects.get().image_hash, item.image_hash)
+
+
+class RecommendationTests(TestCase):
+    """
+    Checks the item-to-item recommendations computed from the ratings, and their incremental refresh.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(f'fan{number}') for number in range(4)]
+        call_command(
+            'generate_catalog', categories=1, bands=2, items=6, users=0, ratings=0, searches=0,
+            stdout=StringIO(), stderr=StringIO(),
+        )
+        cls.items = list(Item.objects.order_by('pk'))
+
+    def rate(self, user, *items, score=5):
+        rate_items(user, {item.pk: score for item in items})
+
+    def recommended(self, item):
+        return list(
+            ItemRecommendation.objects.filter(item=item).order_by('rank').values_list('recommended_id', flat=True)
+        )
+
+    def test_co_rated_items_first(self):
+        first, second, third, *_others = self.items
+        for user in self.users[:3]:
+            self.rate(user, first, second)
+        self.rate(self.users[3], first, third)
+        stats = recommendations.compute()
+        self.assertEqual(stats['mode'], 'full')
+        self.assertEqual(self.recommended(first), [second.pk, third.pk])
+        self.assertEqual(self.recommended(second), [first.pk])
+
+        # One indexed query reads them on the item page.
+        response = self.client.get(reverse('item_detail', args=[first.pk]))
+        self.assertEqual([row.recommended for row in response.context['recommendations']], [second, third])
+
+    def test_incremental_refresh(self):
+        first, second, third, fourth, *_others = self.items
+        self.rate(self.users[0], first, second)
+        recommendations.compute()
+        self.assertEqual(self.recommended(third), [])
+
+        for user in self.users[1:]:
+            self.rate(user, third, fourth)
+        self.rate(self.users[0], third)
+        stats = recommendations.compute(incremental=True)
+        self.assertEqual(stats['mode'], 'incremental')
+        self.assertEqual(stats['recomputed'], 2)
+        self.assertEqual(self.recommended(third), [fourth.pk, first.pk, second.pk])
+        # The lists of the items similar to the recomputed ones are updated as well.
+        self.assertEqual(self.recommended(first), [second.pk, third.pk])
+
+
+class AutocompleteTests(TestCase):
+    """
+    Checks that the autocomplete endpoint answers from the in-process prefix index without querying the database, and
+    that the index follows model changes.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_catalog', categories=2, bands=3, items=10, users=2, ratings=10, searches=0,
+            stdout=StringIO(), stderr=StringIO(),
+        )
+        cls.band = Band.objects.order_by('pk').first()
+
+    def setUp(self):
+        autocomplete.reset_index()
+        self.addCleanup(autocomplete.reset_index)
+
+    def suggest(self, query):
+        response = self.client.get(reverse('autocomplete'), {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [(result['type'], result['id']) for result in response.json()['results']]
+
+    def test_no_queries_once_built(self):
+        autocomplete.get_index()
+        with self.assertNumQueries(0):
+            results = self.suggest(self.band.name[:4])
+        self.assertIn(('band', self.band.pk), results)
+
+    def test_matches_inner_words(self):
+        words = self.band.name.split()
+        self.assertIn(('band', self.band.pk), self.suggest(' '.join(words[1:])[:-1]))
+        self.assertEqual(self.suggest('zzzz'), [])
+
+    def test_follows_model_changes(self):
+        autocomplete.get_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.band.name = 'Quasar Lizards'
+            self.band.save()
+        self.assertEqual(self.suggest('quasar liz'), [('band', self.band.pk)])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.band.item_set.all().delete()
+            self.band.delete()
+        self.assertEqual(self.suggest('quasar'), [])
+
+
+@override_settings(CATALOG_SEARCH_LOG={'ENABLED': False})
+class SearchAnalyticsTests(TestCase):
+    """
+    Checks that logged searches are counted in the hourly and daily rollups, and the reports read from them.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('searcher', password='secret')
+        cls.staff = User.objects.create_user('analyst', password='secret', is_staff=True)
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.now = timezone.now()
+
+    def counts(self, period):
+        return dict(SearchRollup.objects.filter(period=period).values_list('query', 'searches'))
+
+    def test_logged_searches_are_rolled_up(self):
+        self.client.login(username='searcher', password='secret')
+        for query in ('Iron Maiden', 'iron  maiden', 'zzzz'):
+            self.client.get(reverse('search_results'), {'q': query})
+        self.assertEqual(self.counts(SearchRollup.HOUR), {'iron maiden': 2, 'zzzz': 1})
+        self.assertEqual(self.counts(SearchRollup.DAY), {'iron maiden': 2, 'zzzz': 1})
+        self.assertEqual(SearchRollup.objects.get(period=SearchRollup.DAY, query='zzzz').zero_result_searches, 1)
+
+    def test_batches_add_up(self):
+        search_analytics.add_searches([('metal', self.now, 3), ('metal', self.now, 0)])
+        search_analytics.add_searches([('Metal', self.now, 5)])
+        bucket = SearchRollup.objects.get(period=SearchRollup.HOUR, query='metal')
+        self.assertEqual((bucket.searches, bucket.zero_result_searches, bucket.results), (3, 1, 5))
+
+    def test_reports(self):
+        earlier = self.now - timedelta(hours=30)
+        search_analytics.add_searches(
+            [('metal', earlier, 4)] * 2 + [('metal', self.now, 4)] * 3 + [('punk', self.now, 0)] * 4
+        )
+        trending = search_analytics.trending(hours=24)
+        self.assertEqual([(entry['query'], entry['searches'], entry['growth']) for entry in trending],
+                         [('punk', 4, None), ('metal', 3, 0.5)])
+        zero_results = search_analytics.zero_results(days=7)
+        self.assertEqual([(entry['query'], entry['zero_result_searches']) for entry in zero_results], [('punk', 4)])
+
+        self.client.login(username='analyst', password='secret')
+        response = self.client.get(reverse('search_stats'), {'hours': 24, 'limit': 1})
+        self.assertEqual([entry['query'] for entry in response.json()['trending']], ['punk'])
+
+    def test_rebuild_from_history(self):
+        SearchHistory.objects.bulk_create([
+            SearchHistory(user=self.user, query=query, timestamp=self.now) for query in ('Metal', 'metal', 'punk')
+        ])
+        SearchRollup.objects.create(period=SearchRollup.HOUR, bucket_start=self.now - timedelta(days=30), query='old')
+        call_command('rollup_searches', days=2, stdout=StringIO())
+        self.assertEqual(self.counts(SearchRollup.HOUR), {'metal': 2, 'punk': 1})
+        self.assertEqual(self.counts(SearchRollup.DAY), {'metal': 2, 'punk': 1})
+
+    def test_rebuild_counts_collapsed_repeats(self):
+        SearchHistory.objects.bulk_create([
+            SearchHistory(user=self.user, query='metal', timestamp=self.now, count=3),
+            SearchHistory(user=self.user, query='zzzz', timestamp=self.now, count=2),
+        ])
+        search_analytics.rebuild(self.now, self.now, 24)
+        self.assertEqual(self.counts(SearchRollup.DAY), {'metal': 3, 'zzzz': 2})
+        self.assertEqual(SearchRollup.objects.get(period=SearchRollup.DAY, query='zzzz').zero_result_searches, 2)
+
+    def test_rebuild_keeps_archived_buckets(self):
+        archived = self.now - timedelta(days=5)
+        search_analytics.add_searches([('metal', archived, 1)] * 4 + [('punk', self.now, 1)])
+        SearchHistory.objects.create(user=self.user, query='punk', timestamp=self.now, count=2)
+        search_analytics.rebuild(archived, self.now, 24)
+        # The searches of five days ago were archived: their rollups are kept.
+        self.assertEqual(self.counts(SearchRollup.DAY), {'metal': 4, 'punk': 2})
+        self.assertEqual(self.counts(SearchRollup.HOUR), {'metal': 4, 'punk': 2})
+
+
+@override_settings(CATALOG_SEARCH_LOG={'ENABLED': False, 'COLLAPSE_WINDOW': 0})
+class SearchLogTests(TransactionTestCase):
+    """
+    Checks the buffered search history writer: flushes, overflow policies and database errors. Foreign keys are
+    checked when a transaction commits, so these tests commit theirs.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('searcher', password='secret')
+
+    def make_buffer(self, **options):
+        # The background thread only flushes when it is stopped, or woken by a full buffer.
+        buffer = search_log.SearchHistoryBuffer(**{'flush_size': 100, 'flush_interval': 60, **options})
+        self.addCleanup(buffer.close)
+        return buffer
+
+    def queries(self):
+        return list(SearchHistory.objects.order_by('id').values_list('query', flat=True))
+
+    def test_flush(self):
+        buffer = self.make_buffer()
+        for query in ('metal', 'punk', 'Iron Maiden'):
+            self.assertTrue(buffer.record(self.user.pk, query))
+        self.assertEqual(self.queries(), [])
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(self.queries(), ['metal', 'punk', 'Iron Maiden'])
+        self.assertEqual(SearchRollup.objects.filter(period=SearchRollup.DAY).count(), 3)
+        self.assertEqual(buffer.stats(), {'pending': 0, 'recorded': 3, 'flushed': 3, 'dropped': 0, 'failed': 0})
+
+    def test_overflow(self):
+        for overflow, kept in (('drop_oldest', ['b', 'c']), ('drop_newest', ['a', 'b'])):
+            with self.subTest(overflow=overflow):
+                SearchHistory.objects.all().delete()
+                buffer = self.make_buffer(max_size=2, overflow=overflow)
+                accepted = [buffer.record(self.user.pk, query) for query in ('a', 'b', 'c')]
+                self.assertEqual(accepted, [True, True, overflow == 'drop_oldest'])
+                buffer.flush()
+                self.assertEqual(self.queries(), kept)
+                self.assertEqual(buffer.stats()['dropped'], 1)
+
+    def test_block_waits_for_the_writer(self):
+        buffer = self.make_buffer(max_size=1, overflow='block', block_timeout=0.05)
+        buffer.record(self.user.pk, 'a')
+        # While the writer cannot flush, a search waits for the timeout and is dropped.
+        with buffer._flush_lock:
+            self.assertFalse(buffer.record(self.user.pk, 'b'))
+        # The writer thread is woken up and makes room.
+        buffer.block_timeout = 10
+        self.assertTrue(buffer.record(self.user.pk, 'c'))
+        buffer.flush()
+        self.assertEqual(self.queries(), ['a', 'c'])
+        self.assertEqual(buffer.stats()['dropped'], 1)
+
+    def test_integrity_error_falls_back_to_single_rows(self):
+        buffer = self.make_buffer()
+        deleted = User.objects.create_user('deleted')
+        for user_id, query in ((self.user.pk, 'metal'), (deleted.pk, 'punk'), (self.user.pk, 'grunge')):
+            buffer.record(user_id, query)
+        deleted.delete()
+        with self.assertLogs('catalog.search_log', 'ERROR'):
+            self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(self.queries(), ['metal', 'grunge'])
+        self.assertEqual((buffer.stats()['flushed'], buffer.stats()['failed']), (2, 1))
+
+    def test_synchronous_write_error_is_logged(self):
+        deleted = User.objects.create_user('deleted')
+        deleted.delete()
+        with self.assertLogs('catalog.search_log', 'ERROR'):
+            search_log.record_search(deleted, 'metal')
+        search_log.record_search(self.user, 'punk')
+        self.assertEqual(self.queries(), ['punk'])
+
+
+@override_settings(CATALOG_SEARCH_LOG={'ENABLED': False})
+class SearchHistoryRetentionTests(TestCase):
+    """
+    Checks that repeated searches are collapsed into one record, and that expired records are archived and deleted.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('searcher', password='secret')
+        cls.other = User.objects.create_user('browser', password='secret')
+
+    def test_repeats_are_collapsed(self):
+        self.client.login(username='searcher', password='secret')
+        for query in ('metal', 'metal', 'punk', 'metal', 'metal'):
+            self.client.get(reverse('search_results'), {'q': query})
+        history = SearchHistory.objects.filter(user=self.user).order_by('timestamp', 'id')
+        self.assertEqual(list(history.values_list('query', 'count')), [('metal', 2), ('punk', 1), ('metal', 2)])
+
+        response = self.client.get(reverse('search_history'))
+        self.assertContains(response, '(2 times)', count=2)
+
+    def test_expired_records_are_archived(self):
+        now = timezone.now()
+        SearchHistory.objects.bulk_create(
+            [SearchHistory(user=self.user, query=f'query {age}', timestamp=now - timedelta(days=age))
+             for age in range(5)]
+            + [SearchHistory(user=self.other, query='ancient', timestamp=now - timedelta(days=400))]
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            call_command('archive_search_history', output_dir=directory, max_per_user=3, stdout=StringIO())
+            (archive,) = os.listdir(directory)
+            with gzip.open(os.path.join(directory, archive), 'rt') as lines:
+                archived = [json.loads(line)['query'] for line in lines]
+
+        self.assertEqual(sorted(archived), ['ancient', 'query 3', 'query 4'])
+        self.assertEqual(list(SearchHistory.objects.order_by('-timestamp').values_list('query', flat=True)),
+                         ['query 0', 'query 1', 'query 2'])
+
+
+class SearchHistoryExportTests(TestCase):
+    """
+    Checks the streamed search history downloads of a user and of the staff.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('searcher', password='secret')
+        cls.other = User.objects.create_user('browser', password='secret')
+        cls.staff = User.objects.create_user('analyst', password='secret', is_staff=True)
+        cls.start = timezone.now().replace(microsecond=123456) - timedelta(days=10)
+        SearchHistory.objects.bulk_create(
+            [SearchHistory(user=cls.user, query=f'query {day}', timestamp=cls.start + timedelta(days=day))
+             for day in range(5)]
+            + [SearchHistory(user=cls.other, query='other', timestamp=cls.start + timedelta(days=2, hours=1))]
+        )
+
+    def download(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_user_export(self):
+        url = reverse('search_history_export')
+        self.assertRedirects(self.client.get(url), reverse('login'), fetch_redirect_response=False)
+        self.client.force_login(self.user)
+
+        rows = list(csv.reader(self.download(url).splitlines()))
+        self.assertEqual(rows[0], ['timestamp', 'query', 'count'])
+        self.assertEqual([row[1] for row in rows[1:]], [f'query {day}' for day in reversed(range(5))])
+        self.assertEqual(rows[-1][0], self.start.isoformat())
+
+        records = [json.loads(line) for line in self.download(url, format='jsonl').splitlines()]
+        self.assertEqual(records[0], {'timestamp': (self.start + timedelta(days=4)).isoformat(), 'query': 'query 4',
+                                      'count': 1})
+        self.assertEqual(self.client.get(url, {'format': 'xml'}).status_code, 400)
+
+    def test_staff_export_filters(self):
+        url = reverse('search_history_export_all')
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.staff)
+
+        rows = list(csv.reader(self.download(url).splitlines()))
+        self.assertEqual(rows[0], ['id', 'user_id', 'query', 'count', 'timestamp'])
+        self.assertEqual(len(rows), 7)
+
+        since, until = self.start + timedelta(days=2), (self.start + timedelta(days=4)).date()
+        lines = self.download(url, format='jsonl', since=since.isoformat(), until=until.isoformat()).splitlines()
+        self.assertEqual([json.loads(line)['query'] for line in lines], ['query 2', 'other', 'query 3'])
+        lines = self.download(url, format='jsonl', user='browser').splitlines()
+        self.assertEqual([json.loads(line)['user_id'] for line in lines], [self.other.pk])
+
+        self.assertEqual(self.client.get(url, {'since': 'yesterday'}).status_code, 400)
+        # Beyond the last datetime once converted to UTC.
+        self.assertEqual(self.client.get(url, {'until': '9999-12-31T23:00:00-05:00'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'user': 'nobody'}).status_code, 404)
+
+    def test_csv_cells_are_not_formulas(self):
+        queries = ['=HYPERLINK("http://example.com")', '+1', '-2', '@SUM(A1)', "'quoted"]
+        SearchHistory.objects.bulk_create([SearchHistory(user=self.other, query=query) for query in queries])
+        url = reverse('search_history_export')
+        self.client.force_login(self.other)
+
+        rows = list(csv.reader(self.download(url).splitlines()))
+        self.assertCountEqual([row[1] for row in rows[1:]], ["'" + query for query in queries[:4]] + [
+            "'quoted", 'other',
+        ])
+        records = [json.loads(line) for line in self.download(url, format='jsonl').splitlines()]
+        self.assertCountEqual([record['query'] for record in records], queries + ['other'])
+
+    async def test_asgi_export_is_async(self):
+        request = AsyncRequestFactory().get(reverse('search_history_export'))
+        history = SearchHistory.objects.filter(user=self.user).order_by('-timestamp', '-id')
+        response = exports.streaming_export(request, history, ('query',), ('query',), 'history')
+        # Under ASGI the rows are read in the sync thread, batch by batch.
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(content.splitlines(), ['query'] + [f'query {day}' for day in reversed(range(5))])
+
+
+class DatabaseRoutingTests(SimpleTestCase):
+    """
+    Checks that catalog reads go to a replica unless the request wrote or was pinned to the primary.
+    """
+
+    def setUp(self):
+        self.router = routers.PrimaryReplicaRouter(replicas=['replica1'])
+
+    def route_in_request(self, pinned=False):
+        state = routers.RoutingState(pinned=pinned)
+        token = routers.activate(state)
+        self.addCleanup(routers.deactivate, token)
+        return state
+
+    def test_catalog_reads_use_replicas(self):
+        self.route_in_request()
+        self.assertEqual(self.router.db_for_read(Item), 'replica1')
+        self.assertEqual(self.router.db_for_read(Band), 'replica1')
+        for model in (Rating, SearchHistory, User):
+            self.assertEqual(self.router.db_for_read(model), 'default')
+        self.assertFalse(self.router.allow_migrate('replica1', 'catalog'))
+
+    def test_reads_stick_to_primary_after_write(self):
+        state = self.route_in_request()
+        self.assertEqual(self.router.db_for_write(Rating), 'default')
+        self.assertTrue(state.wrote)
+        self.assertEqual(self.router.db_for_read(Item), 'default')
+
+    def test_pinned_request(self):
+        self.route_in_request(pinned=True)
+        self.assertEqual(self.router.db_for_read(Item), 'default')
+
+    def test_outside_requests(self):
+        self.assertEqual(self.router.db_for_read(Item), 'default')
+        self.route_in_request()
+        self.assertEqual(routers.PrimaryReplicaRouter(replicas=[]).db_for_read(Item), 'default')
+
+
+@override_settings(
+    SESSION_ENGINE='catalog.sessions',
+    AUTHENTICATION_BACKENDS=['catalog.auth_backends.CachedModelBackend', 'django.contrib.auth.backends.ModelBackend'],
+)
+
+
+class SessionAndUserCacheTests(TestCase):
+    """
+    Checks that logged-in pages read the session and the user from the caches, and that the caches follow changes.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('regular', password='secret')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        # The first request writes the deferred login changes and caches the user.
+        self.client.get(reverse('category_list'))
+
+    def test_no_session_or_user_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('category_list'))
+        self.assertContains(response, 'regular')
+        tables = [query['sql'] for query in queries if 'django_session' in query['sql'] or 'auth_user' in query['sql']]
+        self.assertEqual(tables, [])
+
+    def test_changes_are_written_behind(self):
+        session = self.client.session
+        session['theme'] = 'dark'
+        session.save()
+        self.assertNotIn('theme', Session.objects.get(pk=session.session_key).get_decoded())
+        self.client.get(reverse('category_list'))
+        self.assertEqual(Session.objects.get(pk=session.session_key).get_decoded()['theme'], 'dark')
+
+        # Saving the same values again does not write.
+        saves = dict(sessions.write_counts)
+        session = self.client.session
+        session['theme'] = 'dark'
+        session.save()
+        self.assertEqual(sessions.write_counts['unchanged'], saves.get('unchanged', 0) + 1)
+
+    def test_password_change_invalidates_cached_user(self):
+        self.user.set_password('changed')
+        self.user.save()
+        response = self.client.get(reverse('search_history'))
+        self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+
+    def test_flushed_session_is_rejected_by_other_stores(self):
+        for write_behind in (True, False):
+            with self.subTest(write_behind=write_behind), \
+                    override_settings(CATALOG_SESSIONS={'WRITE_BEHIND': write_behind}):
+                first = sessions.SessionStore()
+                first['theme'] = 'dark'
+                first.create()
+                session_key = first.session_key
+                # A concurrent request holding the same session.
+                second = sessions.SessionStore(session_key)
+                self.assertEqual(second['theme'], 'dark')
+
+                first.flush()
+                self.assertEqual(sessions.SessionStore(session_key).load(), {})
+                # Its later save neither recreates the session in the database nor puts it back in the cache.
+                second['theme'] = 'light'
+                with self.assertRaises(UpdateError):
+                    second.save()
+                sessions.write_pending()
+                self.assertFalse(sessions.SessionStore().exists(session_key))
+                self.assertEqual(sessions.SessionStore(session_key).load(), {})
+
+
+@override_settings(CATALOG_SEARCH_LOG={'ENABLED': False})
+class CatalogDataTests(TestCase):
+    """
+    Checks that `catalog_data` exports import back into the same catalog, and that bad rows are reported.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_catalog', categories=2, bands=3, items=8, users=2, ratings=12, searches=0,
+            stdout=StringIO(), stderr=StringIO(),
+        )
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as output:
+            output.write(content)
+        return path
+
+    def run_command(self, *args):
+        stderr = StringIO()
+        call_command('catalog_data', *args, stdout=StringIO(), stderr=stderr)
+        return stderr.getvalue()
+
+    def snapshot(self):
+        return {
+            'categories': sorted(Category.objects.values_list('name', flat=True)),
+            'bands': sorted(Band.objects.values_list('name', 'genre')),
+            'items': list(Item.objects.order_by('pk').values_list(
+                'pk', 'name', 'description', 'price', 'category__name', 'band__name', 'is_featured', 'rating_count',
+                'rating_sum', 'rating_average',
+            )),
+            'ratings': sorted(Rating.objects.values_list('item_id', 'user__username', 'score')),
+        }
+
+    def test_round_trip(self):
+        before = self.snapshot()
+        path = os.path.join(self.directory, 'catalog.jsonl')
+        self.run_command('export', '--output', path)
+        Rating.objects.all().delete()
+        Item.objects.all().delete()
+        Band.objects.all().delete()
+        Category.objects.all().delete()
+
+        self.run_command('import', path, '--batch-size', '5')
+        self.assertEqual(self.snapshot(), before)
+        item = Item.objects.order_by('pk').first()
+        self.assertIn(item.pk, search.search_item_ids(item.name))
+
+    def test_items_without_ids_are_indexed(self):
+        band, category = Band.objects.first(), Category.objects.first()
+        path = self.write('items.csv', (
+            'id,name,description,price,category,band,image,is_featured\n'
+            f',Zyxwv Hoodie,Warm,40.00,{category.name},{band.name},,true\n'
+            f'abc,Broken Id,,10.00,{category.name},{band.name},,false\n'
+        ))
+        # Backends such as MySQL do not return the ids of bulk-inserted rows.
+        features = type(connection.features)
+        with mock.patch.object(features, 'can_return_rows_from_bulk_insert', False):
+            errors = self.run_command('import', path, '--format', 'csv', '--model', 'item')
+        self.assertIn("invalid id 'abc'", errors)
+        item = Item.objects.get(name='Zyxwv Hoodie')
+        self.assertEqual(search.search_item_ids('zyxwv'), [item.pk])
+
+    def test_escaped_csv_cells_are_restored(self):
+        band, category = Band.objects.first(), Category.objects.first()
+        path = self.write('items.csv', (
+            'id,name,description,price,category,band,image,is_featured\n'
+            f",'=Formula Shirt,'-- rare,40.00,{category.name},{band.name},,true\n"
+            f",Quoted Shirt,'plain,40.00,{category.name},{band.name},,true\n"
+        ))
+        self.run_command('import', path, '--format', 'csv', '--model', 'item')
+        self.assertEqual(Item.objects.get(name='=Formula Shirt').description, '-- rare')
+        self.assertEqual(Item.objects.get(name='Quoted Shirt').description, "'plain")
+
+    def test_empty_genre_keeps_stored_genre(self):
+        band = Band.objects.exclude(genre='').first()
+        path = self.write('bands.csv', f'name,genre\n{band.name},\nNew Band,\n')
+        self.run_command('import', path, '--format', 'csv', '--model', 'band')
+        band.refresh_from_db()
+        self.assertNotEqual(band.genre, '')
+        self.assertEqual(Band.objects.get(name='New Band').genre, '')
+
+    def test_invalid_ratings_are_reported(self):
+        item, user = Item.objects.first(), User.objects.filter(username__startswith='synthetic').first()
+        Rating.objects.filter(user=user, item=item).delete()
+        path = self.write('ratings.jsonl', ''.join(json.dumps(record) + '\n' for record in [
+            {'item_id': 'abc', 'user': user.username, 'score': 4},
+            {'item_id': item.pk, 'user': user.username, 'score': 4.5},
+            {'item_id': 2 ** 70, 'user': user.username, 'score': 4},
+            {'item_id': item.pk, 'user': user.username, 'score': '3'},
+        ]))
+        errors = self.run_command('import', path, '--model', 'rating')
+        self.assertEqual(errors.count('must be integers'), 3)
+        self.assertEqual(Rating.objects.get(user=user, item=item).score, 3)
+
+
+class BenchmarkTests(TestCase):
+    """
+    Checks that a benchmark run measures the routes without leaving its user or its writes behind.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_catalog', categories=1, bands=2, items=5, users=1, ratings=3, searches=0,
+            stdout=StringIO(), stderr=StringIO(),
+        )
+
+    def test_run_rolls_back(self):
+        counts = (User.objects.count(), Rating.objects.count(), SearchHistory.objects.count(), Session.objects.count())
+        result = benchmark.run(
+            iterations=2, warmup=1, only=['submit_rating', 'search_results_authenticated', 'request_stats'],
+        )
+        self.assertEqual({name: entry['status'] for name, entry in result['results'].items()}, {
+            'submit_rating': [200], 'search_results_authenticated': [200], 'request_stats': [200],
+        })
+        self.assertFalse(User.objects.filter(username=benchmark.BENCHMARK_USERNAME).exists())
+        self.assertEqual(
+            (User.objects.count(), Rating.objects.count(), SearchHistory.objects.count(), Session.objects.count()),
+            counts,
+        )
+
+
+@override_settings(CATALOG_SEARCH_LOG={'ENABLED': False})
+class FragmentCacheTests(TestCase):
+    """
+    Checks that listing cards are served from the fragment cache, and re-rendered when what they show changes.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_catalog', categories=1, bands=2, items=6, users=1, ratings=0, searches=0,
+            stdout=StringIO(), stderr=StringIO(),
+        )
+        cls.user = User.objects.filter(username__startswith='synthetic').first()
+        cls.item = Item.objects.order_by('pk').first()
+
+    def setUp(self):
+        cache.get_cache().clear()
+        fragments.stats.reset()
+        self.url = reverse('item_list', args=[self.item.category_id])
+
+    def card_stats(self):
+        return fragments.stats.snapshot()['catalog/cards/list_item.html']
+
+    def test_cards_are_cached(self):
+        first = self.client.get(self.url)
+        second = self.client.get(self.url)
+        self.assertEqual(first.content, second.content)
+        self.assertContains(second, self.item.name)
+        self.assertEqual((self.card_stats()['misses'], self.card_stats()['hits']), (6, 6))
+
+    def test_changes_rerender_cards(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            rate_items(self.user, {self.item.pk: 4})
+        response = self.client.get(self.url)
+        self.assertContains(response, '(1 rating)')
+        # Only the rated item's card was rendered again.
+        self.assertEqual(self.card_stats()['misses'], 7)
+
+        Item.objects.filter(pk=self.item.pk).update(name='Renamed Shirt')
+        cache.bump_model_version(Item)
+        self.assertContains(self.client.get(self.url), 'Renamed Shirt')
+
+
+class ItemAdminTests(TestCase):
+    """
+    Checks the item changelist's queries, its index-backed search and estimated count, and the bulk actions.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_catalog', categories=2, bands=2, items=6, users=0, ratings=0, searches=0,
+            stdout=StringIO(), stderr=StringIO(),
+        )
+        cls.admin = User.objects.create_superuser('merchandiser', password='secret')
+        cls.items = list(Item.objects.order_by('pk'))
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.client.force_login(self.admin)
+        self.url = reverse('admin:catalog_item_changelist')
+
+    def post_action(self, action, items, **data):
+        return self.client.post(
+            self.url, {'action': action, helpers.ACTION_CHECKBOX_NAME: [item.pk for item in items], **data}
+        )
+
+    def test_changelist_joins_categories_and_bands(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertContains(response, self.items[-1].band.name)
+        # The rows' categories and bands come with the item query, not from one query per row.
+        lookups = [
+            query['sql'] for query in queries if re.search(r'WHERE "catalog_(band|category)"\."id" =', query['sql'])
+        ]
+        self.assertEqual(lookups, [])
+
+    def test_search_uses_the_index(self):
+        band = self.items[0].band
+        response = self.client.get(self.url, {'q': band.name})
+        self.assertEqual(
+            {item.pk for item in response.context['cl'].result_list},
+            set(Item.objects.filter(band=band).values_list('pk', flat=True)),
+        )
+
+    def test_rating_aggregates_are_not_editable(self):
+        item = self.items[0]
+        url = reverse('admin:catalog_item_change', args=[item.pk])
+        form = self.client.get(url).context['adminform'].form
+        self.assertFalse({'rating_count', 'rating_sum', 'rating_average'} & set(form.fields))
+
+        data = {field: form.initial.get(field) or '' for field in form.fields}
+        data.update(is_featured='on' if item.is_featured else '', rating_count=50, rating_sum=250, rating_average=5)
+        self.assertRedirects(self.client.post(url, data), self.url, fetch_redirect_response=False)
+        self.assertEqual(Item.objects.values_list('rating_count', 'rating_sum', 'rating_average').get(pk=item.pk),
+                         (item.rating_count, item.rating_sum, item.rating_average))
+
+    def test_search_without_index_uses_search_fields(self):
+        band = self.items[0].band
+        for backend in SEARCH_BACKENDS:
+            with self.subTest(backend=backend), override_settings(CATALOG_SEARCH_BACKEND=backend):
+                search.get_backend().clear()
+                response = self.client.get(self.url, {'q': band.name})
+                self.assertEqual(
+                    {item.pk for item in response.context['cl'].result_list},
+                    set(Item.objects.filter(band=band).values_list('pk', flat=True)),
+                )
+
+    def test_broad_search_lists_every_match(self):
+        band = self.items[0].band
+        expected = set(Item.objects.filter(band=band).values_list('pk', flat=True))
+        self.assertGreater(len(expected), 1)
+        with mock.patch('catalog.admin.SEARCH_LIMIT', len(expected) - 1):
+            response = self.client.get(self.url, {'q': band.name})
+        self.assertEqual({item.pk for item in response.context['cl'].result_list}, expected)
+
+    @skipUnless(connection.vendor == 'sqlite', 'Reads the SQLite statistics.')
+    def test_estimated_count(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.assertEqual(estimated_row_count(Item, 'default'), len(self.items))
+        Item.objects.filter(pk=self.items[0].pk).delete()
+        paginator = EstimatedCountPaginator(Item.objects.order_by('pk'), 100)
+        paginator.estimate_threshold = 1
+        # The statistics are not updated until the next ANALYZE; filtered querysets are counted exactly.
+        self.assertEqual(paginator.count, len(self.items))
+        filtered = EstimatedCountPaginator(Item.objects.filter(is_featured__in=[True, False]).order_by('pk'), 100)
+        filtered.estimate_threshold = 1
+        self.assertEqual(filtered.count, len(self.items) - 1)
+
+    def test_feature_actions_run_one_update(self):
+        version = cache.model_versions((Item,))[0]
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            self.post_action('feature', self.items)
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "catalog_item"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(Item.objects.filter(is_featured=True).count(), len(self.items))
+        self.assertNotEqual(cache.model_versions((Item,))[0], version)
+
+        self.post_action('unfeature', self.items[:2])
+        self.assertEqual(Item.objects.filter(is_featured=False).count(), 2)
+
+    def test_change_price(self):
+        item = self.items[0]
+        Item.objects.filter(pk=item.pk).update(price=Decimal('19.99'))
+        Item.objects.filter(pk=self.items[1].pk).update(price=Decimal('9000.00'))
+        # The first post shows the intermediate form.
+        self.assertContains(self.post_action('change_price', self.items[:2], index=0), 'name="percentage"')
+        self.post_action('change_price', self.items[:2], percentage='12.5', apply='Apply', select_across='0')
+        self.assertEqual(Item.objects.get(pk=item.pk).price, Decimal('22.49'))
+        self.assertEqual(Item.objects.get(pk=self.items[1].pk).price, MAX_PRICE)
+
+    def test_change_category_reindexes(self):
+        category = Category.objects.exclude(pk=self.items[0].category_id).first()
+        moved = [item for item in self.items if item.category_id != category.pk]
+        self.post_action('change_category', moved, category=category.pk, apply='Apply', select_across='0')
+        self.assertEqual(Item.objects.filter(category=category).count(), len(self.items))
+        self.assertEqual(set(search.search_item_ids(category.name)), {item.pk for item in self.items})
+
+    def test_export_csv_streams(self):
+        response = self.post_action('export_csv', self.items[:1], index=0, select_across='1')
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], ['id', 'name', 'description', 'price', 'category', 'band', 'image', 'is_featured'])
+        self.assertEqual([int(row[0]) for row in rows[1:]], [item.pk for item in self.items])
+
+
+class StaticAssetTests(SimpleTestCase):
+    """
+    Checks that collectstatic writes hashed, pre-compressed files and that StaticAssetMiddleware serves the variant
+    each client accepts, with far-future caching for hashed names.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.root = tempfile.TemporaryDirectory()
+        cls.enterClassContext(override_settings(STATIC_ROOT=cls.root.name, CATALOG_SERVE_STATIC=True))
+        call_command('collectstatic', interactive=False, verbosity=0)
+        with open(os.path.join(cls.root.name, 'staticfiles.json'), encoding='utf-8') as manifest:
+            cls.paths = json.load(manifest)['paths']
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.root.cleanup()
+
+    def setUp(self):
+        # The middleware reads the settings when the client's handler loads it.
+        self.client = Client()
+
+    def test_compressed_variant(self):
+        url = f"/static/{self.paths['catalog/css/style.css']}"
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('Accept-Encoding', response['Vary'])
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_unhashed_name(self):
+        response = self.client.get('/static/catalog/css/style.css')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('immutable', response['Cache-Control'])
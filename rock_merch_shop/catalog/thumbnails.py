@@ -0,0 +1,181 @@
+"""
+Responsive image derivatives for Item.image.
+
+Every item image is resized with Pillow into a few presets (thumb, card and detail) and saved in WebP and PNG under
+MEDIA_ROOT/derived/. File names start with a hash of the source image's content, so a derivative never changes once
+written: it can be cached forever by browsers and is only generated again when the image itself changes. The hash of
+the current image and its width are stored on Item.image_hash and Item.image_width, which lets templates build srcset
+attributes without touching the disk. Images are never upscaled: the presets at least as wide as the original are
+generated once, by the narrowest of them, at the original width, and srcsets only list the widths generated.
+
+Derivatives are generated when an item image is uploaded (see catalog/signals.py) and in bulk, in parallel across a
+process pool, by `python manage.py generate_thumbnails`.
+"""
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+
+# Target width in pixels of each preset, smallest first. Images are never upscaled.
+PRESETS = {'thumb': 100, 'card': 350, 'detail': 800}
+
+# Output formats, in order of preference for the <picture> element.
+FORMATS = ('webp', 'png')
+
+# Directory, relative to MEDIA_ROOT and MEDIA_URL, holding the derivatives.
+DERIVED_DIR = 'derived'
+
+
+def content_hash(path):
+    """
+    Returns a short hash of a file's content, used to name its derivatives.
+
+    :param path: The filesystem path of the file.
+    :return: A 16 character hexadecimal digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def derivative_name(digest, preset, image_format):
+    """
+    Returns the media-relative name of a derivative.
+
+    :param digest: The content hash of the source image.
+    :param preset: The preset name, a key of PRESETS.
+    :param image_format: The file format, one of FORMATS.
+    :return: The name, e.g. 'derived/3f2a9c1d0b7e4a55-card.webp'.
+    """
+    return f'{DERIVED_DIR}/{digest}-{preset}.{image_format}'
+
+
+def generated_presets(original_width):
+    """
+    Returns the presets generated for an image, with the width of their derivatives.
+
+    :param original_width: The width of the source image in pixels, or None if unknown (every preset is listed).
+    :return: A dict mapping preset names to widths, smallest first.
+    """
+    if not original_width:
+        return dict(PRESETS)
+    presets = {}
+    for preset, width in PRESETS.items():
+        presets[preset] = min(width, original_width)
+        if width >= original_width:
+            break
+    return presets
+
+
+def display_preset(preset, original_width):
+    """
+    Returns the generated preset an image is shown at for a requested preset: the requested one, or the largest
+    generated one if the image is narrower than the requested width.
+    """
+    presets = generated_presets(original_width)
+    return preset if preset in presets else list(presets)[-1]
+
+
+def derivatives_exist(digest, original_width, media_root):
+    """
+    Returns whether every derivative of an image is on disk.
+
+    :param digest: The content hash of the source image.
+    :param original_width: The width of the source image in pixels.
+    :param media_root: The MEDIA_ROOT directory the derivatives are written under.
+    """
+    return all(
+        os.path.exists(os.path.join(media_root, derivative_name(digest, preset, image_format)))
+        for preset in generated_presets(original_width) for image_format in FORMATS
+    )
+
+
+def render_derivatives(source_path, media_root, force=False):
+    """
+    Generates every preset and format of one source image.
+
+    This function only uses Pillow and the filesystem so it can run in a worker process. Derivatives that already
+    exist are skipped unless 'force' is set.
+
+    :param source_path: The filesystem path of the source image.
+    :param media_root: The MEDIA_ROOT directory the derivatives are written under.
+    :param force: Regenerate derivatives even if they already exist.
+    :return: A (digest, width of the source image, number of files written) tuple.
+    """
+    from PIL import Image
+
+    digest = content_hash(source_path)
+    os.makedirs(os.path.join(media_root, DERIVED_DIR), exist_ok=True)
+
+    written = 0
+    # Opening an image only reads its header; it is decoded when a derivative has to be written.
+    with Image.open(source_path) as original:
+        image = None
+        for preset, width in generated_presets(original.width).items():
+            resized = None
+            for image_format in FORMATS:
+                target = os.path.join(media_root, derivative_name(digest, preset, image_format))
+                if not force and os.path.exists(target):
+                    continue
+                if image is None:
+                    original.load()
+                    # WebP and PNG both support transparency, so only palette and exotic modes need converting.
+                    image = original if original.mode in ('RGB', 'RGBA') else original.convert('RGBA')
+                if resized is None:
+                    resized = image.copy()
+                    resized.thumbnail((width, width * 4), Image.LANCZOS)
+                # Write to a temporary name first so a half-written file is never served.
+                temporary = f'{target}.{os.getpid()}.tmp'
+                if image_format == 'webp':
+                    resized.save(temporary, 'WEBP', quality=82, method=4)
+                else:
+                    resized.save(temporary, 'PNG', optimize=True)
+                os.replace(temporary, target)
+                written += 1
+        return digest, original.width, written
+
+
+def generate_for_paths(paths, workers=None, force=False):
+    """
+    Generates the derivatives of many images in parallel across a process pool.
+
+    :param paths: The filesystem paths of the source images.
+    :param workers: The number of worker processes (defaults to the number of CPUs).
+    :param force: Regenerate derivatives even if they already exist.
+    :return: A dict mapping each source path to its (digest, width, number of files written) tuple.
+    """
+    paths = list(paths)
+    media_root = str(settings.MEDIA_ROOT)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(render_derivatives, paths, [media_root] * len(paths), [force] * len(paths))
+        return dict(zip(paths, results))
+
+
+def srcset(digest, image_format, original_width=None):
+    """
+    Builds a srcset attribute value listing every generated preset of an image in one format.
+
+    :param digest: The content hash of the source image.
+    :param image_format: The file format, one of FORMATS.
+    :param original_width: The width of the source image in pixels, or None if unknown.
+    :return: The srcset string, e.g. '/media/derived/...-thumb.webp 100w, /media/derived/...-card.webp 350w, ...'.
+    """
+    return ', '.join(
+        f'{settings.MEDIA_URL}{derivative_name(digest, preset, image_format)} {width}w'
+        for preset, width in generated_presets(original_width).items()
+    )
+
+
+def derivative_url(digest, preset, image_format):
+    """
+    Returns the URL of one derivative.
+
+    :param digest: The content hash of the source image.
+    :param preset: The preset name, a key of PRESETS.
+    :param image_format: The file format, one of FORMATS.
+    :return: The URL of the derivative.
+    """
+    return f'{settings.MEDIA_URL}{derivative_name(digest, preset, image_format)}'
@@ -1,15 +1,31 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import api, async_views, views
 from .views import search_history, submit_rating, band_list
 
+# Under ASGI (the CATALOG_ASYNC_VIEWS setting), the read-heavy views and submit_rating are served natively async.
+read_views = async_views if settings.CATALOG_ASYNC_VIEWS else views
+rating_view = async_views.submit_rating if settings.CATALOG_ASYNC_VIEWS else submit_rating
+
 urlpatterns = [
-    path('', views.home, name='home'),  # Home page
+    path('', read_views.home, name='home'),  # Home page
     path('categories/', views.category_list, name='category_list'),  # List of categories
-    path('items/<int:category_id>/', views.item_list, name='item_list'),  # List of items in a category
-    path('item/<int:item_id>/', views.item_detail, name='item_detail'),  # Item detail page
-    path('search/', views.search_results, name='search_results'),  # Search results page
-    path('band/<int:band_id>/', views.band_detail, name='band_detail'),  # Band detail page
+    path('items/<int:category_id>/', read_views.item_list, name='item_list'),  # List of items in a category
+    path('item/<int:item_id>/', read_views.item_detail, name='item_detail'),  # Item detail page
+    path('search/', read_views.search_results, name='search_results'),  # Search results page
+    path('search/autocomplete/', views.autocomplete_suggestions, name='autocomplete'),  # Search suggestions (JSON)
+    path('band/<int:band_id>/', read_views.band_detail, name='band_detail'),  # Band detail page
     path('bands/', band_list, name='band_list'),  # List of bands
     path('search-history/', search_history, name='search_history'),  # Search history page
-    path('rate/', submit_rating, name='submit_rating'),  # Rating submission
+    path('search-history/export/', views.search_history_export, name='search_history_export'),  # Own history download
+    path('rate/', rating_view, name='submit_rating'),  # Rating submission
+    path('rate/batch/', views.submit_ratings, name='submit_ratings'),  # Batch rating submission (JSON)
+    path('stats/requests/', views.request_stats, name='request_stats'),  # Request instrumentation (staff only)
+    path('stats/searches/', views.search_stats, name='search_stats'),  # Search analytics (staff only)
+    path('stats/search-history/export/', views.search_history_export_all,
+         name='search_history_export_all'),  # Every user's search history download (staff only)
+    path('api/items/', api.item_list, name='api_item_list'),  # Item list (JSON)
+    path('api/items/<int:item_id>/', api.item_detail, name='api_item_detail'),  # Item detail (JSON)
+    path('api/bands/', api.band_list, name='api_band_list'),  # Band list (JSON)
+    path('api/categories/', api.category_list, name='api_category_list'),  # Category list (JSON)
 ]
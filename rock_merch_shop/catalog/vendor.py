@@ -0,0 +1,129 @@
+"""
+Self-hosted copies of the third-party front-end assets: Bootstrap, jQuery and the Google Fonts.
+
+`python manage.py vendor_assets` downloads the pinned versions listed in VENDOR_ASSETS into
+catalog/static/catalog/vendor/, checking the Subresource Integrity hash of those that have one, so collectstatic
+hashes and compresses them with the rest of the static files (see catalog/staticfiles.py). The Google Fonts
+stylesheet is downloaded with its font files, and its URLs are rewritten to the local copies.
+
+The {% vendor_asset %} template tag (catalog_assets library) links the self-hosted copy once it exists, and the CDN
+(with the integrity hash) until then.
+"""
+import base64
+import hashlib
+import os
+import re
+import urllib.request
+from functools import lru_cache
+
+from django.contrib.staticfiles import finders
+
+# Directory, relative to the static files, holding the vendored assets.
+VENDOR_DIR = 'catalog/vendor'
+
+VENDOR_ASSETS = {
+    'bootstrap.css': {
+        'url': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css',
+        'integrity': 'sha384-QWTKZyjpPEjISv5WaRU9OFeRpok6YctnYmDr5pNlyT2bRjXh0JMhjY6hW+ALEwIH',
+        'path': f'{VENDOR_DIR}/bootstrap-5.3.3/bootstrap.min.css',
+    },
+    'bootstrap.js': {
+        'url': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js',
+        'integrity': 'sha384-YvpcrYf0tY3lHB60NNkmXc5s9fDVZLESaAA55NDzOxhy9GkcIdslK1eN7N6jIeHz',
+        'path': f'{VENDOR_DIR}/bootstrap-5.3.3/bootstrap.bundle.min.js',
+    },
+    'jquery.js': {
+        'url': 'https://code.jquery.com/jquery-3.7.1.min.js',
+        'integrity': 'sha256-/JqT3SQfawRcv/BIHPThkBvs0OEvtFFmqPF/lYI/Cxo=',
+        'path': f'{VENDOR_DIR}/jquery-3.7.1/jquery.min.js',
+    },
+    'fonts.css': {
+        'url': 'https://fonts.googleapis.com/css2?family=Metal+Mania&family=RocknRoll+One&display=swap',
+        # Google Fonts tailors the stylesheet to the browser, so it has no fixed hash.
+        'integrity': None,
+        'path': f'{VENDOR_DIR}/fonts/fonts.css',
+    },
+}
+
+# Google Fonts only serves WOFF2 files to browsers it recognizes.
+USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36'
+
+FONT_URL_RE = re.compile(r'url\((https://fonts\.gstatic\.com/[^)]+)\)')
+
+# The source maps are not vendored, and collectstatic fails on references to missing files.
+SOURCE_MAP_RE = re.compile(rb'\n?/[*/]# sourceMappingURL=[^\n]*?(?:\*/)?(?=\n|$)')
+
+# The app's static directory, which the vendored files are written to.
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+
+def fetch(url):
+    """
+    Downloads a URL.
+
+    :param url: The URL.
+    :return: The response body as bytes.
+    """
+    request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return response.read()
+
+
+def check_integrity(data, integrity):
+    """
+    Checks downloaded content against a Subresource Integrity value such as 'sha384-...'.
+
+    :raises ValueError: If the content does not match.
+    """
+    algorithm, expected = integrity.split('-', 1)
+    actual = base64.b64encode(hashlib.new(algorithm, data).digest()).decode()
+    if actual != expected:
+        raise ValueError(f'Integrity check failed: expected {integrity}, got {algorithm}-{actual}.')
+
+
+def write(path, data):
+    target = os.path.join(STATIC_DIR, path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as output:
+        output.write(data)
+    return target
+
+
+def vendor_asset(name):
+    """
+    Downloads one asset of VENDOR_ASSETS (and, for a font stylesheet, its fonts) into the app's static directory.
+
+    :param name: The asset name, a key of VENDOR_ASSETS.
+    :return: The filesystem paths written.
+    :raises ValueError: If the download does not match its integrity hash.
+    :raises OSError: If the download fails.
+    """
+    asset = VENDOR_ASSETS[name]
+    data = fetch(asset['url'])
+    if asset['integrity']:
+        check_integrity(data, asset['integrity'])
+    data = SOURCE_MAP_RE.sub(b'', data)
+
+    written = []
+    if asset['path'].endswith('.css'):
+        stylesheet = data.decode('utf-8')
+        directory = os.path.dirname(asset['path'])
+        for url in sorted(set(FONT_URL_RE.findall(stylesheet))):
+            # Font URLs end with a content-specific file name, so the same name is never reused for other content.
+            filename = '-'.join(url.split('/')[-2:])
+            written.append(write(f'{directory}/files/{filename}', fetch(url)))
+            stylesheet = stylesheet.replace(url, f'files/{filename}')
+        data = stylesheet.encode('utf-8')
+    written.append(write(asset['path'], data))
+    is_vendored.cache_clear()
+    return written
+
+
+@lru_cache(maxsize=None)
+def is_vendored(name):
+    """
+    Tells whether the self-hosted copy of an asset exists among the static files.
+
+    :param name: The asset name, a key of VENDOR_ASSETS.
+    """
+    return finders.find(VENDOR_ASSETS[name]['path']) is not None
@@ -1,23 +1,44 @@
-from django.db.models import Q
+import json
+from datetime import datetime, time, timezone as dt_timezone
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth.models import User
 from django.shortcuts import render
 from django.shortcuts import get_object_or_404
 
-from .models import Category, Item, Band, Rating
+from .models import Category, Item, ItemRecommendation, Band, Rating
 from .models import SearchHistory
+from . import auth_backends, autocomplete, exports, facets, fragments, instrumentation, search_analytics, sessions
+from .cache import cache_page_for_anonymous, page_cache_context
+from .conditional import conditional_page
+from .pagination import MAX_INTEGER, InvalidCursor, get_page_size, paginate_request
+from .ratings import rate_item, rate_items
+from .search import paginate_search
+from .search_log import get_buffer, record_search
+from .search_retention import ARCHIVE_FIELDS
 
 from django.http import JsonResponse
+from django.utils.cache import patch_cache_control
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 
+from django.http import Http404
 from django.http import HttpResponseBadRequest
 from django.http import HttpResponseRedirect
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
 # Home View
+@conditional_page('home')
+@cache_page_for_anonymous('home')
 def home(request):
     """
     View function for home page of site.
 
     Retrieves the featured items, all categories, and all bands to display on the home page.
+    The page is cached (see catalog/cache.py); the querysets are lazy, so they only run when the cache misses.
 
     :param request: The incoming HTTP request
     :return: Rendered home page with context data
@@ -34,7 +55,8 @@ def home(request):
     context = {
         'featured_items': featured_items,
         'categories': categories,
-        'bands': bands
+        'bands': bands,
+        **page_cache_context('home'),
     }
 
     # Render and return the home page with context.
@@ -42,9 +64,11 @@ def home(request):
 
 
 # Category List View
+@conditional_page('category_list')
+@cache_page_for_anonymous('category_list')
 def category_list(request):
     """
-    View function for listing all categories in the site.
+    View function for listing all categories in the site. The page is cached (see catalog/cache.py).
 
     :param request: The incoming HTTP request.
     :return: Rendered category list page with context data containing all categories.
@@ -53,38 +77,107 @@ def category_list(request):
     categories = Category.objects.all()
 
     # Context dictionary to be filled with category data for the template.
-    context = {'categories': categories}
+    context = {'categories': categories, **page_cache_context('category_list')}
 
     # Render and return the category list page with context data.
     return render(request, 'catalog/category_list.html', context)
 
 
+# Orderings available to the item list through the 'sort' GET parameter. They only use stored columns, so sorting by
+# rating never aggregates the Rating table. The primary key is the final tie-breaker to keep the order stable.
+ITEM_SORTS = {
+    'default': ('id',),
+    'rating': ('-rating_average', '-rating_count', 'id'),
+    'popular': ('-rating_count', '-rating_average', 'id'),
+}
+
+
+def item_list_query(request, category_id=None):
+    """
+    Builds the item list queryset from the request's 'sort' GET parameter and its facet filters ('band', 'genre',
+    'price' and 'min_rating', see catalog/facets.py).
+
+    :param request: The incoming HTTP request.
+    :param category_id: The ID of the category to filter items by, defaults to None.
+    :return: A (queryset, sort, filters) tuple; sort is a key of ITEM_SORTS and filters a facets.FacetFilters.
+    """
+    # Check if a category ID is provided and filter items by category, otherwise retrieve all items.
+    items = Item.objects.filter(category=category_id) if category_id else Item.objects.all()
+
+    # Apply the requested ordering, falling back to the default for unknown values.
+    sort = request.GET.get('sort', 'default')
+    if sort not in ITEM_SORTS:
+        sort = 'default'
+
+    # Narrow the items by band, genre, price range and average rating, ignoring values that are not valid. The
+    # (category, rating_average) range of the rating index serves 'min_rating'; with another ordering than 'rating',
+    # the database sorts the items found in it.
+    filters = facets.parse_filters(request.GET)
+    items = items.filter(filters.q())
+    return items, sort, filters
+
+
+def item_list_context(page, sort, filters, facet_counts):
+    """
+    Returns the template context of the item list page.
+
+    :param page: The KeysetPage of items.
+    :param sort: The applied sort, a key of ITEM_SORTS.
+    :param filters: The applied facets.FacetFilters.
+    :param facet_counts: The facet counts, as returned by facets.facet_counts.
+    :return: A dict.
+    """
+    return {
+        'items': page.object_list,
+        'page': page,
+        'sort': sort,
+        'min_rating': filters.min_rating,
+        'facets': facet_counts,
+        'filter_query': urlencode(filters.query_params()),
+    }
+
+
 # Item List View
 def item_list(request, category_id=None):
     """
     View function for listing all items or items within a specific category.
 
+    The list can be sorted with the 'sort' GET parameter (see ITEM_SORTS) and narrowed by band, genre, price range
+    and minimum average rating (see catalog/facets.py); every facet option is shown with its number of items.
+    Results are paginated by keyset with the 'cursor' and 'page_size' GET parameters.
+
     :param request: The incoming HTTP request.
     :param category_id: The ID of the category to filter items by, defaults to None.
     :return: Rendered item list page with context data containing items, optionally filtered by category.
     """
-    # Check if a category ID is provided and filter items by category, otherwise retrieve all items.
-    items = Item.objects.filter(category=category_id) if category_id else Item.objects.all()
+    # Filter and sort the items as requested.
+    items, sort, filters = item_list_query(request, category_id)
+
+    # Fetch one page of items by keyset on the chosen ordering.
+    try:
+        page = paginate_request(request, items, ITEM_SORTS[sort])
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor.")
+
+    # Count the items behind every facet option.
+    facet_counts = facets.facet_counts(category_id, filters)
 
     # Context dictionary to be filled with item data for the template.
-    context = {'items': items}
+    context = item_list_context(page, sort, filters, facet_counts)
 
     # Render and return the item list page with the context.
     return render(request, 'catalog/item_list.html', context)
 
 
 # Item Detail View
+@conditional_page('item_detail', item_kwarg='item_id')
 def item_detail(request, item_id):
     """
     View function for displaying the detail of a single item.
 
     If the user is authenticated, it also checks if the user has already rated the item
     and passes that rating to the template for displaying the user's previous rating.
+    The item's precomputed recommendations (see catalog/recommendations.py) are read with one indexed query.
 
     :param request: The HttpRequest object for the current request.
     :param item_id: The ID of the item to display.
@@ -103,70 +196,112 @@ def item_detail(request, item_id):
             # If the rating exists, retrieve the score for the user's rating.
             user_rating = user_rating_query.first().score
 
+    # Read the "fans who rated this also liked" items, best first, with their bands.
+    recommendations = recommended_items(item_id)
+
     # Compile the context with the item, a range for stars (for rating display), and the user's rating (if any).
     context = {
         'item': item,
         'stars_range': range(1, 6), # Provides a range from 1 to 5 for displaying rating stars.
-        'user_rating': user_rating  # The user's previous rating, if it exists.
+        'user_rating': user_rating,  # The user's previous rating, if it exists.
+        'recommendations': recommendations,  # The recommended items.
     }
 
     # Render the 'item_detail.html' template with the provided context.
     return render(request, 'catalog/item_detail.html', context)
 
 
+def recommended_items(item_id):
+    """
+    Returns the query of an item's recommended items, best first, with their bands.
+
+    :param item_id: The ID of the item.
+    :return: An ItemRecommendation queryset, served by the (item, rank) unique index.
+    """
+    return ItemRecommendation.objects.filter(item_id=item_id).select_related('recommended__band').order_by('rank')
+
+
 # Search Results View
 def search_results(request):
     """
     View function for displaying the search results based on a user's query.
 
-    This function retrieves items that match the search query across multiple fields (name, category, band).
-    If the user is authenticated, their search is logged for future reference.
+    This function looks the query up in the catalog search index, which covers the item name, the category name and
+    the band name, and returns one page of the matching items ranked by relevance.
+    If the user is authenticated, their search is logged for future reference (once, on the first page).
 
     :param request: The HttpRequest object containing the search query.
     :return: HttpResponse object with the rendered search results page.
     """
     # Extract query from GET parameters, defaulting to an empty string if not provided.
     query = request.GET.get('q', '')
+    cursor = request.GET.get('cursor')
+    page = None
 
     if query:
-        # Perform a case-insensitive search across name, category name, and band name.
-        # Used 'distinct()' to avoid duplicate items in results.
-        items = Item.objects.filter(
-            Q(name__icontains=query) |
-            Q(category__name__icontains=query) |
-            Q(band__name__icontains=query)
-        ).distinct()
+        # Rank one page of matching item ids through the search index instead of scanning the Item table.
+        try:
+            page = paginate_search(query, cursor, get_page_size(request), request.GET)
+        except InvalidCursor:
+            return HttpResponseBadRequest("Invalid cursor.")
+        ranked_ids = [item_id for item_id, _score in page.object_list]
+        # Fetch the matching items (with their category and band) in one query and keep the relevance order.
+        items_by_id = Item.objects.select_related('category', 'band').in_bulk(ranked_ids)
+        items = [items_by_id[item_id] for item_id in ranked_ids if item_id in items_by_id]
 
         # For authenticated users, log the search query for analytics or personalized features.
-        if request.user.is_authenticated:
-            log_search_history(request.user, query)
+        if request.user.is_authenticated and not cursor:
+            log_search_history(request.user, query, len(page.object_list))
     else:
         # If no query is provided, return an empty QuerySet.
         items = Item.objects.none()
 
     # Compile the context with the items found and the original query string.
-    context = {'items': items, 'query': query}
+    context = {'items': items, 'page': page, 'query': query}
 
     # Render the 'search_results.html' template with the context.
     return render(request, 'catalog/search_results.html', context)
 
 
-def log_search_history(user, query):
+# Autocomplete View
+def autocomplete_suggestions(request):
+    """
+    View function returning search-as-you-type suggestions for the navbar search box as JSON.
+
+    Items, bands and categories whose names have words starting with every word of ?q= are looked up in the
+    in-process prefix index (see catalog/autocomplete.py), ranked by popularity, without querying the database.
+
+    :param request: The HttpRequest object containing the partial query and an optional `limit`.
+    :return: JsonResponse with the query and the list of suggestions, each with its type, id, label, detail and url.
+    """
+    # Read the partial query and the number of suggestions wanted
+    query = request.GET.get('q', '')
+    options = autocomplete.get_options()
+    try:
+        limit = min(int(request.GET.get('limit', options['LIMIT'])), options['MAX_LIMIT'])
+    except ValueError:
+        return HttpResponseBadRequest("Invalid limit.")
+
+    # Look the query up in the prefix index
+    response = JsonResponse({'query': query, 'results': autocomplete.suggest(query, limit)})
+
+    # The suggestions are the same for every user, so browsers and shared caches may reuse them for a minute
+    patch_cache_control(response, public=True, max_age=60)
+    return response
+
+
+def log_search_history(user, query, results=0):
     """
     Logs the search query made by a user.
 
-    Attempts to create a new SearchHistory object with the user and their search query.
-    In case of any exception (e.g., database issues), the error is silently ignored.
+    The search is added to the in-process search history buffer, which writes it together with other searches in a
+    single bulk insert off the request path, and counts it in the search rollups (see catalog/search_log.py).
 
     :param user: The User object representing the currently logged-in user.
     :param query: The search query string input by the user.
+    :param results: The number of results shown on the first page.
     """
-    try:
-        # Attempt to create and save a new search history record.
-        SearchHistory.objects.create(user=user, query=query)
-    except Exception as e:
-        # Log the exception to the server's log.
-        print(f"Error logging search history for user {user.username}: {str(e)}")
+    record_search(user, query, results)
 
 
 def search_history(request):
@@ -182,21 +317,56 @@ def search_history(request):
         # Redirect unauthenticated users to the login page
         return HttpResponseRedirect(reverse('login'))
 
-    # Retrieve search history for the current user, ordered by the timestamp in descending order.
-    user_search_history = SearchHistory.objects.filter(user=request.user).order_by('-timestamp')
+    # Retrieve one page of the current user's search history, newest first (the id breaks timestamp ties).
+    try:
+        page = paginate_request(request, SearchHistory.objects.filter(user=request.user), ('-timestamp', '-id'))
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor.")
 
     # Prepare the context with the search history data.
     context = {
-        'search_history': user_search_history
+        'search_history': page.object_list,
+        'page': page,
     }
 
     # Render the 'search_history.html' template with the context.
     return render(request, 'catalog/search_history.html', context)
 
+
+# Fields of a user's own search history download.
+USER_EXPORT_FIELDS = ('timestamp', 'query', 'count')
+
+
+def search_history_export(request):
+    """
+    View function streaming the authenticated user's whole search history as a CSV or JSON Lines download.
+
+    ?format=csv (the default) or ?format=jsonl selects the format. Records are listed newest first, as on the search
+    history page, and read from the database in chunks (see catalog/exports.py).
+
+    :param request: HttpRequest object.
+    :return: StreamingHttpResponse with the download, or a redirection to the login page.
+    """
+    if not request.user.is_authenticated:
+        # Redirect unauthenticated users to the login page
+        return HttpResponseRedirect(reverse('login'))
+
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in exports.FORMATS:
+        return HttpResponseBadRequest("Invalid format.")
+
+    # Stream the user's history through the (user, -timestamp, -id) index.
+    history = SearchHistory.objects.filter(user=request.user).order_by('-timestamp', '-id')
+    return exports.streaming_export(
+        request, history, USER_EXPORT_FIELDS, USER_EXPORT_FIELDS, 'search-history', export_format
+    )
+
 # Band List View
+@conditional_page('band_list')
+@cache_page_for_anonymous('band_list')
 def band_list(request):
     """
-     View function for listing all bands available in the database.
+     View function for listing all bands available in the database. The page is cached (see catalog/cache.py).
 
     :param request: HttpRequest object.
     :return: HttpResponse object with the rendered band list page.
@@ -205,16 +375,17 @@ def band_list(request):
     bands = Band.objects.all()
 
     # Render the 'band_list.html' template with the context containing all bands.
-    return render(request, 'catalog/band_list.html', {'bands': bands})
+    return render(request, 'catalog/band_list.html', {'bands': bands, **page_cache_context('band_list')})
 
 # Band Detail View
+@conditional_page('band_detail')
 def band_detail(request, band_id):
     """
     View function for displaying details about a specific band, including a list of items associated with the band.
 
     Retrieves the Band object based on the provided band_id. If no Band object is found, a 404 error is raised. Then,
-    retrieves all Item objects associated with the band and passes them to the 'band_detail.html' template for
-    rendering.
+    retrieves one keyset-paginated page of the Item objects associated with the band and passes them to the
+    'band_detail.html' template for rendering.
 
     :param request: HttpRequest object.
     :param band_id: The primary key (ID) of the Band object to be detailed.
@@ -224,11 +395,47 @@ def band_detail(request, band_id):
     # Retrieve the band by ID or return a 404 error if not found.
     band = get_object_or_404(Band, id=band_id)
 
-    # Retrieve all items associated with the band.
-    items = Item.objects.filter(band=band)
+    # Retrieve one page of the items associated with the band.
+    try:
+        page = paginate_request(request, Item.objects.filter(band=band), ('id',))
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor.")
 
     # Render the 'band_detail.html' template with the band and items context.
-    return render(request, 'catalog/band_detail.html', {'band': band, 'items': items})
+    return render(request, 'catalog/band_detail.html', {'band': band, 'items': page.object_list, 'page': page})
+
+
+def parse_integer(value):
+    """
+    Returns a submitted integer: an int (not a bool), or a string of ASCII digits.
+
+    :param value: The submitted value (a form field string, or any JSON value).
+    :return: The integer, or None if the value is not one (e.g. 4.9, true, [1] or '²').
+    """
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        value = value.strip()
+        if value.isascii() and value.isdigit():
+            return int(value)
+    return None
+
+
+def parse_rating(item_id, score):
+    """
+    Validates one submitted rating.
+
+    :param item_id: The submitted item id (string or integer).
+    :param score: The submitted score (string or integer).
+    :return: An (item_id, score, error) tuple; error is None when both values are valid, and the values are returned as
+             submitted when they are not integers.
+    """
+    parsed_item_id, parsed_score = parse_integer(item_id), parse_integer(score)
+    if parsed_item_id is None or parsed_score is None or not 1 <= parsed_item_id <= MAX_INTEGER:
+        return item_id, score, "item_id and score must be integers."
+    if not 1 <= parsed_score <= 5:
+        return parsed_item_id, parsed_score, "Score must be between 1 and 5."
+    return parsed_item_id, parsed_score, None
 
 
 @login_required
@@ -238,7 +445,8 @@ def submit_rating(request):
 
      Only POST requests are accepted. The function expects 'item_id' and 'score' in the POST data. If either is missing,
      or the request method is not POST, it returns a bad request response. This function is decorated with
-     @login_required, ensuring that only authenticated users can submit ratings.
+     @login_required, ensuring that only authenticated users can submit ratings. The rating is written through the
+     same single-statement upsert path as the batch endpoint (see submit_ratings).
 
     :param request: HttpRequest object, contains 'item_id' and 'score' in POST data.
     :return: JsonResponse indicating the success or failure of the rating submission.
@@ -257,25 +465,206 @@ def submit_rating(request):
         # Return a bad request response if either item_id or score is missing
         return HttpResponseBadRequest("Missing item_id or score in POST data.")
 
-    # Attempt to retrieve the item; if not found, respond with error
-    try:
-        item = get_object_or_404(Item, pk=item_id)
-    except Item.DoesNotExist:
-        # Return a JSON response with an error message if the item does not exist
-        return JsonResponse({'success': False, 'error': "Item does not exist."})
-
-    print(f"Rating Item: {item} with Score: {score} by User: {user.username}")  # Debug print
+    # Ensure both values are integers and the score is a whole number of stars between 1 and 5
+    item_id, score, error = parse_rating(item_id, score)
+    if error:
+        return HttpResponseBadRequest(error)
 
     # Attempt to create or update the rating
     try:
-        # Get or create the rating for the user-item pair
-        rating, created = Rating.objects.get_or_create(user=user, item=item, defaults={'score': score})
-        if not created:
-            # Update the score if the rating already exists
-            rating.score = score
-            rating.save()
-        # Return a success response with the score and item_id
-        return JsonResponse({'success': True, 'score': score, 'item_id': item_id})
+        # Upsert the rating and update the item's rating aggregates in one transaction
+        outcome = rate_item(user, item_id, score)
     except Exception as e:
         # Return an error response if an exception occurs
         return JsonResponse({'success': False, 'error': str(e)})
+
+    if outcome == 'missing':
+        # Respond with a 404 error if the item does not exist
+        raise Http404("Item does not exist.")
+
+    # Return a success response with the score and item_id
+    return JsonResponse({'success': True, 'score': score, 'item_id': item_id})
+
+
+@login_required
+def submit_ratings(request):
+    """
+    Submits many ratings by the logged-in user in one request.
+
+    Expects a JSON body of the form {"ratings": [{"item_id": 1, "score": 5}, ...]}. Every entry is validated first,
+    the existence of all items is checked with one query, and the valid ratings are written in one transaction with a
+    single upsert statement (see catalog.ratings.rate_items). When an item appears more than once, the last entry wins.
+
+    :param request: HttpRequest object with the JSON body.
+    :return: JsonResponse with one result per submitted item, in submission order.
+    """
+    # Only accept POST requests
+    if request.method != 'POST':
+        return HttpResponseBadRequest("Invalid request method.")
+
+    # Parse the JSON body
+    try:
+        entries = json.loads(request.body)['ratings']
+    except (ValueError, KeyError, TypeError):
+        return HttpResponseBadRequest('Expected a JSON body of the form {"ratings": [{"item_id": ..., "score": ...}]}.')
+    if not isinstance(entries, list):
+        return HttpResponseBadRequest('"ratings" must be a list.')
+    max_batch = getattr(settings, 'CATALOG_MAX_RATING_BATCH', 100)
+    if len(entries) > max_batch:
+        return HttpResponseBadRequest(f"At most {max_batch} ratings can be submitted at once.")
+
+    # Validate every entry before touching the database. Results are keyed by item id, or by entry index for the
+    # entries whose item id is not an integer (it may be any JSON value, e.g. a list).
+    results = {}
+    scores = {}
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            return HttpResponseBadRequest("Each rating must be an object with item_id and score.")
+        item_id, score, error = parse_rating(entry.get('item_id'), entry.get('score'))
+        key = item_id if isinstance(item_id, int) and not isinstance(item_id, bool) else ('entry', index)
+        if error:
+            results[key] = {'item_id': item_id, 'success': False, 'error': error}
+            scores.pop(key, None)
+        else:
+            results[key] = None
+            scores[key] = score
+
+    # Upsert all valid ratings in one transaction; database errors propagate as a server error
+    outcomes = rate_items(request.user, scores)
+
+    for item_id, outcome in outcomes.items():
+        if outcome == 'missing':
+            results[item_id] = {'item_id': item_id, 'success': False, 'error': "Item does not exist."}
+        else:
+            results[item_id] = {'item_id': item_id, 'success': True, 'score': scores[item_id], 'status': outcome}
+
+    return JsonResponse({'success': all(result['success'] for result in results.values()),
+                         'results': list(results.values())})
+
+
+@staff_member_required
+def request_stats(request):
+    """
+    View function returning the request instrumentation statistics as JSON (staff only).
+
+    Shows, per URL name, the latency, SQL time, render time and query count histograms and the repeated query
+    patterns recorded by RequestInstrumentationMiddleware, along with the search history buffer counters, the size and
+    memory use of the autocomplete index, the hit rates of the session and user caches, and the hits and render time
+    saved of each cached card template.
+    Pass ?reset=1 to clear the statistics after reading them.
+
+    :param request: The incoming HTTP request
+    :return: JsonResponse with the statistics of this process
+    """
+    # Read the aggregates of this process
+    index = autocomplete.loaded_index()
+    stats = {
+        'options': instrumentation.get_options(),
+        'views': instrumentation.store.snapshot(),
+        'search_history_buffer': get_buffer().stats(),
+        'autocomplete_index': index.stats() if index else None,
+        'sessions': sessions.stats(),
+        'user_cache': auth_backends.cache_counter.snapshot(),
+        'fragments': fragments.stats.snapshot(),
+    }
+
+    # Start a new measurement window if asked to
+    if request.GET.get('reset'):
+        instrumentation.store.reset()
+        fragments.stats.reset()
+
+    return JsonResponse(stats)
+
+
+@staff_member_required
+def search_stats(request):
+    """
+    View function returning the shop-wide search analytics as JSON (staff only).
+
+    Shows the trending queries of the last ?hours= hours (24 by default) compared with the hours before, and the
+    queries that most often found nothing during the last ?days= days (7 by default), read from the hourly and daily
+    search rollups (see catalog/search_analytics.py). ?limit= sets the number of queries of each report.
+
+    :param request: The incoming HTTP request
+    :return: JsonResponse with the trending and zero-result reports
+    """
+    # Read the report windows
+    try:
+        hours = max(1, min(int(request.GET.get('hours', 24)), 24 * 7))
+        days = max(1, min(int(request.GET.get('days', 7)), 365))
+        limit = max(1, min(int(request.GET.get('limit', search_analytics.get_options()['REPORT_LIMIT'])), 100))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid hours, days or limit.")
+
+    # Aggregate the rollup buckets of each window
+    return JsonResponse({
+        'hours': hours,
+        'days': days,
+        'trending': search_analytics.trending(hours, limit),
+        'zero_results': search_analytics.zero_results(days, limit),
+    })
+
+
+def parse_moment(value):
+    """
+    Parses an ISO 8601 date or date and time; dates stand for their midnight, naive values for the current time zone.
+
+    :param value: The raw value.
+    :return: An aware datetime.
+    :raises ValueError: If the value is neither a date nor a date and time, or is out of the range of datetime in UTC
+                        (e.g. 9999-12-31T23:00:00-05:00), where the database compares it.
+    """
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'Invalid date: {value!r}')
+        moment = datetime.combine(day, time.min)
+    try:
+        moment = timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+        moment.astimezone(dt_timezone.utc)
+    except OverflowError:
+        raise ValueError(f'Date out of range: {value!r}')
+    return moment
+
+
+@staff_member_required
+def search_history_export_all(request):
+    """
+    View function streaming the search history of every user as a CSV or JSON Lines download (staff only).
+
+    ?format=csv (the default) or ?format=jsonl selects the format. ?since= (inclusive) and ?until= (exclusive) take
+    ISO 8601 dates or dates and times and select a time range, read through the (timestamp, id) index; ?user= takes a
+    username and reads that user's records through the (user, -timestamp, -id) index. Records are listed oldest
+    first, with the fields of the search history archives (see catalog/search_retention.py).
+
+    :param request: The incoming HTTP request
+    :return: StreamingHttpResponse with the download
+    """
+    # Read the filters
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in exports.FORMATS:
+        return HttpResponseBadRequest("Invalid format.")
+    try:
+        since = parse_moment(request.GET['since']) if request.GET.get('since') else None
+        until = parse_moment(request.GET['until']) if request.GET.get('until') else None
+    except ValueError:
+        return HttpResponseBadRequest("Invalid since or until.")
+
+    history = SearchHistory.objects.order_by('timestamp', 'id')
+    if since:
+        history = history.filter(timestamp__gte=since)
+    if until:
+        history = history.filter(timestamp__lt=until)
+    if request.GET.get('user'):
+        # Resolve the username first, so the history is filtered on the indexed user column without a join.
+        user_id = User.objects.filter(username=request.GET['user']).values_list('pk', flat=True).first()
+        if user_id is None:
+            raise Http404("No such user.")
+        history = history.filter(user_id=user_id)
+
+    # Stream the records in chunks
+    filename = '-'.join(
+        ['search-history'] + [f'{moment:%Y%m%dT%H%M%S}' for moment in (since, until) if moment is not None]
+    )
+    return exports.streaming_export(request, history, ARCHIVE_FIELDS, ARCHIVE_FIELDS, filename, export_format)
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rock_merch_shop.settings')
+# The native async catalog views (see catalog/async_views.py) are opt-in with CATALOG_ASYNC_VIEWS=true: with Django
+# 5.0's async ORM they serve fewer requests per second than the synchronous ones (see `manage.py compare_interfaces`).
 
 application = get_asgi_application()
@@ -48,6 +48,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'catalog.middleware.StaticAssetMiddleware',
+    'catalog.middleware.RequestInstrumentationMiddleware',
+    'catalog.middleware.PrimaryPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -58,12 +61,21 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'rock_merch_shop.urls'
 
+# Templates are compiled once per process by the cached loader (runserver's autoreloader still resets it when a
+# template changes).
+TEMPLATE_LOADERS = [
+    ('django.template.loaders.cached.Loader', [
+        'django.template.loaders.filesystem.Loader',
+        'django.template.loaders.app_directories.Loader',
+    ]),
+]
+
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'catalog.instrumentation.InstrumentedDjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
+            'loaders': TEMPLATE_LOADERS,
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -80,13 +92,113 @@ WSGI_APPLICATION = 'rock_merch_shop.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# The primary database is configured from DATABASE_ENGINE (default SQLite), DATABASE_NAME, DATABASE_USER,
+# DATABASE_PASSWORD, DATABASE_HOST and DATABASE_PORT, e.g. DATABASE_ENGINE=django.db.backends.mysql for MySQL.
+# DATABASE_REPLICAS lists read replicas separated by commas: host[:port] entries for MySQL/PostgreSQL, database file
+# paths for SQLite (a copy of the primary file can stand in for a replica). Catalog reads go to the replicas and
+# everything else to the primary (see catalog/routers.py).
+# Connections are kept open for DATABASE_CONN_MAX_AGE seconds and checked before being reused.
+
+DATABASE_ENGINE = os.getenv('DATABASE_ENGINE', 'django.db.backends.sqlite3')
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'ENGINE': DATABASE_ENGINE,
+        'NAME': os.getenv('DATABASE_NAME', BASE_DIR / 'db.sqlite3'),
+        'USER': os.getenv('DATABASE_USER', ''),
+        'PASSWORD': os.getenv('DATABASE_PASSWORD', ''),
+        'HOST': os.getenv('DATABASE_HOST', ''),
+        'PORT': os.getenv('DATABASE_PORT', ''),
+        'CONN_MAX_AGE': int(os.getenv('DATABASE_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'charset': 'utf8mb4'} if DATABASE_ENGINE == 'django.db.backends.mysql' else {},
     }
 }
 
+for number, replica in enumerate(filter(None, os.getenv('DATABASE_REPLICAS', '').split(',')), start=1):
+    if DATABASE_ENGINE == 'django.db.backends.sqlite3':
+        location = {'NAME': replica.strip()}
+    else:
+        host, _, port = replica.strip().partition(':')
+        location = {'HOST': host, 'PORT': port or DATABASES['default']['PORT']}
+    # Tests read the replicas through the test primary.
+    DATABASES[f'replica{number}'] = {**DATABASES['default'], **location, 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['catalog.routers.PrimaryReplicaRouter']
+
+# Which models are read from the replicas, and how long a user's reads stick to the primary after a write.
+CATALOG_DATABASE_ROUTING = {
+    'STICKY_SECONDS': int(os.getenv('CATALOG_DATABASE_STICKY_SECONDS', 5)),
+}
+
+
+# Caches
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# The catalog page cache is invalidated by model signals, so with several worker processes it must live in a shared
+# backend (e.g. CATALOG_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache, CATALOG_CACHE_LOCATION=redis://...).
+
+LOCMEM_CACHE = 'django.core.cache.backends.locmem.LocMemCache'
+CATALOG_CACHE_BACKEND = os.getenv('CATALOG_CACHE_BACKEND', LOCMEM_CACHE)
+
+# Whether the catalog caches are shared by every worker process. The per-process LocMemCache (and DummyCache) is not:
+# a session flushed or a user changed in one worker would stay valid in the memory of the others.
+CATALOG_SHARED_CACHE = CATALOG_CACHE_BACKEND not in (LOCMEM_CACHE, 'django.core.cache.backends.dummy.DummyCache')
+
+
+def catalog_cache(location, key_prefix='', max_entries=None):
+    """
+    Returns the configuration of a cache of the CATALOG_CACHE_BACKEND. max_entries only bounds a LocMemCache: other
+    backends take their OPTIONS as client arguments and bound their memory themselves.
+    """
+    config = {
+        'BACKEND': CATALOG_CACHE_BACKEND,
+        'LOCATION': os.getenv('CATALOG_CACHE_LOCATION', location),
+        'KEY_PREFIX': key_prefix,
+    }
+    if max_entries and CATALOG_CACHE_BACKEND == LOCMEM_CACHE:
+        config['OPTIONS'] = {'MAX_ENTRIES': max_entries}
+    return config
+
+
+CACHES = {
+    'default': {
+        'BACKEND': LOCMEM_CACHE,
+    },
+    'catalog': catalog_cache('catalog'),
+    'sessions': catalog_cache('sessions', key_prefix='sessions', max_entries=10000),
+    # Bounds the number of users kept in memory.
+    'users': catalog_cache('users', key_prefix='users', max_entries=5000),
+}
+
+CATALOG_CACHE_ALIAS = 'catalog'
+
+# With a shared cache, sessions are served from the 'sessions' cache and written to the database behind it (see
+# catalog/sessions.py); otherwise they are read from the database on every request.
+SESSION_ENGINE = 'catalog.sessions' if CATALOG_SHARED_CACHE else 'django.contrib.sessions.backends.db'
+SESSION_CACHE_ALIAS = 'sessions'
+CATALOG_SESSIONS = {
+    'WRITE_BEHIND': os.getenv('CATALOG_SESSIONS_WRITE_BEHIND', 'true').lower() == 'true',
+}
+
+# With a shared cache, request.user is loaded from the 'users' cache (see catalog/auth_backends.py). Sessions created
+# before the cached backend was enabled name ModelBackend, which stays listed so they remain valid; sessions created
+# through the cached backend end (their users log in again) if the shared cache is removed.
+AUTHENTICATION_BACKENDS = [
+    *(['catalog.auth_backends.CachedModelBackend'] if CATALOG_SHARED_CACHE else []),
+    'django.contrib.auth.backends.ModelBackend',
+]
+CATALOG_USER_CACHE_ALIAS = 'users'
+CATALOG_USER_CACHE_TIMEOUT = 300
+
+# Lifetime of cached catalog pages in seconds; unset means they are kept until a model change invalidates them.
+CATALOG_PAGE_CACHE_TIMEOUT = (
+    int(os.environ['CATALOG_PAGE_CACHE_TIMEOUT']) if os.getenv('CATALOG_PAGE_CACHE_TIMEOUT') else None
+)
+
+# Release identifier (e.g. the deployed commit) mixed into the catalog pages' ETags, so a deploy changing the templates
+# invalidates the pages browsers and CDNs hold (see catalog/conditional.py).
+CATALOG_RELEASE = os.getenv('CATALOG_RELEASE', '')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -110,6 +222,20 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.0/howto/static-files/
 
 STATIC_URL = '/static/'
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# collectstatic writes content-hashed, pre-compressed copies of the static files (see catalog/staticfiles.py).
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'catalog.staticfiles.CompressedManifestStaticFilesStorage',
+    },
+}
+
+# Serve the collected static files from Django itself, when no web server such as nginx sits in front of it.
+CATALOG_SERVE_STATIC = os.getenv('CATALOG_SERVE_STATIC', 'false').lower() == 'true'
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
@@ -121,3 +247,83 @@ MEDIA_URL = '/media/'
 
 LOGIN_REDIRECT_URL = 'home'
 LOGOUT_REDIRECT_URL = 'home'
+
+# Serve the read-heavy catalog views natively async (see catalog/async_views.py). They are opt-in, under ASGI too:
+# set CATALOG_ASYNC_VIEWS=true to enable them.
+CATALOG_ASYNC_VIEWS = os.getenv('CATALOG_ASYNC_VIEWS', 'false').lower() == 'true'
+
+# Catalog search backend: 'auto' uses SQLite FTS5 when available and the built-in inverted index otherwise.
+CATALOG_SEARCH_BACKEND = os.getenv('CATALOG_SEARCH_BACKEND', 'auto')
+
+# Default and maximum number of rows per page for the keyset-paginated catalog listings.
+CATALOG_PAGE_SIZE = int(os.getenv('CATALOG_PAGE_SIZE', 24))
+CATALOG_MAX_PAGE_SIZE = int(os.getenv('CATALOG_MAX_PAGE_SIZE', 100))
+
+# Buffered search history writer (see catalog/search_log.py).
+CATALOG_SEARCH_LOG = {
+    'ENABLED': os.getenv('CATALOG_SEARCH_LOG_ENABLED', 'true').lower() == 'true',
+    'MAX_SIZE': 10000,
+    'FLUSH_SIZE': 200,
+    'FLUSH_INTERVAL': 5.0,
+    'OVERFLOW': 'drop_oldest',
+    # Seconds a search waits for room in a full buffer with the 'block' overflow policy.
+    'BLOCK_TIMEOUT': 1.0,
+    # Seconds within which a repeated query increments the user's previous record instead of adding one.
+    'COLLAPSE_WINDOW': 600,
+    # Retention applied by `python manage.py archive_search_history` (see catalog/search_retention.py).
+    'MAX_PER_USER': 1000,
+    'MAX_AGE_DAYS': 365,
+    'ARCHIVE_DIR': BASE_DIR / 'search_history_archive',
+}
+
+# Faceted filtering of the item list (see catalog/facets.py).
+CATALOG_FACETS = {
+    # Facet counts of a filter combination are cached once it was requested this many times within the window.
+    'CACHE_AFTER': 2,
+    'POPULAR_WINDOW': 3600,
+    'CACHE_TIMEOUT': 300,
+    # Bands listed in the band facet, besides the selected ones.
+    'MAX_BAND_OPTIONS': 20,
+    # Values accepted per repeated filter parameter.
+    'MAX_VALUES': 20,
+}
+
+# Maximum number of ratings accepted by one request to the batch rating endpoint.
+CATALOG_MAX_RATING_BATCH = 100
+
+# In-process prefix index of the search-as-you-type suggestions (see catalog/autocomplete.py).
+CATALOG_AUTOCOMPLETE = {
+    'LIMIT': 8,
+    'MAX_LIMIT': 20,
+    # Seconds after which the index is rebuilt in the background, refreshing popularity and other processes' changes.
+    'MAX_AGE': int(os.getenv('CATALOG_AUTOCOMPLETE_MAX_AGE', 600)),
+    'SEARCH_WINDOW_DAYS': 30,
+}
+
+# Item-to-item recommendations computed by `python manage.py compute_recommendations` (see catalog/recommendations.py).
+CATALOG_RECOMMENDATIONS = {
+    'TOP_K': 8,
+    'SHRINKAGE': 5,
+    # Most similarity entries held in memory at once.
+    'MAX_PAIRS': 5_000_000,
+}
+
+# Hourly and daily search rollups behind the trending and zero-result reports at /stats/searches/ (see
+# catalog/search_analytics.py).
+CATALOG_SEARCH_ANALYTICS = {
+    # Hourly rollups older than this are deleted by `python manage.py rollup_searches`.
+    'HOURLY_RETENTION_DAYS': 14,
+    'REPORT_CACHE_TIMEOUT': 60,
+    'REPORT_LIMIT': 20,
+}
+
+# Per-request SQL and latency instrumentation (see catalog/instrumentation.py), readable at /stats/requests/.
+CATALOG_INSTRUMENTATION = {
+    'ENABLED': os.getenv('CATALOG_INSTRUMENTATION_ENABLED', 'true').lower() == 'true',
+    # Fraction of requests measured, from 0.0 to 1.0.
+    'SAMPLE_RATE': float(os.getenv('CATALOG_INSTRUMENTATION_SAMPLE_RATE', 1.0)),
+    # Add Server-Timing and X-Query-Count headers to measured responses.
+    'RESPONSE_HEADER': os.getenv('CATALOG_INSTRUMENTATION_HEADER', 'false').lower() == 'true',
+    'REPEAT_THRESHOLD': 5,
+    'MAX_PATTERNS': 10,
+}